@@ -1,23 +1,57 @@
 import streamlit as st
 import bcrypt
 import pandas as pd
+import pyarrow as pa
 from datetime import datetime, timedelta, date
 import uuid
+import itertools
+from collections import namedtuple
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
-import pyodbc
+import time
+import math
+import string
 import sqlite3
-import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 
-def get_auth_connection():
-    return sqlite3.connect("auth.db")
+from streamlit.errors import StreamlitAPIException
 
-def init_auth_database():
-    conn = get_auth_connection()
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import filestore
+from storage import get_backend, frame_dtypes, ensure_schema, migrate, SQLITE, INVOICE_LEDGER_SQL, CRM_TABLES, CUSTOMER_PROGRESS_REBUILD_SQL, CircuitOpenError
+
+def get_auth_connection():
+    return sqlite3.connect(os.environ.get("AUTH_DB_PATH", "auth.db"))
+
+# Change sequence for the notifications table, bumped by triggers on every
+# write from any connection, so pollers can tell whether anything changed
+# with a single primary-key read (see get_notification_seq).
+CHANGE_SEQ_SQL = '''
+    CREATE TABLE IF NOT EXISTS change_seq (
+        name TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO change_seq (name, seq) VALUES ('notifications', 0);
+    CREATE TRIGGER IF NOT EXISTS notifications_seq_insert AFTER INSERT ON notifications
+    BEGIN UPDATE change_seq SET seq = seq + 1 WHERE name = 'notifications'; END;
+    CREATE TRIGGER IF NOT EXISTS notifications_seq_update AFTER UPDATE ON notifications
+    BEGIN UPDATE change_seq SET seq = seq + 1 WHERE name = 'notifications'; END;
+    CREATE TRIGGER IF NOT EXISTS notifications_seq_delete AFTER DELETE ON notifications
+    BEGIN UPDATE change_seq SET seq = seq + 1 WHERE name = 'notifications'; END;
+'''
+
+def create_auth_schema(conn):
+    """Create the auth.db tables and triggers on an open connection (seed_data.py uses this too)."""
     cursor = conn.cursor()
 
+    # Only takes effect on a new, empty auth.db; existing files are
+    # converted once with `python manage.py compact-auth`
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
     # Users table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -56,6 +90,19 @@ def init_auth_database():
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
+    cursor.executescript(CHANGE_SEQ_SQL)
+    ensure_notification_keys(conn)
+    cursor.execute(NOTIFICATION_ARCHIVE_SQL)
+    conn.commit()
+
+def init_auth_database():
+    conn = get_auth_connection()
+    cursor = conn.cursor()
+    create_auth_schema(conn)
+
+    # Indexes from storage.AUTH_INDEXES
+    for version in migrate(conn, SQLITE, 'auth'):
+        print(f"auth.db migration {version} applied ✅")
 
     # Ensure default admin user
     cursor.execute("SELECT COUNT(*) FROM users WHERE role='admin'")
@@ -74,50 +121,88 @@ def init_auth_database():
 
 
 def get_connection():
-    """Create and return a SQL Server connection with fallback options."""
-    
-    # Database credentials
-    server = "14.224.227.37"
-    port = "1434"
-    database = "SlinerNB"
-    username = "SlinerOwner"
-    password = "Sliner!19870310"
-    
-    # Try different connection approaches based on environment
-    connection_attempts = []
-    
-    # For Mac/Windows (local development)
-    if platform.system() in ['Darwin', 'Windows']:
-        connection_attempts = [
-            f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password}",
-            f"DRIVER={{ODBC Driver 18 for SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password}",
-            f"DRIVER={{SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password}"
-        ]
-    
-    # For Linux (Render deployment)
-    else:
-        connection_attempts = [
-            f"DRIVER={{FreeTDS}};SERVER={server};PORT={port};DATABASE={database};UID={username};PWD={password};TDS_Version=8.0",
-            f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password}",
-            f"SERVER={server},{port};DATABASE={database};UID={username};PWD={password}"
-        ]
-    
-    # Try each connection string
-    for conn_str in connection_attempts:
-        try:
-            print(f"Attempting connection with: {conn_str.split(';')[0]}...")
-            conn = pyodbc.connect(conn_str)
-            print("✅ Connection successful!")
-            return conn
-        except pyodbc.Error as e:
-            print(f"❌ Failed: {e}")
-            continue
-    
-    # If all attempts fail
-    raise Exception(f"Could not connect to database. Tried {len(connection_attempts)} different approaches.")
+    """Return a connection to the CRM database on the configured backend (see storage.py)."""
+    return get_backend().connect()
+
+
+def q(identifier):
+    """Quote a column/table name for the CRM backend's dialect (e.g. Group)."""
+    return get_backend().dialect.quote(identifier)
+
+
 def get_crm_connection():
     """Get connection to CRM database (SQL Server)"""
-    return get_connection()  # Uses your existing SQL Server connection
+    return get_connection()  # Uses the configured CRM backend
+
+
+# ---------- Query batches (SQL Server) ----------
+# Loaders that need several independent reads hand them to query_batch as
+# named statements. SQL Server gets them as one batch, one round trip, and
+# the result sets are read back with cursor.nextset(). SQLite is in-process,
+# so there they run one after another inside a single read transaction,
+# which gives every statement the same snapshot.
+MAX_SQL_PARAMS = 2000  # SQL Server allows 2100 parameters per statement or batch
+
+def query_batch(statements, conn=None):
+    """
+    Run {name: (sql, params)} and return {name: DataFrame}. Uses `conn` if
+    given (the caller owns its transaction), else a connection of its own.
+    Statements must not contain ';' followed by a newline. On SQL Server,
+    statements are split over several batches when their params together
+    exceed MAX_SQL_PARAMS.
+    """
+    def frame(cursor):
+        columns = [column[0] for column in cursor.description]
+        return pd.DataFrame.from_records([tuple(row) for row in cursor.fetchall()], columns=columns)
+
+    own = conn is None
+    if own:
+        conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        if not get_backend().dialect.multiple_result_sets:
+            if own:
+                cursor.execute("BEGIN")
+            frames = {}
+            for name, (sql, params) in statements.items():
+                cursor.execute(sql, params)
+                frames[name] = frame(cursor)
+            if own:
+                conn.rollback()  # read-only, nothing to keep
+            return frames
+
+        # Group consecutive statements into batches that stay under the parameter limit
+        batches, batch, batch_params = [], [], 0
+        for name, (_, params) in statements.items():
+            if batch and batch_params + len(params) > MAX_SQL_PARAMS:
+                batches.append(batch)
+                batch, batch_params = [], 0
+            batch.append(name)
+            batch_params += len(params)
+        batches.append(batch)
+
+        frames = {}
+        for batch in batches:
+            # NOCOUNT stops row counts arriving as result sets of their own
+            cursor.execute("SET NOCOUNT ON;\n" + ";\n".join(statements[name][0] for name in batch),
+                           [param for name in batch for param in statements[name][1]])
+            results = []
+            while True:
+                if cursor.description:
+                    results.append(frame(cursor))
+                if not cursor.nextset():
+                    break
+            if len(results) != len(batch):
+                raise RuntimeError(f"Expected {len(batch)} result sets, got {len(results)}")
+            frames.update(zip(batch, results))
+        return frames
+    finally:
+        if own:
+            conn.close()
+
+# Tables the app added on top of the original SQL Server schema; init_database
+# creates them there if missing (embedded backends create every table)
+APP_TABLES = ['CRM_CustomerProgress', 'CRM_DocumentFiles', 'CRM_Sequences', 'CRM_RevenueRollup', 'CRM_Watermarks']
 
 def init_database():
     max_retries = 2
@@ -125,8 +210,21 @@ def init_database():
     for attempt in range(max_retries):
         try:
             conn = get_connection()
+            if get_backend().embedded:
+                # Embedded backends create the CRM schema on connect; logins live in auth.db
+                conn.close()
+                print("Embedded CRM database ready!")
+                return True
             cursor = conn.cursor()
 
+            # ---- Ensure derived tables exist and indexes are migrated (see storage.py) ----
+            try:
+                ensure_schema(conn, get_backend().dialect, {name: CRM_TABLES[name] for name in APP_TABLES}, indexes={})
+                for version in migrate(conn, get_backend().dialect, 'crm'):
+                    print(f"CRM migration {version} applied ✅")
+            except Exception as e:
+                print(f"⚠️ Could not create derived tables/indexes: {e}")
+
             # ---- Ensure default admin user exists ----
             cursor.execute("SELECT COUNT(*) FROM Users WHERE role = 'admin'")
             admin_count = cursor.fetchone()[0]
@@ -146,6 +244,10 @@ def init_database():
             print("Database initialized successfully!")
             return True
 
+        except CircuitOpenError as e:
+            print(f"Skipping database init, {e}")
+            return False
+
         except Exception as e:
             print(f"Database connection/init error on attempt {attempt + 1}: {e}")
 
@@ -183,6 +285,316 @@ def authenticate_user(email, password):
         return {'id': user[0], 'email': email, 'role': user[2], 'name': user[3]}
     return None
 
+# ---------- Compact DataFrames ----------
+# Loader output dtypes: schema-driven categoricals/nullable ints, plus the
+# auth.db columns merged in by the loaders.
+FRAME_DTYPES = {
+    **frame_dtypes(),
+    'status': 'category',
+    'assigned_to': 'category',
+    'assigned_name': 'category',
+    'responsible_name': 'category',
+    'updated_by_name': 'category',
+    'approved': 'int8',
+}
+
+def compact_frame(df, name=None):
+    """
+    Convert a loader's DataFrame to FRAME_DTYPES in place of object columns.
+    With `name`, also records its size for this session's memory report.
+    """
+    for column, dtype in FRAME_DTYPES.items():
+        if column in df.columns and str(df[column].dtype) != dtype:
+            try:
+                df[column] = df[column].astype(dtype)
+            except (TypeError, ValueError):
+                pass  # leave mixed/unexpected values as they are
+    if name:
+        record_frame_memory(name, df)
+    return df
+
+def record_frame_memory(name, df):
+    """Remember how many bytes the latest `name` frame takes in this session."""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return  # called outside a Streamlit session (scripts, benchmarks)
+    st.session_state.setdefault('frame_memory', {})[name] = int(df.memory_usage(deep=True).sum())
+
+# ---------- Columnar reads ----------
+# pd.read_sql_query fetches every row as a tuple, copies them into an object
+# array and only then builds columns. Large list reads go through read_frame
+# instead: FETCH_BATCH_ROWS rows at a time from cursor.fetchmany(), each
+# batch turned straight into Arrow columns, so only one batch of row objects
+# is alive at once. FRAME_DTYPES categoricals and nullable ints are built in
+# Arrow too, rather than from object columns afterwards.
+FETCH_BATCH_ROWS = int(os.environ.get("FETCH_BATCH_ROWS", "1000"))
+
+def arrow_batch(rows, names):
+    """One fetchmany() batch as an Arrow table (decimals as floats, like read_sql_query)."""
+    arrays = []
+    for values in zip(*rows):
+        array = pa.array(values, from_pandas=True)
+        if pa.types.is_decimal(array.type):
+            array = array.cast(pa.float64())
+        arrays.append(array)
+    return pa.table(arrays, names=names)
+
+def typed_table(table, dtypes):
+    """Apply `dtypes` ('category', 'Int32', ...) to an Arrow table's columns where they fit."""
+    for i, name in enumerate(table.column_names):
+        column = table.column(i)
+        try:
+            if dtypes.get(name) == 'category' and pa.types.is_string(column.type):
+                table = table.set_column(i, name, column.dictionary_encode())
+            elif dtypes.get(name) == 'Int32' and pa.types.is_integer(column.type):
+                table = table.set_column(i, name, column.cast(pa.int32()))
+        except pa.ArrowInvalid:
+            pass  # out-of-range values: leave the column as read
+    return table.unify_dictionaries()
+
+def read_frame(sql, conn, params=None, dtypes=None, batch_rows=FETCH_BATCH_ROWS):
+    """
+    pd.read_sql_query(sql, conn, params) read in fetchmany() batches through
+    Arrow, with `dtypes` (e.g. FRAME_DTYPES) applied on the way. Batches
+    Arrow can't type (mixed values in one column, which SQLite allows) are
+    read row-wise and the result concatenated.
+    """
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(sql, params)
+    else:
+        cursor.execute(sql)
+    names = [column[0] for column in cursor.description]
+
+    tables, frames = [], []
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            break
+        if not frames:
+            try:
+                tables.append(arrow_batch(rows, names))
+                continue
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                pass
+        frames.append(pd.DataFrame.from_records([tuple(row) for row in rows], columns=names, coerce_float=True))
+    if not tables and not frames:
+        return pd.DataFrame(columns=names)
+
+    if tables:
+        try:
+            table = pa.concat_tables(tables, promote_options='permissive')
+            parts = [typed_table(table, dtypes or {}).to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get)]
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            parts = [table.to_pandas() for table in tables]  # batches typed differently
+        frames = parts + frames
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+# ---------- Shared snapshots ----------
+# The customer and service tables are loaded once per process into read-only
+# Arrow tables that every session reads from, instead of one copy per session.
+SNAPSHOT_TTL = float(os.environ.get("SNAPSHOT_TTL", "60"))
+
+Snapshot = namedtuple('Snapshot', 'version generation loaded_at table approved_rows pending_rows assignee_rows')
+
+class SnapshotStore:
+    """
+    Versioned, process-wide Arrow snapshots of the large CRM datasets.
+
+    Rows are sorted approved-first and grouped by assignee, so every role's
+    view is one contiguous, zero-copy slice of the shared table. A refresh
+    (TTL expiry or invalidate() after a write) builds a new snapshot and swaps
+    it in with a single assignment; sessions still reading the old one keep a
+    consistent view until they ask again.
+    """
+
+    def __init__(self, loaders, ttl=SNAPSHOT_TTL):
+        self.loaders = loaders
+        self.ttl = ttl
+        self._snapshots = {}
+        self._generations = {name: 0 for name in loaders}
+        self._locks = {name: threading.Lock() for name in loaders}
+
+    def _is_fresh(self, name, snapshot):
+        return (snapshot is not None
+                and snapshot.generation == self._generations[name]
+                and time.monotonic() - snapshot.loaded_at < self.ttl)
+
+    def get(self, name):
+        snapshot = self._snapshots.get(name)
+        if self._is_fresh(name, snapshot):
+            return snapshot
+        # One session rebuilds; the others wait for it rather than loading their own copy
+        with self._locks[name]:
+            snapshot = self._snapshots.get(name)
+            if not self._is_fresh(name, snapshot):
+                snapshot = self._build(name, snapshot.version + 1 if snapshot else 1)
+                self._snapshots[name] = snapshot
+        return snapshot
+
+    def invalidate(self, *names):
+        """Mark datasets stale after a write; the next read rebuilds them."""
+        for name in names or self.loaders:
+            if name in self._generations:
+                self._generations[name] += 1
+
+    def _build(self, name, version):
+        generation = self._generations[name]
+        df = self.loaders[name]()
+        if df.empty:
+            return Snapshot(version, generation, time.monotonic(), None, (0, 0), (0, 0), {})
+
+        df = df.sort_values(['approved', 'assigned_to'], ascending=[False, True],
+                            kind='stable', na_position='last').reset_index(drop=True)
+        approved_count = int((df['approved'] == 1).sum())
+
+        # (offset, length) of each assignee's approved rows
+        assignee_rows = {}
+        offset = 0
+        for assignee, group in itertools.groupby(df['assigned_to'].iloc[:approved_count].tolist()):
+            length = sum(1 for _ in group)
+            if not pd.isna(assignee):
+                assignee_rows[assignee] = (offset, length)
+            offset += length
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        print(f"Snapshot '{name}' v{version}: {table.num_rows} rows, {table.nbytes / (1024 * 1024):.1f} MB")
+        return Snapshot(version, generation, time.monotonic(), table,
+                        (0, approved_count), (approved_count, len(df) - approved_count), assignee_rows)
+
+@st.cache_resource
+def get_snapshot_store():
+    return SnapshotStore({'customers': load_customers_frame, 'services': load_services_frame})
+
+def invalidate_snapshots(*names):
+    """Mark list datasets stale after a write: their snapshots and cached row details."""
+    get_snapshot_store().invalidate(*names)
+    get_detail_cache().invalidate(*names)
+    get_customer_360_cache().invalidate()
+
+def snapshot_view(name, user_id=None, user_role=None, pending=False):
+    """
+    This user's rows of a shared snapshot as a DataFrame: approved rows for
+    admins, approved rows assigned to `user_id` otherwise, or unapproved rows
+    with `pending`. Slicing is zero-copy; conversion reuses the Arrow buffers
+    wherever pandas can (numerics, dictionary-encoded categoricals). The
+    snapshot's version is in df.attrs['snapshot_version'].
+    """
+    snapshot = get_snapshot_store().get(name)
+    if snapshot.table is None:
+        return pd.DataFrame()
+
+    if pending:
+        offset, length = snapshot.pending_rows
+    elif user_role == 'admin':
+        offset, length = snapshot.approved_rows
+    else:
+        offset, length = snapshot.assignee_rows.get(user_id, (0, 0))
+
+    df = snapshot.table.slice(offset, length).to_pandas(split_blocks=True)
+    df.attrs['snapshot_version'] = snapshot.version
+    record_frame_memory(f"{name} (pending)" if pending else name, df)
+    return df
+
+# ---------- List projections & row details ----------
+# List queries fetch only the columns a collapsed row shows (its label, the
+# filters, the pickers). Contacts, addresses, descriptions and notes are loaded
+# when an expander is opened, for that row and its neighbours in one query.
+DETAIL_BATCH_SIZE = int(os.environ.get("DETAIL_BATCH_SIZE", "25"))
+
+CUSTOMER_LIST_COLUMNS = ['CustomerID', 'CompanyName', 'Group', 'Country', 'CustomerCategory', 'AccountManager']
+SERVICE_LIST_COLUMNS = ['ServiceID', 'CustomerID', 'ServiceType', 'StartDate', 'ExpectedEndDate', 'Status']
+
+# dataset -> (SELECT ... FROM ..., key column); the first selected column is the key
+DETAIL_SOURCES = {
+    'customers': ('''
+        SELECT CustomerID, TaxCode, Address, CompanyType, Industry, Source, CreatedDate,
+               ContactPerson1, ContactEmail1, ContactPhone1,
+               ContactPerson2, ContactEmail2, ContactPhone2
+        FROM CRM_Customers
+    ''', 'CustomerID'),
+    'services': ('''
+        SELECT ServiceID, Description, PackageCode, Partner, PaymentType
+        FROM CRM_Services
+    ''', 'ServiceID'),
+    'payments': ('''
+        SELECT p.PaymentID, p.TypeOfPayment, p.PaidAmount, p.Currency, p.Exrate, p.PaidAmountUSD,
+               p.ReceivedAccount, p.InvoiceID, p.Notes, s.PaymentType
+        FROM CRM_Payments p
+        LEFT JOIN CRM_Invoice i ON p.InvoiceID = i.InvoiceCode
+        LEFT JOIN CRM_Services s ON i.ServiceID = s.ServiceID
+    ''', 'p.PaymentID'),
+}
+
+class DetailCache:
+    """
+    Process-wide cache of list-row details, keyed by dataset and row ID.
+
+    Missing IDs are fetched with one IN (...) query per chunk, so opening a row
+    loads its whole batch and reopening any of them costs nothing. A dataset's
+    entries are dropped after SNAPSHOT_TTL or when invalidate() is called after
+    a write; a fetch that overlaps an invalidation is served but not cached.
+    """
+
+    CHUNK_SIZE = 500  # well under SQL Server's 2100-parameter limit
+
+    def __init__(self, sources, ttl=SNAPSHOT_TTL):
+        self.sources = sources
+        self.ttl = ttl
+        self._rows = {name: {} for name in sources}
+        self._loaded_at = {name: time.monotonic() for name in sources}
+        self._generations = {name: 0 for name in sources}
+        self._lock = threading.Lock()
+
+    def get_many(self, name, ids):
+        with self._lock:
+            if time.monotonic() - self._loaded_at[name] >= self.ttl:
+                self._rows[name] = {}
+                self._loaded_at[name] = time.monotonic()
+            rows = self._rows[name]
+            generation = self._generations[name]
+
+        missing = [row_id for row_id in dict.fromkeys(ids) if row_id not in rows]
+        fetched = self._fetch(name, missing) if missing else {}
+        if fetched:
+            with self._lock:
+                if self._generations[name] == generation:
+                    rows.update(fetched)
+        return {row_id: fetched.get(row_id, rows.get(row_id, {})) for row_id in ids}
+
+    def invalidate(self, *names):
+        with self._lock:
+            for name in names or self.sources:
+                if name in self._rows:
+                    self._rows[name] = {}
+                    self._generations[name] += 1
+
+    def _fetch(self, name, ids):
+        select_sql, key = self.sources[name]
+        fetched = {row_id: {} for row_id in ids}
+        conn = get_connection()
+        try:
+            for start in range(0, len(ids), self.CHUNK_SIZE):
+                chunk = ids[start:start + self.CHUNK_SIZE]
+                placeholders = ', '.join('?' * len(chunk))
+                df = pd.read_sql_query(f"{select_sql} WHERE {key} IN ({placeholders})", conn, params=list(chunk))
+                id_col = df.columns[0]
+                for row in df.to_dict('records'):
+                    fetched[row[id_col]] = row
+        except Exception as e:
+            print(f"Error fetching {name} details: {e}")
+            fetched = {}  # nothing cached, so the next open retries
+        finally:
+            conn.close()
+        return fetched
+
+@st.cache_resource
+def get_detail_cache():
+    return DetailCache(DETAIL_SOURCES)
+
+def load_details(name, ids):
+    """Detail columns of these list rows as {row ID: {column: value}}, batched and cached."""
+    return get_detail_cache().get_many(name, list(ids))
+
 # ---------- Users (SQLite auth.db) ----------
 def get_all_users():
     conn = get_connection()  # Use SQL Server connection
@@ -222,20 +634,26 @@ def add_user(email, password, role, name):
         print(f"Error adding user: {e}")
         return False
 
-def get_customer_groups():
-    conn = get_connection()  # Use SQL Server connection, not auth
-    df = pd.read_sql_query('SELECT DISTINCT [Group] FROM CRM_Customers ORDER BY [Group]', conn)
-    conn.close()
-    return df
+def get_customer_field_options():
+    """Existing Group, Source and AccountManager values for the add-customer form, in one batch."""
+    return query_batch({
+        'Group': (f'SELECT DISTINCT {q("Group")} FROM CRM_Customers ORDER BY {q("Group")}', []),
+        'Source': ('SELECT DISTINCT Source FROM CRM_Customers WHERE Source IS NOT NULL ORDER BY Source', []),
+        'AccountManager': ('SELECT DISTINCT AccountManager FROM CRM_Customers '
+                           'WHERE AccountManager IS NOT NULL ORDER BY AccountManager', []),
+    })
 
-def get_customers_enhanced(user_id=None, user_role=None):
+def load_customers_frame():
     """
-    Fetch customers from CRM_Customers and enrich with CRM_Users data
+    All customers from CRM_Customers (list columns only, see CUSTOMER_LIST_COLUMNS),
+    enriched with CRM_Users names and the auth.db approval/status meta.
+    No role filtering (see get_customers_enhanced).
     """
     # Get customers from SQL Server
     crm_conn = get_connection()
     try:
-        crm_df = pd.read_sql_query('SELECT * FROM CRM_Customers', crm_conn)
+        columns = ', '.join(q(c) for c in CUSTOMER_LIST_COLUMNS)
+        crm_df = read_frame(f'SELECT {columns} FROM CRM_Customers', crm_conn, dtypes=FRAME_DTYPES)
         
         # Get users from SQL Server CRM_Users table
         users_df = pd.read_sql_query('SELECT UserID, Name FROM CRM_Users', crm_conn)
@@ -272,46 +690,18 @@ def get_customers_enhanced(user_id=None, user_role=None):
     df['approved'] = df['approved'].fillna(0).astype(int)
     df['status'] = df['status'].fillna('Chưa bắt đầu')
 
-    # Filter by role
-    if user_role == 'admin':
-        df_filtered = df[df['approved'] == 1]
-    else:
-        df_filtered = df[(df['assigned_to'] == user_id) & (df['approved'] == 1)]
+    return compact_frame(df)
 
-    return df_filtered.reset_index(drop=True)
+def get_customers_enhanced(user_id=None, user_role=None):
+    """
+    Approved customers visible to this user (admins: all, others: assigned to them),
+    as a view of the shared customer snapshot.
+    """
+    return snapshot_view('customers', user_id, user_role)
 
 def get_pending_customers():
-    crm_conn = get_connection()  # Use get_connection() not get_crm_connection()
-    try:
-        crm_df = pd.read_sql_query('SELECT * FROM CRM_Customers', crm_conn)
-        users_df = pd.read_sql_query('SELECT UserID, Name FROM CRM_Users', crm_conn)
-    except Exception:
-        crm_df = pd.DataFrame()
-        users_df = pd.DataFrame(columns=['UserID','Name'])
-    crm_conn.close()
-
-    auth_conn = get_auth_connection()
-    try:
-        meta_df = pd.read_sql_query('SELECT CustomerID, assigned_to, status, approved FROM customer_meta', auth_conn)
-    except Exception:
-        meta_df = pd.DataFrame(columns=['CustomerID','assigned_to','status','approved'])
-    auth_conn.close()
-
-    if crm_df.empty:
-        return crm_df
-
-    df = crm_df.merge(meta_df, on='CustomerID', how='left')
-    
-    # Map AccountManager to user names
-    if not users_df.empty:
-        account_manager_map = dict(zip(users_df['UserID'], users_df['Name']))
-        df['assigned_name'] = df['AccountManager'].map(account_manager_map)
-    else:
-        df['assigned_name'] = None
-        
-    df['approved'] = df['approved'].fillna(0).astype(int)
-    pending = df[df['approved'] == 0].reset_index(drop=True)
-    return pending
+    """Customers still waiting for admin approval, from the shared customer snapshot."""
+    return snapshot_view('customers', pending=True)
 
 def approve_customer(customer_id):
     """Approve customer by updating the approved flag in SQLite auth.db"""
@@ -335,12 +725,13 @@ def approve_customer(customer_id):
         print(f"Created new customer_meta record for {customer_id}")
     
     # Clear any pending approval notifications for this customer
-    cursor.execute('UPDATE notifications SET [read] = 1 WHERE related_id = ? AND type = ?', 
+    cursor.execute("UPDATE notifications SET [read] = 1 WHERE related_id = ? AND type IN (?, 'approval_stale')",
                   (customer_id, 'customer_approval'))
     
     auth_conn.commit()
     auth_conn.close()
-    
+    invalidate_snapshots('customers', 'services')
+
     print(f"Customer {customer_id} approved successfully!")
     
 def update_customer_status(customer_id, new_status):
@@ -361,15 +752,161 @@ def update_customer_status(customer_id, new_status):
 
     conn.commit()
     conn.close()
+    invalidate_snapshots('customers', 'services')
     return True
 
+# Columns the customer grid may write back to CRM_Customers
+CUSTOMER_EDITABLE_COLUMNS = [
+    'CompanyName', 'TaxCode', 'Address', 'Industry',
+    'ContactPerson1', 'ContactEmail1', 'ContactPhone1',
+    'ContactPerson2', 'ContactEmail2', 'ContactPhone2',
+]
+
+def diff_customer_edits(original_df, edited_rows):
+    """
+    Turn st.data_editor's `edited_rows` ({row position: {column: value}}) into
+    a list of (CustomerID, {column: new value}) holding only cells that really changed.
+    """
+    changes = []
+    for position, cells in edited_rows.items():
+        row = original_df.iloc[int(position)]
+        changed = {
+            col: value for col, value in cells.items()
+            if col in CUSTOMER_EDITABLE_COLUMNS and not (pd.isna(row[col]) and value in (None, '')) and value != row[col]
+        }
+        if changed:
+            changes.append((row['CustomerID'], changed))
+    return changes
+
+def update_customers_batch(changes):
+    """
+    Write diffed customer edits back in one transaction. Rows that changed the
+    same set of columns share one UPDATE statement sent with executemany.
+    Returns the number of customers updated.
+    """
+    if not changes:
+        return 0
+
+    statements = {}
+    for customer_id, changed in changes:
+        columns = tuple(sorted(changed))
+        statements.setdefault(columns, []).append(tuple(changed[c] for c in columns) + (customer_id,))
+
+    crm_conn = get_connection()
+    try:
+        cursor = crm_conn.cursor()
+        if hasattr(cursor, 'fast_executemany'):
+            cursor.fast_executemany = True  # pyodbc: send parameter arrays in one round trip
+        for columns, params in statements.items():
+            assignments = ", ".join(f"{q(c)} = ?" for c in columns)
+            cursor.executemany(f"UPDATE CRM_Customers SET {assignments} WHERE CustomerID = ?", params)
+        crm_conn.commit()
+    except Exception:
+        crm_conn.rollback()
+        raise
+    finally:
+        crm_conn.close()
+    invalidate_snapshots('customers', 'services')
+    return len(changes)
+
+# ---------- ID allocation (SQL Server) ----------
+# New IDs are prefix + zero-padded sequence number (DV00001234). Each process
+# reserves ID_BLOCK_SIZE numbers at a time from CRM_Sequences with one UPDATE
+# and hands them out from memory, so IDs are unique across processes without
+# a round trip per insert. Numbers left in a block when a process exits are
+# skipped, never reused.
+ID_BLOCK_SIZE = int(os.environ.get("ID_BLOCK_SIZE", "100"))
+ID_DIGITS = 8
+
+# sequence -> (prefix, table, column); the column seeds a new sequence past existing IDs
+ID_SEQUENCES = {
+    'service': ('DV', 'CRM_Services', 'ServiceID'),
+    'task': ('CV', 'WorkProgress', 'TaskID'),
+    'invoice': ('INV', 'CRM_Payments', 'InvoiceID'),
+    'document': ('DOC', 'ClientDocuments', 'DocumentID'),
+}
+
+class IdAllocator:
+    """hi/lo sequence numbers: blocks reserved in the database, values handed out from memory."""
+
+    def __init__(self, connect, block_size=ID_BLOCK_SIZE):
+        self.connect = connect
+        self.block_size = block_size
+        self._blocks = {}  # name -> [next value, end of block)
+        self._lock = threading.Lock()
+
+    def next_value(self, name):
+        with self._lock:
+            block = self._blocks.get(name)
+            if block is None or block[0] >= block[1]:
+                block = self._blocks[name] = list(self._reserve(name))
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def _reserve(self, name):
+        """Claim the next block of `name` in one transaction. Returns (first, end)."""
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            for _ in range(3):
+                cursor.execute('UPDATE CRM_Sequences SET NextValue = NextValue + ? WHERE Name = ?',
+                               (self.block_size, name))
+                if cursor.rowcount == 1:
+                    # The UPDATE holds the row lock, so this reads our own increment
+                    cursor.execute('SELECT NextValue FROM CRM_Sequences WHERE Name = ?', (name,))
+                    end = cursor.fetchone()[0]
+                    conn.commit()
+                    return end - self.block_size, end
+                conn.rollback()
+                first = self._first_value(cursor, name)  # read errors propagate rather than seed 1
+                try:
+                    cursor.execute('INSERT INTO CRM_Sequences (Name, NextValue) VALUES (?, ?)', (name, first))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()  # another process created it first; reserve from theirs
+            raise RuntimeError(f"Could not reserve IDs for sequence '{name}'")
+        finally:
+            conn.close()
+
+    def _first_value(self, cursor, name):
+        """
+        One past the highest number among existing prefix + digits IDs (1 if
+        there are none). Compared as numbers, so longer IDs count, and IDs with
+        other suffixes (DV-OLD) are skipped as they can't collide.
+        """
+        if name not in ID_SEQUENCES:
+            return 1
+        prefix, table, column = ID_SEQUENCES[name]
+        condition, params = get_backend().dialect.prefix_match(column, prefix)
+        cursor.execute(f'SELECT {column} FROM {table} WHERE {condition}', params)
+        highest = 0
+        while True:
+            rows = cursor.fetchmany(FETCH_BATCH_ROWS)
+            if not rows:
+                return highest + 1
+            for (value,) in rows:
+                suffix = value[len(prefix):]
+                if suffix.isascii() and suffix.isdigit():
+                    highest = max(highest, int(suffix))
+
+@st.cache_resource
+def get_id_allocator():
+    """Process-wide allocator, so sessions share the reserved blocks."""
+    return IdAllocator(get_connection)
+
+def next_id(sequence):
+    """New ID for one of ID_SEQUENCES, e.g. next_id('service') -> 'DV00001234'."""
+    prefix = ID_SEQUENCES[sequence][0]
+    return f"{prefix}{get_id_allocator().next_value(sequence):0{ID_DIGITS}d}"
+
 # ---------- Service management (SQL Server) ----------
 def add_service(customer_id, service_type, description, start_date, expected_end_date, package_code, partner):
     """Add service to CRM_Services table using correct columns"""
     crm_conn = get_connection()
     crm_cursor = crm_conn.cursor()
     
-    service_id = f"DV{str(uuid.uuid4())[:6].upper()}"
+    service_id = next_id('service')
     
     # FIXED: Using actual CRM_Services columns
     crm_cursor.execute('''
@@ -379,6 +916,7 @@ def add_service(customer_id, service_type, description, start_date, expected_end
     
     crm_conn.commit()
     crm_conn.close()
+    invalidate_snapshots('services')
     return service_id
 
 def get_services_by_customer(customer_id):
@@ -392,18 +930,21 @@ def get_services_by_customer(customer_id):
     return df
 
 
-def get_all_services(user_id=None, user_role=None):
+def load_services_frame():
     """
-    Fetch services from CRM_Services and enrich with customer data
+    All services from CRM_Services (list columns only, see SERVICE_LIST_COLUMNS)
+    joined to their customer and enriched with auth.db meta and assignee names.
+    No role filtering (see get_all_services).
     """
     crm_conn = get_connection()
     try:
         # FIXED: Using correct table names
-        services_df = pd.read_sql_query('''
-            SELECT s.*, c.CompanyName 
+        columns = ', '.join(f's.{c}' for c in SERVICE_LIST_COLUMNS)
+        services_df = read_frame(f'''
+            SELECT {columns}, c.CompanyName
             FROM CRM_Services s
             JOIN CRM_Customers c ON s.CustomerID = c.CustomerID
-        ''', crm_conn)
+        ''', crm_conn, dtypes=FRAME_DTYPES)
     except Exception as e:
         print(f"Error fetching services: {e}")
         services_df = pd.DataFrame()
@@ -435,28 +976,34 @@ def get_all_services(user_id=None, user_role=None):
     df['approved'] = df['approved'].fillna(0).astype(int)
     df['status'] = df['status'].fillna('Chưa bắt đầu')
 
-    # Filter by role
-    if user_role == 'admin':
-        df_filtered = df[df['approved'] == 1]
-    else:
-        df_filtered = df[(df['assigned_to'] == user_id) & (df['approved'] == 1)]
+    return compact_frame(df)
+
+def get_all_services(user_id=None, user_role=None):
+    """Services of approved customers visible to this user, from the shared service snapshot."""
+    return snapshot_view('services', user_id, user_role)
 
-    return df_filtered.reset_index(drop=True)
 
 # ---------- Payment Progress (SQL Server) ----------
 def add_work_task(service_id, task_name, task_description, start_date, expected_end_date, updated_by):
     crm_conn = get_crm_connection()
     crm_cursor = crm_conn.cursor()
     
-    task_id = f"CV{str(uuid.uuid4())[:6].upper()}"
+    task_id = next_id('task')
     
     crm_cursor.execute('''
         INSERT INTO WorkProgress (TaskID, ServiceID, TaskName, TaskDescription, StartDate, ExpectedEndDate, UpdatedBy, LastUpdated)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     ''', (task_id, service_id, task_name, task_description, start_date, expected_end_date, updated_by, datetime.now().date()))
-    
+
+    # New tasks start not completed at 0%
+    crm_cursor.execute('SELECT CustomerID FROM CRM_Services WHERE ServiceID = ?', (service_id,))
+    row = crm_cursor.fetchone()
+    if row:
+        apply_progress_delta(crm_cursor, row[0], tasks=1)
+
     crm_conn.commit()
     crm_conn.close()
+    get_customer_360_cache().invalidate()
     return task_id
 
 
@@ -466,12 +1013,12 @@ def get_work_progress(user_id=None, user_role=None):
     """
     crm_conn = get_crm_connection()
     try:
-        wp_df = pd.read_sql_query('''
+        wp_df = read_frame('''
             SELECT wp.*, s.ServiceType, s.CustomerID, c.CompanyName
             FROM WorkProgress wp
-            JOIN Services s ON wp.ServiceID = s.ServiceID
-            JOIN Customers c ON s.CustomerID = c.CustomerID
-        ''', crm_conn)
+            JOIN CRM_Services s ON wp.ServiceID = s.ServiceID
+            JOIN CRM_Customers c ON s.CustomerID = c.CustomerID
+        ''', crm_conn, dtypes=FRAME_DTYPES)
     except Exception:
         wp_df = pd.DataFrame()
     crm_conn.close()
@@ -508,7 +1055,7 @@ def get_work_progress(user_id=None, user_role=None):
     else:
         df_filtered = df[(df['assigned_to'] == user_id) & (df['approved'] == 1)]
 
-    return df_filtered.reset_index(drop=True)
+    return compact_frame(df_filtered.reset_index(drop=True), 'work_progress')
 
 
 def update_task_status(task_id, new_status, progress, updated_by, notes=""):
@@ -518,13 +1065,319 @@ def update_task_status(task_id, new_status, progress, updated_by, notes=""):
     crm_conn = get_crm_connection()
     cursor = crm_conn.cursor()
     last_updated = datetime.now().date()
+
+    # Old values, to move the customer's progress aggregate by the difference
+    cursor.execute('''
+        SELECT wp.Status, wp.Progress, s.CustomerID
+        FROM WorkProgress wp
+        JOIN CRM_Services s ON wp.ServiceID = s.ServiceID
+        WHERE wp.TaskID = ?
+    ''', (task_id,))
+    old = cursor.fetchone()
+
     cursor.execute('''
         UPDATE WorkProgress
         SET Status = ?, Progress = ?, UpdatedBy = ?, Notes = ?, LastUpdated = ?
         WHERE TaskID = ?
     ''', (new_status, progress, updated_by, notes, last_updated, task_id))
+
+    if old:
+        old_status, old_progress, customer_id = old
+        apply_progress_delta(
+            cursor, customer_id,
+            completed=(new_status == TASK_DONE_STATUS) - (old_status == TASK_DONE_STATUS),
+            progress=(progress or 0) - (old_progress or 0),
+        )
     crm_conn.commit()
     crm_conn.close()
+    get_customer_360_cache().invalidate()
+
+
+# ---------- Customer progress aggregates (SQL Server) ----------
+# CRM_CustomerProgress holds per-customer task totals so the dashboard reads
+# one row per customer instead of scanning WorkProgress. Task writes apply
+# their delta in the same transaction; rebuild_customer_progress() recomputes
+# everything (python manage.py rebuild-progress).
+def apply_progress_delta(cursor, customer_id, tasks=0, completed=0, progress=0):
+    """Add a task write's change to the customer's aggregate row, creating it if missing."""
+    update = '''
+        UPDATE CRM_CustomerProgress
+        SET TotalTasks = TotalTasks + ?, CompletedTasks = CompletedTasks + ?, ProgressSum = ProgressSum + ?
+        WHERE CustomerID = ?
+    '''
+    cursor.execute(update, (tasks, completed, progress, customer_id))
+    if cursor.rowcount == 0:
+        # No row yet (first task, or the table was never built): count this customer from source
+        cursor.execute(get_backend().dialect.insert_missing_sql(
+            'CRM_CustomerProgress', ['CustomerID', 'TotalTasks', 'CompletedTasks', 'ProgressSum'], 'CustomerID', '''
+            SELECT s.CustomerID AS CustomerID, COUNT(*) AS TotalTasks,
+                   SUM(CASE WHEN wp.Status = ? THEN 1 ELSE 0 END) AS CompletedTasks,
+                   SUM(COALESCE(wp.Progress, 0)) AS ProgressSum
+            FROM WorkProgress wp
+            JOIN CRM_Services s ON wp.ServiceID = s.ServiceID
+            WHERE s.CustomerID = ?
+            GROUP BY s.CustomerID
+        '''), (TASK_DONE_STATUS, customer_id))
+        if cursor.rowcount == 0:
+            # A concurrent first write created the row in between; add this change to it
+            cursor.execute(update, (tasks, completed, progress, customer_id))
+
+
+def rebuild_customer_progress():
+    """Recompute CRM_CustomerProgress from WorkProgress in one transaction. Returns the row count."""
+    crm_conn = get_crm_connection()
+    ensure_schema(crm_conn, get_backend().dialect, {'CRM_CustomerProgress': CRM_TABLES['CRM_CustomerProgress']})
+    cursor = crm_conn.cursor()
+    try:
+        cursor.execute('DELETE FROM CRM_CustomerProgress')
+        cursor.execute(CUSTOMER_PROGRESS_REBUILD_SQL, (TASK_DONE_STATUS,))
+        crm_conn.commit()
+        cursor.execute('SELECT COUNT(*) FROM CRM_CustomerProgress')
+        return cursor.fetchone()[0]
+    except Exception:
+        crm_conn.rollback()
+        raise
+    finally:
+        crm_conn.close()
+
+
+CUSTOMER_PROGRESS_SQL = '''
+    SELECT p.CustomerID, c.CompanyName, p.TotalTasks, p.CompletedTasks,
+           CASE WHEN p.TotalTasks > 0 THEN p.ProgressSum * 1.0 / p.TotalTasks END AS AvgProgress
+    FROM CRM_CustomerProgress p
+    JOIN CRM_Customers c ON p.CustomerID = c.CustomerID
+    WHERE p.TotalTasks > 0
+    ORDER BY p.CustomerID
+'''
+
+def get_customer_progress():
+    """Per-customer task totals and average progress, read from CRM_CustomerProgress."""
+    conn = get_connection()
+    df = pd.read_sql_query(CUSTOMER_PROGRESS_SQL, conn)
+    conn.close()
+    return df
+
+# ---------- Task board (SQL Server) ----------
+# Board and overdue queries are shaped to the WorkProgress indexes in
+# storage.CRM_INDEXES, so they stay index reads as the table grows.
+TASK_STATUSES = ['Chưa bắt đầu', 'Đang thực hiện', 'Hoàn thành']
+TASK_DONE_STATUS = 'Hoàn thành'
+TASK_PAGE_SIZE = int(os.environ.get("TASK_PAGE_SIZE", "20"))
+OVERDUE_LIMIT = 50
+
+def in_clause(column, values, dialect=None):
+    """
+    `column IN (...)` and its params. Very long lists are inlined as literals
+    instead, to stay under the backend's parameter limit. `dialect` is the
+    database the clause runs on (default: the CRM backend; SQLITE for auth.db).
+    """
+    if len(values) > MAX_SQL_PARAMS:
+        dialect = dialect or get_backend().dialect
+        return f"{column} IN ({', '.join(dialect.literal(v) for v in values)})", []
+    return f"{column} IN ({', '.join('?' * len(values))})", list(values)
+
+def task_scope(user_id, user_role):
+    """
+    WHERE conditions (and params) limiting WorkProgress to this user's tasks:
+    none for admins, their services otherwise. None if they have no services.
+    """
+    if user_role == 'admin':
+        return [], []
+    services_df = get_all_services(user_id, user_role)
+    if services_df.empty:
+        return None
+    condition, params = in_clause('wp.ServiceID', services_df['ServiceID'].tolist())
+    return [condition], params
+
+def task_counts_query(scope):
+    """(sql, params) counting tasks per status within a task_scope()."""
+    conditions, params = scope
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f'''
+        SELECT wp.Status, COUNT(*) AS TaskCount
+        FROM WorkProgress wp
+        {where}
+        GROUP BY wp.Status
+    ''', params
+
+def task_counts(df):
+    """{status: count} from a task_counts_query() result."""
+    return {status: int(count) for status, count in zip(df['Status'], df['TaskCount']) if status is not None}
+
+def task_page_query(status, page, scope, page_size=TASK_PAGE_SIZE):
+    """(sql, params) for one page of a board column within a task_scope()."""
+    conditions, params = scope
+    where = ' AND '.join(['wp.Status = ?'] + conditions)
+    return f'''
+        SELECT wp.TaskID, wp.ServiceID, wp.TaskName, wp.StartDate, wp.ExpectedEndDate,
+               wp.Status, wp.Progress, wp.Notes, wp.LastUpdated,
+               CASE WHEN wp.ExpectedEndDate < ? THEN 1 ELSE 0 END AS PastDue,
+               s.ServiceType, c.CompanyName
+        FROM WorkProgress wp
+        LEFT JOIN CRM_Services s ON wp.ServiceID = s.ServiceID
+        LEFT JOIN CRM_Customers c ON s.CustomerID = c.CustomerID
+        WHERE {where}
+        ORDER BY wp.ExpectedEndDate, wp.TaskID
+    ''' + get_backend().dialect.paginate(page_size, page * page_size), [datetime.now().date(), status] + params
+
+def overdue_tasks_query(scope, limit=OVERDUE_LIMIT):
+    """(sql, params) for unfinished tasks past their expected end date within a task_scope()."""
+    conditions, params = scope
+    where = ' AND '.join(['wp.ExpectedEndDate < ?', '(wp.Status IS NULL OR wp.Status <> ?)'] + conditions)
+    return f'''
+        SELECT wp.TaskID, wp.TaskName, wp.Status, wp.LastUpdated, wp.ExpectedEndDate
+        FROM WorkProgress wp
+        WHERE {where}
+        ORDER BY wp.ExpectedEndDate
+    ''' + get_backend().dialect.paginate(limit), [datetime.now().date(), TASK_DONE_STATUS] + params
+
+def get_task_counts(user_id=None, user_role=None):
+    """{status: number of tasks} on this user's board."""
+    scope = task_scope(user_id, user_role)
+    if scope is None:
+        return {}
+    sql, params = task_counts_query(scope)
+    conn = get_connection()
+    df = pd.read_sql_query(sql, conn, params=params)
+    conn.close()
+    return task_counts(df)
+
+def get_task_page(status, page, user_id=None, user_role=None, page_size=TASK_PAGE_SIZE):
+    """
+    One page of a board column: tasks with this status, earliest due date
+    first, read in IX_WorkProgress_Status_Due order (or per service for users).
+    """
+    scope = task_scope(user_id, user_role)
+    if scope is None:
+        return pd.DataFrame()
+    sql, params = task_page_query(status, page, scope, page_size)
+    conn = get_connection()
+    df = pd.read_sql_query(sql, conn, params=params)
+    conn.close()
+    return df
+
+def get_overdue_tasks(limit=OVERDUE_LIMIT, user_id=None, user_role='admin'):
+    """
+    Unfinished tasks past their expected end date, most overdue first. One
+    range scan of IX_WorkProgress_Due (ExpectedEndDate < today), stopping at `limit`.
+    """
+    scope = task_scope(user_id, user_role)
+    if scope is None:
+        return pd.DataFrame(columns=['TaskID', 'TaskName', 'Status', 'LastUpdated', 'ExpectedEndDate'])
+    sql, params = overdue_tasks_query(scope, limit)
+    conn = get_connection()
+    df = pd.read_sql_query(sql, conn, params=params)
+    conn.close()
+    return df
+
+# ---------- Type-ahead search (SQL Server) ----------
+# Pickers send what the user typed to the server and get back at most
+# PICKER_LIMIT matches: ID and company-name prefixes first, one query per
+# column so each is an index range read in index order, then names
+# containing the text to fill the list.
+PICKER_LIMIT = int(os.environ.get("PICKER_LIMIT", "20"))
+
+def assigned_customer_ids(user_id):
+    """Approved customers assigned to this user (auth.db, IX_customer_meta_assigned)."""
+    auth_conn = get_auth_connection()
+    rows = auth_conn.execute('SELECT CustomerID FROM customer_meta WHERE assigned_to = ? AND approved = 1',
+                             (user_id,)).fetchall()
+    auth_conn.close()
+    return [row[0] for row in rows]
+
+def approved_customer_ids(customer_ids):
+    """The approved subset of customer_ids (auth.db primary key lookups)."""
+    if not customer_ids:
+        return set()
+    condition, params = in_clause('CustomerID', list(customer_ids), SQLITE)
+    auth_conn = get_auth_connection()
+    rows = auth_conn.execute(f'SELECT CustomerID FROM customer_meta WHERE approved = 1 AND {condition}',
+                             params).fetchall()
+    auth_conn.close()
+    return {row[0] for row in rows}
+
+def search_rows(select_sql, key, text, prefix_columns, contains_columns, customer_col,
+                user_id=None, user_role=None, limit=PICKER_LIMIT, filters=None):
+    """
+    Up to `limit` rows of select_sql matching `text`: prefix matches on each
+    of prefix_columns ((column, uppercase the text?) pairs) in that column's
+    order, then contains matches on contains_columns in `key` order. Rows
+    are limited to customers this user may see: assigned ones in the query
+    for users, approved ones checked per page for admins. `filters` is a
+    (conditions, params) pair every row must also meet.
+    """
+    dialect = get_backend().dialect
+    scope, scope_params = filters or ([], [])
+    scope, scope_params = list(scope), list(scope_params)
+    if user_role != 'admin':
+        ids = assigned_customer_ids(user_id)
+        if not ids:
+            return pd.DataFrame()
+        condition, params = in_clause(customer_col, ids)
+        scope.append(condition)
+        scope_params += params
+
+    text = text.strip()
+    if not text:
+        passes = [([], [], key)]
+    else:
+        passes = []
+        for column, upper in prefix_columns:
+            condition, params = dialect.prefix_match(column, text.upper() if upper else text)
+            passes.append(([condition], params, f"{column}, {key}" if column != key else key))
+        conditions, params = [], []
+        for column, upper in contains_columns:
+            condition, condition_params = dialect.contains_match(column, text.upper() if upper else text)
+            conditions.append(condition)
+            params += condition_params
+        passes.append((["(" + " OR ".join(conditions) + ")"], params, key))
+
+    key_col, customer_key = key.split('.')[-1], customer_col.split('.')[-1]
+    frames, seen = [], set()
+    conn = get_connection()
+    try:
+        for conditions, params, order_by in passes:
+            where = " AND ".join(scope + conditions) or "1 = 1"
+            # Rows already shown or of pending customers are dropped, so page on
+            # until the list is full (a bounded number of pages)
+            for page in range(5):
+                if len(seen) >= limit:
+                    break
+                df = pd.read_sql_query(f"{select_sql} WHERE {where} ORDER BY {order_by}" + dialect.paginate(limit, page * limit),
+                                       conn, params=scope_params + params)
+                fetched = len(df)
+                df = df[~df[key_col].isin(seen)]
+                if user_role == 'admin' and not df.empty:
+                    df = df[df[customer_key].isin(approved_customer_ids(set(df[customer_key])))]
+                frames.append(df)
+                seen.update(df[key_col])
+                if fetched < limit:
+                    break
+    finally:
+        conn.close()
+    return pd.concat(frames, ignore_index=True).head(limit)
+
+def search_customers(text, user_id=None, user_role=None, limit=PICKER_LIMIT):
+    """Customers for a picker: CustomerID / CompanyName prefix, then CompanyName contains."""
+    return search_rows('SELECT c.CustomerID, c.CompanyName FROM CRM_Customers c', 'c.CustomerID', text,
+                       [('c.CustomerID', True), ('c.CompanyName', False)], [('c.CompanyName', False)],
+                       'c.CustomerID', user_id, user_role, limit)
+
+def search_services(text, user_id=None, user_role=None, limit=PICKER_LIMIT):
+    """Services for a picker: ServiceID / CustomerID / CompanyName prefix, then CompanyName contains."""
+    return search_rows('''SELECT s.ServiceID, s.ServiceType, s.CustomerID, c.CompanyName
+                          FROM CRM_Services s JOIN CRM_Customers c ON s.CustomerID = c.CustomerID''',
+                       's.ServiceID', text,
+                       [('s.ServiceID', True), ('s.CustomerID', True), ('c.CompanyName', False)],
+                       [('c.CompanyName', False)], 'c.CustomerID', user_id, user_role, limit)
+
+def search_invoices(text, service_id, user_id=None, user_role=None, limit=PICKER_LIMIT):
+    """Invoices of one service for a picker, within the user's customers: InvoiceID prefix, then contains."""
+    return search_rows('''SELECT i.InvoiceID, s.CustomerID
+                          FROM CRM_Payments i JOIN CRM_Services s ON i.ServiceID = s.ServiceID''',
+                       'i.InvoiceID', text, [('i.InvoiceID', True)], [('i.InvoiceID', True)],
+                       's.CustomerID', user_id, user_role, limit,
+                       filters=(['i.ServiceID = ?', 'i.AmountUSD IS NOT NULL'], [service_id]))
 
 # ---------- Invoice (SQL Server) ----------
 def add_invoice(service_id, customer_id, amount_original, currency, due_date, notes=""):
@@ -532,8 +1385,8 @@ def add_invoice(service_id, customer_id, amount_original, currency, due_date, no
     crm_conn = get_connection()
     cursor = crm_conn.cursor()
     
-    invoice_id = f"INV{str(uuid.uuid4())[:6].upper()}"
-    invoice_code = f"CODE{str(uuid.uuid4())[:4].upper()}"
+    invoice_id = next_id('invoice')
+    invoice_code = f"CODE{invoice_id[len('INV'):]}"
     invoice_date = datetime.now().date()
     
     # Convert to USD if needed (you'll need exchange rates)
@@ -587,6 +1440,380 @@ def update_payment(invoice_id, first_amount=None, first_date=None, second_amount
     crm_conn.close()
 
 
+# ---------- Invoice ledger (SQL Server) ----------
+# The invoice row (the CRM_Payments row with AmountUSD) keeps OutstandingUSD
+# and Status current: each payment subtracts its PaidAmountUSD in the same
+# transaction as its insert. rebuild_invoice_ledger() recomputes every
+# invoice from its payments and verify_invoice_ledger() lists the ones that
+# disagree (python manage.py rebuild-ledger / verify-ledger).
+INVOICE_PAID = 'Paid'
+INVOICE_PARTIAL = 'Partially Paid'
+INVOICE_PENDING = 'Pending'
+LEDGER_TOLERANCE = 0.005  # half a cent: balances within this count as settled
+LEDGER_PARAMS = (LEDGER_TOLERANCE, INVOICE_PAID, INVOICE_PARTIAL, INVOICE_PENDING)
+
+# Stored invoice row `i` disagrees with ledger row `l` (tolerance parameter)
+LEDGER_MISMATCH = '''(i.OutstandingUSD IS NULL OR ABS(i.OutstandingUSD - l.OutstandingUSD) > ?
+                      OR COALESCE(i.Status, '') <> l.Status)'''
+
+def apply_invoice_payment(cursor, invoice_id, paid_usd):
+    """Take a payment off its invoice's balance. Returns the invoice's (OutstandingUSD, Status), or None."""
+    cursor.execute('''
+        UPDATE CRM_Payments
+        SET OutstandingUSD = OutstandingUSD - ?,
+            Status = CASE WHEN OutstandingUSD - ? <= ? THEN ? ELSE ? END
+        WHERE InvoiceID = ? AND AmountUSD IS NOT NULL AND OutstandingUSD IS NOT NULL
+    ''', (paid_usd, paid_usd, LEDGER_TOLERANCE, INVOICE_PAID, INVOICE_PARTIAL, invoice_id))
+    if cursor.rowcount == 0:
+        # No balance yet (or no invoice row): compute this invoice from its payments
+        cursor.execute(INVOICE_LEDGER_SQL.format(where="AND i.InvoiceID = ?"), LEDGER_PARAMS + (invoice_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute('''
+            UPDATE CRM_Payments SET OutstandingUSD = ?, Status = ?
+            WHERE InvoiceID = ? AND AmountUSD IS NOT NULL
+        ''', (row[1], row[2], invoice_id))
+    cursor.execute('''
+        SELECT OutstandingUSD, Status FROM CRM_Payments
+        WHERE InvoiceID = ? AND AmountUSD IS NOT NULL
+    ''', (invoice_id,))
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+def add_payment(invoice_id, payment_date, type_of_payment, paid_amount, currency, exrate,
+                payer_name, received_account, notes, payment_type, service_id=None):
+    """
+    Record a payment against an invoice (of service_id, if given) and update
+    the invoice's balance in the same transaction. Returns the invoice's (OutstandingUSD, Status), or
+    None if there is no invoice row for invoice_id.
+    """
+    paid_amount_usd = paid_amount / exrate if currency != 'USD' else paid_amount
+    crm_conn = get_connection()
+    cursor = crm_conn.cursor()
+    try:
+        cursor.execute('''
+            INSERT INTO CRM_Payments
+            (PaymentDate, TypeOfPayment, PaidAmount, Currency, Exrate, PayerName,
+            ReceivedAccount, Notes, InvoiceID, PaidAmountUSD, PaymentType, ServiceID)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (payment_date, type_of_payment, paid_amount, currency, exrate, payer_name,
+              received_account, notes, invoice_id, paid_amount_usd, payment_type, service_id))
+        balance = apply_invoice_payment(cursor, invoice_id, paid_amount_usd)
+        crm_conn.commit()
+    except Exception:
+        crm_conn.rollback()
+        raise
+    finally:
+        crm_conn.close()
+    invalidate_snapshots('payments')
+    return balance
+
+def rebuild_invoice_ledger():
+    """
+    Recompute every invoice's OutstandingUSD and Status from its payments, set
+    based, in one transaction. Only invoices that disagree are written;
+    returns their count.
+    """
+    dialect = get_backend().dialect
+    ledger = dialect.temp_table('invoice_ledger')
+    crm_conn = get_crm_connection()
+    cursor = crm_conn.cursor()
+    try:
+        cursor.execute(f"CREATE TABLE {ledger} (InvoiceID {dialect.types['key']} PRIMARY KEY, "
+                       f"OutstandingUSD {dialect.types['real']}, Status {dialect.types['text']})")
+        cursor.execute(f"INSERT INTO {ledger} (InvoiceID, OutstandingUSD, Status) "
+                       + INVOICE_LEDGER_SQL.format(where=""), LEDGER_PARAMS)
+        lookup = f"SELECT {{column}} FROM {ledger} l WHERE l.InvoiceID = CRM_Payments.InvoiceID"
+        cursor.execute(f'''
+            UPDATE CRM_Payments
+            SET OutstandingUSD = ({lookup.format(column='l.OutstandingUSD')}),
+                Status = ({lookup.format(column='l.Status')})
+            WHERE AmountUSD IS NOT NULL AND EXISTS (
+                SELECT 1 FROM {ledger} l, CRM_Payments i
+                WHERE l.InvoiceID = CRM_Payments.InvoiceID AND i.PaymentID = CRM_Payments.PaymentID
+                  AND {LEDGER_MISMATCH})
+        ''', (LEDGER_TOLERANCE,))
+        corrected = max(cursor.rowcount, 0)
+        crm_conn.commit()
+    except Exception:
+        crm_conn.rollback()
+        raise
+    finally:
+        drop_temp_table(cursor, dialect, ledger)
+        crm_conn.close()
+    invalidate_snapshots('payments')
+    return corrected
+
+def verify_invoice_ledger(limit=None):
+    """Invoices whose stored balance or status disagrees with their payments (all of them, or the first `limit`)."""
+    dialect = get_backend().dialect
+    conn = get_connection()
+    df = pd.read_sql_query(f'''
+        SELECT i.InvoiceID, i.OutstandingUSD AS StoredOutstandingUSD, l.OutstandingUSD AS OutstandingUSD,
+               i.Status AS StoredStatus, l.Status
+        FROM CRM_Payments i
+        JOIN ({INVOICE_LEDGER_SQL.format(where="")}) l ON l.InvoiceID = i.InvoiceID
+        WHERE i.AmountUSD IS NOT NULL AND {LEDGER_MISMATCH}
+        ORDER BY i.InvoiceID
+    ''' + (dialect.paginate(limit) if limit else ""), conn, params=LEDGER_PARAMS + (LEDGER_TOLERANCE,))
+    conn.close()
+    return df
+
+
+# ---------- Revenue rollups (SQL Server) ----------
+# CRM_RevenueRollup holds paid revenue at month x customer group x country x
+# service type x account manager, so the revenue report reads a few thousand
+# pre-summed rows instead of joining every payment. refresh_revenue_rollups()
+# folds in payments with a PaymentID past the 'revenue_rollup' watermark
+# (CRM_Watermarks). Payments are attributed to the customer's attributes at
+# refresh time; edits to old payments, deleted customers or a reassigned
+# account manager need a rebuild (python manage.py refresh-rollups --rebuild).
+#
+# An IDENTITY value is taken when a payment is inserted, not when it
+# commits, so MAX(PaymentID) can pass a payment whose transaction is still
+# open. Folding up to it would skip that payment for good. Instead each
+# refresh records the MAX(PaymentID) it saw ('revenue_rollup_seen') and only
+# folds up to a mark seen at least ROLLUP_SETTLE_SECONDS earlier, by when
+# every transaction that took a lower ID has finished. New payments
+# therefore reach the rollup one settle period (and a refresh) later.
+ROLLUP_WATERMARK = 'revenue_rollup'
+ROLLUP_SEEN = 'revenue_rollup_seen'
+ROLLUP_SETTLE_SECONDS = float(os.environ.get("ROLLUP_SETTLE_SECONDS", "60"))
+ROLLUP_DIMENSIONS = {
+    'Customer group': 'CustomerGroup',
+    'Country': 'Country',
+    'Service type': 'ServiceType',
+    'Account manager': 'AccountManager',
+}
+ROLLUP_KEYS = ['Month'] + list(ROLLUP_DIMENSIONS.values())
+
+def revenue_delta_sql(dialect):
+    """Revenue per rollup key for payments with low < PaymentID <= high (parameters low, high)."""
+    # Form payments carry only the InvoiceID: take service and customer from the invoice row
+    keys = [
+        (dialect.month_sql('p.PaymentDate'), 'Month'),
+        (f"COALESCE(c.{q('Group')}, '')", 'CustomerGroup'),
+        ("COALESCE(c.Country, '')", 'Country'),
+        ("COALESCE(s.ServiceType, '')", 'ServiceType'),
+        ("COALESCE(c.AccountManager, '')", 'AccountManager'),
+    ]
+    return f'''
+        SELECT {", ".join(f"{expr} AS {name}" for expr, name in keys)},
+               SUM(p.PaidAmountUSD) AS RevenueUSD, COUNT(*) AS Payments
+        FROM CRM_Payments p
+        LEFT JOIN CRM_Payments i ON p.ServiceID IS NULL AND i.InvoiceID = p.InvoiceID AND i.AmountUSD IS NOT NULL
+        LEFT JOIN CRM_Services s ON s.ServiceID = COALESCE(p.ServiceID, i.ServiceID)
+        LEFT JOIN CRM_Customers c ON c.CustomerID = COALESCE(p.CustomerID, i.CustomerID, s.CustomerID)
+        WHERE p.PaymentID > ? AND p.PaymentID <= ?
+          AND p.PaidAmountUSD IS NOT NULL AND p.PaymentDate IS NOT NULL
+        GROUP BY {", ".join(expr for expr, _ in keys)}
+    '''
+
+def refresh_revenue_rollups(rebuild=False, settle_seconds=None):
+    """
+    Fold settled payments past the watermark into CRM_RevenueRollup in one
+    transaction (all settled payments into an emptied rollup with
+    `rebuild`). settle_seconds overrides ROLLUP_SETTLE_SECONDS; 0 folds up to
+    the newest payment, which is only safe while nothing writes payments.
+    Returns the number of payments folded in, 0 if there were none or a
+    concurrent refresh claimed them first.
+    """
+    settle = ROLLUP_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+    dialect = get_backend().dialect
+    delta = dialect.temp_table('revenue_delta')
+    crm_conn = get_crm_connection()
+    cursor = crm_conn.cursor()
+    try:
+        now = datetime.now()
+        reads = query_batch({
+            'marks': ('SELECT Name, LastID, RefreshedAt FROM CRM_Watermarks WHERE Name IN (?, ?)',
+                      [ROLLUP_WATERMARK, ROLLUP_SEEN]),
+            'high': ('SELECT MAX(PaymentID) AS High FROM CRM_Payments', []),
+        }, crm_conn)
+        marks = {name: (int(last_id), refreshed_at) for name, last_id, refreshed_at in reads['marks'].itertuples(index=False)}
+        for name in (ROLLUP_WATERMARK, ROLLUP_SEEN):
+            if name not in marks:
+                try:
+                    cursor.execute('INSERT INTO CRM_Watermarks (Name, LastID) VALUES (?, 0)', (name,))
+                    crm_conn.commit()
+                except Exception:
+                    crm_conn.rollback()  # created by a concurrent refresh; the claims below sort it out
+        stored = marks.get(ROLLUP_WATERMARK, (0, None))[0]
+        seen, seen_at = marks.get(ROLLUP_SEEN, (0, None))
+        high = reads['high']['High'].iloc[0]
+        high = 0 if pd.isna(high) else int(high)
+
+        # Fold up to the last mark that has had time to settle
+        if settle <= 0:
+            target = high
+        elif seen_at is not None and not pd.isna(seen_at) and pd.Timestamp(seen_at) <= now - timedelta(seconds=settle):
+            target = max(seen, stored)
+        else:
+            target = stored
+        low = 0 if rebuild else stored
+
+        # Start the next settle period once the current mark is used up
+        if seen <= target < high:
+            cursor.execute('UPDATE CRM_Watermarks SET LastID = ?, RefreshedAt = ? WHERE Name = ? AND LastID = ?',
+                           (high, now, ROLLUP_SEEN, seen))
+        if target <= stored and not rebuild:
+            crm_conn.commit()
+            return 0
+
+        # Claim (low, target]: only one of two concurrent refreshes matches here
+        cursor.execute('UPDATE CRM_Watermarks SET LastID = ?, RefreshedAt = ? WHERE Name = ? AND LastID = ?',
+                       (target, now, ROLLUP_WATERMARK, stored))
+        if cursor.rowcount == 0:
+            crm_conn.rollback()
+            return 0
+        if rebuild:
+            cursor.execute('DELETE FROM CRM_RevenueRollup')
+
+        columns = ", ".join(ROLLUP_KEYS + ['RevenueUSD', 'Payments'])
+        cursor.execute(f"CREATE TABLE {delta} ("
+                       + ", ".join(f"{key} {dialect.types['text']}" for key in ROLLUP_KEYS)
+                       + f", RevenueUSD {dialect.types['real']}, Payments {dialect.types['int']})")
+        cursor.execute(f"INSERT INTO {delta} ({columns}) " + revenue_delta_sql(dialect), (low, target))
+
+        # Add onto existing rollup rows, then insert the new ones
+        match = " AND ".join(f"d.{key} = CRM_RevenueRollup.{key}" for key in ROLLUP_KEYS)
+        cursor.execute(f'''
+            UPDATE CRM_RevenueRollup
+            SET RevenueUSD = RevenueUSD + (SELECT d.RevenueUSD FROM {delta} d WHERE {match}),
+                Payments = Payments + (SELECT d.Payments FROM {delta} d WHERE {match})
+            WHERE EXISTS (SELECT 1 FROM {delta} d WHERE {match})
+        ''')
+        cursor.execute(f'''
+            INSERT INTO CRM_RevenueRollup ({columns})
+            SELECT {columns} FROM {delta} d
+            WHERE NOT EXISTS (SELECT 1 FROM CRM_RevenueRollup WHERE {match})
+        ''')
+        cursor.execute(f"SELECT COALESCE(SUM(Payments), 0) FROM {delta}")
+        folded = cursor.fetchone()[0]
+        cursor.execute(f"DROP TABLE {delta}")
+        crm_conn.commit()
+    except Exception:
+        crm_conn.rollback()
+        raise
+    finally:
+        crm_conn.close()
+    if folded:
+        print(f"📈 Revenue rollups: folded in {folded:,} payments (up to PaymentID {target})")
+    return folded
+
+def get_rollup_options():
+    """Months covered and the values of each dimension, for the report's filters (one batch)."""
+    options = query_batch({
+        column: (f"SELECT DISTINCT {column} FROM CRM_RevenueRollup ORDER BY {column}", [])
+        for column in ROLLUP_KEYS
+    })
+    return {column: df[column].tolist() for column, df in options.items()}
+
+def get_revenue_slice(split_by, filters, months):
+    """
+    RevenueUSD and Payments per month and `split_by` value (as Segment), for
+    months between months[0] and months[1] and the {column: [values]}
+    filters (empty lists don't filter).
+    """
+    conditions, params = ["Month >= ? AND Month <= ?"], list(months)
+    for column, values in filters.items():
+        if values:
+            condition, condition_params = in_clause(column, values)
+            conditions.append(condition)
+            params += condition_params
+    conn = get_connection()
+    df = pd.read_sql_query(f'''
+        SELECT Month, {split_by} AS Segment, SUM(RevenueUSD) AS RevenueUSD, SUM(Payments) AS Payments
+        FROM CRM_RevenueRollup
+        WHERE {" AND ".join(conditions)}
+        GROUP BY Month, {split_by}
+        ORDER BY Month
+    ''', conn, params=params)
+    conn.close()
+    return df
+
+
+# ---------- Customer 360 (SQL Server) ----------
+# Everything about one customer in one batch: on SQL Server the statements go
+# in a single execute() and come back as consecutive result sets, so the
+# view costs one round trip. Results are kept for CUSTOMER_360_TTL seconds
+# per customer, and dropped on any write that could change them.
+CUSTOMER_360_TTL = float(os.environ.get("CUSTOMER_360_TTL", "30"))
+
+# (section, SELECT with one ? for the CustomerID)
+CUSTOMER_360_QUERIES = [
+    ('services', '''
+        SELECT ServiceID, ServiceType, Status, StartDate, ExpectedEndDate, PackageCode, Partner
+        FROM CRM_Services WHERE CustomerID = ?
+        ORDER BY ServiceID'''),
+    ('invoices', '''
+        SELECT InvoiceID, InvoiceCode, ServiceID, InvoiceDate, DueDate, AmountUSD, OutstandingUSD, Status
+        FROM CRM_Payments WHERE CustomerID = ? AND AmountUSD IS NOT NULL
+        ORDER BY InvoiceDate DESC'''),
+    ('payments', '''
+        SELECT p.PaymentID, p.InvoiceID, p.PaymentDate, p.PaidAmount, p.Currency, p.PaidAmountUSD,
+               p.TypeOfPayment, p.PayerName
+        FROM CRM_Payments p
+        WHERE p.PaidAmountUSD IS NOT NULL AND p.InvoiceID IN (
+            SELECT InvoiceID FROM CRM_Payments WHERE CustomerID = ? AND AmountUSD IS NOT NULL)
+        ORDER BY p.PaymentDate DESC'''),
+    ('documents', '''
+        SELECT d.DocumentID, d.ServiceID, d.DocumentType, d.DocumentName, d.Status, d.CreatedDate, f.FileName
+        FROM ClientDocuments d
+        LEFT JOIN CRM_DocumentFiles f ON f.DocumentID = d.DocumentID
+        WHERE d.CustomerID = ?
+        ORDER BY d.CreatedDate DESC'''),
+    ('tasks', '''
+        SELECT wp.TaskID, wp.ServiceID, wp.TaskName, wp.Status, wp.Progress, wp.ExpectedEndDate
+        FROM WorkProgress wp
+        JOIN CRM_Services s ON wp.ServiceID = s.ServiceID
+        WHERE s.CustomerID = ?
+        ORDER BY wp.ExpectedEndDate'''),
+]
+
+class Customer360Cache:
+    """
+    Process-wide {CustomerID: {section: DataFrame}} with a short TTL. A load
+    that overlaps invalidate() is served but not cached.
+    """
+
+    def __init__(self, ttl=CUSTOMER_360_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, customer_id, load):
+        with self._lock:
+            entry = self._entries.get(customer_id)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                return entry[1]
+            generation = self._generation
+        value = load(customer_id)
+        with self._lock:
+            if self._generation == generation:
+                self._entries[customer_id] = (time.monotonic(), value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = {}
+            self._generation += 1
+
+@st.cache_resource
+def get_customer_360_cache():
+    return Customer360Cache()
+
+def load_customer_360(customer_id):
+    """{section: DataFrame} for one customer from one batch (see CUSTOMER_360_QUERIES)."""
+    return query_batch({section: (sql, [customer_id]) for section, sql in CUSTOMER_360_QUERIES})
+
+def get_customer_360(customer_id):
+    """One customer's services, invoices, payments, documents and tasks, cached for CUSTOMER_360_TTL."""
+    return get_customer_360_cache().get(customer_id, load_customer_360)
+
+
 # --------------------------
 # Document functions
 # --------------------------
@@ -597,7 +1824,7 @@ def add_document(customer_id, service_id, document_type, document_name, responsi
     crm_conn = get_crm_connection()
     cursor = crm_conn.cursor()
 
-    doc_id = f"DOC{str(uuid.uuid4())[:6].upper()}"
+    doc_id = next_id('document')
     created_date = datetime.now().date()
 
     cursor.execute('''
@@ -608,6 +1835,7 @@ def add_document(customer_id, service_id, document_type, document_name, responsi
 
     crm_conn.commit()
     crm_conn.close()
+    get_customer_360_cache().invalidate()
     return doc_id
 
 
@@ -623,10 +1851,12 @@ def get_documents(user_id=None, user_role=None):
         docs_df = pd.read_sql_query('''
             SELECT cd.DocumentID, cd.CustomerID, cd.ServiceID, cd.DocumentType, cd.DocumentName,
                    cd.ResponsiblePerson, cd.Notes, cd.Status, cd.CreatedDate,
-                   c.CompanyName, s.ServiceType
+                   c.CompanyName, s.ServiceType,
+                   f.ContentHash, f.FileName, f.ContentType, f.FileSize
             FROM ClientDocuments cd
-            JOIN Customers c ON cd.CustomerID = c.CustomerID
-            LEFT JOIN Services s ON cd.ServiceID = s.ServiceID
+            JOIN CRM_Customers c ON cd.CustomerID = c.CustomerID
+            LEFT JOIN CRM_Services s ON cd.ServiceID = s.ServiceID
+            LEFT JOIN CRM_DocumentFiles f ON cd.DocumentID = f.DocumentID
         ''', crm_conn)
     except Exception:
         docs_df = pd.DataFrame()
@@ -667,7 +1897,7 @@ def get_documents(user_id=None, user_role=None):
     else:
         df_filtered = df[(df['assigned_to'] == user_id) & (df['approved'] == 1)]
 
-    return df_filtered.reset_index(drop=True)
+    return compact_frame(df_filtered.reset_index(drop=True), 'documents')
 
 
 def update_document_status(doc_id, new_status):
@@ -679,10 +1909,42 @@ def update_document_status(doc_id, new_status):
     cursor.execute('UPDATE ClientDocuments SET Status = ? WHERE DocumentID = ?', (new_status, doc_id))
     crm_conn.commit()
     crm_conn.close()
+    get_customer_360_cache().invalidate()
     return True
 
 
-# --------------------------
+# ---------- Document files (local content-addressed store) ----------
+# File contents live on disk under their SHA-256 (filestore.py); the CRM
+# database only records the hash against the DocumentID in CRM_DocumentFiles.
+@st.cache_resource
+def get_document_store():
+    """The document file store, shared by every session in this process."""
+    return filestore.get_store()
+
+
+def attach_document_file(doc_id, fileobj, file_name, content_type=None):
+    """
+    Stream a file into the document store and record its hash against doc_id,
+    replacing any earlier file. Identical files are stored once. Returns the hash.
+    """
+    digest, size, stored = get_document_store().put(fileobj)
+
+    crm_conn = get_crm_connection()
+    cursor = crm_conn.cursor()
+    cursor.execute('DELETE FROM CRM_DocumentFiles WHERE DocumentID = ?', (doc_id,))
+    cursor.execute('''
+        INSERT INTO CRM_DocumentFiles (DocumentID, ContentHash, FileName, ContentType, FileSize, UploadedDate)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (doc_id, digest, file_name, content_type, size, datetime.now().date()))
+    crm_conn.commit()
+    crm_conn.close()
+    get_customer_360_cache().invalidate()
+
+    print(f"📎 {doc_id}: {file_name} ({size:,} bytes) {'stored' if stored else 'already in store'} as {digest[:12]}")
+    return digest
+
+
+# --------------------------
 # Notification functions (SQLite auth.db)
 # --------------------------
 def get_notifications(user_id, user_role=None):
@@ -720,6 +1982,35 @@ def get_unread_count(user_id, user_role=None):
     return count
 
 
+NOTIFICATION_POLL_SECONDS = float(os.environ.get("NOTIFICATION_POLL_SECONDS", "10"))
+
+def get_notification_seq():
+    """
+    Current change sequence of the notifications table, or None if auth.db
+    predates change tracking (callers then reload every time).
+    """
+    auth_conn = get_auth_connection()
+    try:
+        row = auth_conn.execute("SELECT seq FROM change_seq WHERE name = 'notifications'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    auth_conn.close()
+    return row[0] if row else None
+
+
+def reload_on_change(scope, seq, load):
+    """
+    Return this session's cached load() result for `scope`, calling load()
+    again only when the notifications sequence has moved since the last load.
+    """
+    cache = st.session_state.setdefault('notification_cache', {})
+    entry = cache.get(scope)
+    if entry is None or seq is None or entry[0] != seq:
+        entry = (seq, load())
+        cache[scope] = entry
+    return entry[1]
+
+
 def mark_notification_read(notification_id):
     auth_conn = get_auth_connection()
     cursor = auth_conn.cursor()
@@ -729,32 +2020,368 @@ def mark_notification_read(notification_id):
     return True
 
 
+# ---------- Notification rules (SQL Server + auth.db) ----------
+# Scheduled checks for things nobody asked about yet: invoices and services
+# coming due, approvals left pending. Each rule is one set-based query over
+# the whole table. CRM matches are streamed into a scratch table in auth.db,
+# and from there one INSERT ... SELECT addresses them to the customer's
+# assignee (admins while unassigned or unapproved). notification_keys keeps
+# one dedup key per notification raised (rule:entity:date), so reruns and
+# overlapping runs add nothing twice, even after the notification itself is
+# gone. The app runs the rules in the background at most every
+# NOTIFY_INTERVAL seconds (0 turns that off); cron can run
+# `python manage.py notify` instead.
+NOTIFY_DUE_DAYS = int(os.environ.get("NOTIFY_DUE_DAYS", "7"))
+NOTIFY_APPROVAL_DAYS = int(os.environ.get("NOTIFY_APPROVAL_DAYS", "3"))
+NOTIFY_INTERVAL = float(os.environ.get("NOTIFY_INTERVAL", "3600"))
+SERVICE_DONE_STATUS = 'Hoàn thành'
+
+NOTIFICATION_KEYS_SQL = '''
+    CREATE TABLE IF NOT EXISTS notification_keys (
+        dedup_key TEXT PRIMARY KEY,
+        notification_id TEXT NOT NULL,
+        customer_id TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+def ensure_notification_keys(conn):
+    """Create notification_keys, adding customer_id to tables made before it had one."""
+    conn.execute(NOTIFICATION_KEYS_SQL)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(notification_keys)')}
+    if 'customer_id' not in columns:
+        conn.execute('ALTER TABLE notification_keys ADD COLUMN customer_id TEXT')
+
+# rule -> (CRM query for RelatedID, CustomerID, DueDate in [today, horizon], extra params)
+CRM_NOTIFICATION_RULES = {
+    'invoice_due': ('''
+        SELECT i.InvoiceID, COALESCE(i.CustomerID, s.CustomerID), i.DueDate
+        FROM CRM_Payments i
+        LEFT JOIN CRM_Services s ON i.ServiceID = s.ServiceID
+        WHERE i.DueDate >= ? AND i.DueDate <= ?
+          AND i.AmountUSD IS NOT NULL AND i.InvoiceID IS NOT NULL
+          AND (i.Status IS NULL OR i.Status <> ?)
+    ''', [INVOICE_PAID]),
+    'service_due': ('''
+        SELECT ServiceID, CustomerID, ExpectedEndDate
+        FROM CRM_Services
+        WHERE ExpectedEndDate >= ? AND ExpectedEndDate <= ?
+          AND (Status IS NULL OR Status <> ?)
+    ''', [SERVICE_DONE_STATUS]),
+}
+
+# rule -> message, as an SQLite expression over the match row `c`; rules
+# without one get "<rule>: <related_id>"
+NOTIFICATION_MESSAGES = {
+    'invoice_due': "'Invoice ' || c.related_id || ' is due on ' || c.due_date",
+    'service_due': "'Service ' || c.related_id || ' is due to finish on ' || c.due_date",
+    'approval_stale': "'Customer ' || c.related_id || ' has been waiting for approval since ' || c.due_date",
+}
+
+# auth.db rule: customers still unapproved NOTIFY_APPROVAL_DAYS after creation
+STALE_APPROVALS_SQL = '''
+    INSERT INTO notify_matches (rule, related_id, customer_id, due_date)
+    SELECT 'approval_stale', CustomerID, CustomerID, date(created_at)
+    FROM customer_meta
+    WHERE approved = 0 AND created_at < ?
+'''
+
+# uuid4-shaped ids, generated inside the INSERT ... SELECT
+NOTIFICATION_ID_SQL = ("lower(hex(randomblob(4)) || '-' || hex(randomblob(2)) || '-4' || substr(hex(randomblob(2)), 2)"
+                       " || '-' || substr('89ab', 1 + abs(random()) % 4, 1) || substr(hex(randomblob(2)), 2)"
+                       " || '-' || hex(randomblob(6)))")
+
+def run_notification_rules(today=None):
+    """
+    Evaluate every notification rule against `today` (default: today) and
+    write the notifications not raised before. Returns {rule: added}.
+    """
+    today = today or datetime.now().date()
+    horizon = today + timedelta(days=NOTIFY_DUE_DAYS)
+    stale_before = datetime.combine(today, datetime.min.time()) - timedelta(days=NOTIFY_APPROVAL_DAYS)
+
+    auth_conn = get_auth_connection()
+    crm_conn = get_connection()
+    try:
+        ensure_notification_keys(auth_conn)
+        # Scratch rows live in auth.db's temp schema, so loading them takes no lock on auth.db itself
+        auth_conn.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS notify_matches (
+                rule TEXT, related_id TEXT, customer_id TEXT, due_date TEXT,
+                dedup_key TEXT, notification_id TEXT
+            )
+        ''')
+        auth_conn.execute('DELETE FROM notify_matches')
+
+        crm_cursor = crm_conn.cursor()
+        for rule, (sql, params) in CRM_NOTIFICATION_RULES.items():
+            crm_cursor.execute(sql, [today, horizon] + params)
+            batches = iter(lambda: crm_cursor.fetchmany(FETCH_BATCH_ROWS), [])
+            auth_conn.executemany(
+                'INSERT INTO notify_matches (rule, related_id, customer_id, due_date) VALUES (?, ?, ?, ?)',
+                ((rule, related_id, customer_id, str(due_date))
+                 for batch in batches for related_id, customer_id, due_date in batch))
+        auth_conn.execute(STALE_APPROVALS_SQL, (stale_before.strftime('%Y-%m-%d %H:%M:%S'),))
+
+        # Drop matches raised by an earlier run, then give the rest their ids
+        auth_conn.execute("UPDATE notify_matches SET dedup_key = rule || ':' || related_id || ':' || COALESCE(due_date, '')")
+        auth_conn.execute('DELETE FROM notify_matches WHERE dedup_key IN (SELECT dedup_key FROM notification_keys)')
+        auth_conn.execute(f'UPDATE notify_matches SET notification_id = {NOTIFICATION_ID_SQL}')
+        # Claim the keys; a key seen before (or twice in this run) keeps its first id.
+        # The customer goes with the key, so deleting a customer finds its notifications.
+        auth_conn.execute('''
+            INSERT OR IGNORE INTO notification_keys (dedup_key, notification_id, customer_id)
+            SELECT dedup_key, notification_id, customer_id FROM notify_matches
+        ''')
+        message = ("CASE c.rule " + " ".join(f"WHEN '{rule}' THEN {expr}" for rule, expr in NOTIFICATION_MESSAGES.items())
+                   + " ELSE c.rule || ': ' || c.related_id END")
+        auth_conn.execute(f'''
+            INSERT INTO notifications (id, user_id, message, type, related_id, created_at)
+            SELECT c.notification_id, m.assigned_to, {message}, c.rule, c.related_id, CURRENT_TIMESTAMP
+            FROM notify_matches c
+            JOIN notification_keys k ON k.dedup_key = c.dedup_key AND k.notification_id = c.notification_id
+            LEFT JOIN customer_meta m ON m.CustomerID = c.customer_id AND m.approved = 1
+        ''')
+        added = dict(auth_conn.execute('''
+            SELECT c.rule, COUNT(*) FROM notify_matches c
+            JOIN notifications n ON n.id = c.notification_id
+            GROUP BY c.rule
+        ''').fetchall())
+        auth_conn.execute('DELETE FROM notify_matches')
+        auth_conn.commit()
+    except Exception:
+        auth_conn.rollback()
+        raise
+    finally:
+        crm_conn.close()
+        auth_conn.close()
+
+    added = {rule: added.get(rule, 0) for rule in list(CRM_NOTIFICATION_RULES) + ['approval_stale']}
+    if any(added.values()):
+        print(f"🔔 Notification rules: {', '.join(f'{rule} +{count}' for rule, count in added.items())}")
+    return added
+
+@st.cache_resource
+def get_notification_schedule():
+    return {'next_run': 0.0, 'lock': threading.Lock()}
+
+def schedule_notification_rules():
+    """
+    Start a background run of the rules and the retention job if
+    NOTIFY_INTERVAL has passed since the last one in this process.
+    """
+    schedule = get_notification_schedule()
+    if NOTIFY_INTERVAL <= 0 or time.monotonic() < schedule['next_run']:
+        return
+    if not schedule['lock'].acquire(blocking=False):
+        return  # already running
+
+    def run():
+        try:
+            run_notification_rules()
+            archive_notifications()
+        except Exception as e:
+            print(f"⚠️ Notification rules failed: {e}")
+        finally:
+            schedule['next_run'] = time.monotonic() + NOTIFY_INTERVAL
+            schedule['lock'].release()
+
+    threading.Thread(target=run, name="notification-rules", daemon=True).start()
+
+
+# ---------- Notification retention (auth.db) ----------
+# Read notifications older than NOTIFICATION_RETENTION_DAYS move to
+# notifications_archive, and archived rows older than
+# NOTIFICATION_ARCHIVE_DAYS (0 keeps them) are dropped. Both go in batches
+# of ARCHIVE_BATCH_SIZE rows. Each batch is its own short BEGIN IMMEDIATE
+# transaction, with ARCHIVE_PAUSE between batches, so live sessions' reads
+# and writes get the database between batches rather than waiting for the
+# whole job. Freed pages then go back to the filesystem with
+# PRAGMA incremental_vacuum, VACUUM_PAGES at a time, on databases in
+# auto_vacuum=INCREMENTAL mode. Runs after the notification rules, or with
+# `python manage.py archive-notifications`.
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get("NOTIFICATION_RETENTION_DAYS", "30"))
+NOTIFICATION_ARCHIVE_DAYS = int(os.environ.get("NOTIFICATION_ARCHIVE_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_PAUSE = float(os.environ.get("ARCHIVE_PAUSE", "0.05"))
+VACUUM_PAGES = int(os.environ.get("VACUUM_PAGES", "500"))
+INCREMENTAL_VACUUM = 2  # PRAGMA auto_vacuum value
+
+NOTIFICATION_ARCHIVE_SQL = '''
+    CREATE TABLE IF NOT EXISTS notifications_archive (
+        id TEXT PRIMARY KEY,
+        user_id TEXT,
+        message TEXT NOT NULL,
+        type TEXT NOT NULL,
+        related_id TEXT,
+        read BOOLEAN,
+        created_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+def move_in_batches(conn, select_ids, params, statements, batch_size, pause):
+    """
+    Repeatedly load up to batch_size ids from `select_ids` into the temp
+    table batch_ids and run `statements` against it, one transaction per
+    batch, until no ids are left. Returns the number of ids handled.
+    """
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS batch_ids (id TEXT PRIMARY KEY)')
+    done = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM batch_ids')
+            count = conn.execute(f'INSERT INTO batch_ids (id) {select_ids} LIMIT ?', params + [batch_size]).rowcount
+            for statement in statements:
+                conn.execute(statement)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        done += count
+        if count < batch_size:
+            return done
+        time.sleep(pause)
+
+def incremental_vacuum(conn, pages=VACUUM_PAGES, pause=ARCHIVE_PAUSE):
+    """Return free pages to the filesystem `pages` at a time. Returns the pages freed (0 unless auto_vacuum is INCREMENTAL)."""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != INCREMENTAL_VACUUM:
+        return 0
+    freed = 0
+    while True:
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if free == 0:
+            return freed
+        # executescript steps the pragma to completion; execute() would free one page
+        conn.executescript(f'PRAGMA incremental_vacuum({min(free, pages)});')
+        freed += min(free, pages)
+        time.sleep(pause)
+
+def archive_notifications(days=None, archive_days=None, batch_size=None, pause=None):
+    """
+    Run the retention job once (defaults from the settings above).
+    Returns {'archived': rows, 'purged': rows, 'vacuumed_pages': pages}.
+    """
+    days = NOTIFICATION_RETENTION_DAYS if days is None else days
+    archive_days = NOTIFICATION_ARCHIVE_DAYS if archive_days is None else archive_days
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    pause = ARCHIVE_PAUSE if pause is None else pause
+
+    def cutoff(days):
+        return (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    auth_conn = get_auth_connection()
+    auth_conn.isolation_level = None  # transactions are explicit, one per batch
+    try:
+        auth_conn.execute(NOTIFICATION_ARCHIVE_SQL)
+        archived = move_in_batches(
+            auth_conn,
+            'SELECT id FROM notifications WHERE [read] = 1 AND created_at < ? ORDER BY created_at',
+            [cutoff(days)],
+            ['''INSERT OR IGNORE INTO notifications_archive (id, user_id, message, type, related_id, read, created_at)
+                SELECT id, user_id, message, type, related_id, read, created_at
+                FROM notifications WHERE id IN (SELECT id FROM batch_ids)''',
+             'DELETE FROM notifications WHERE id IN (SELECT id FROM batch_ids)'],
+            batch_size, pause)
+        purged = 0
+        if archive_days:
+            purged = move_in_batches(
+                auth_conn,
+                'SELECT id FROM notifications_archive WHERE created_at < ?',
+                [cutoff(archive_days)],
+                ['DELETE FROM notifications_archive WHERE id IN (SELECT id FROM batch_ids)'],
+                batch_size, pause)
+        vacuumed = incremental_vacuum(auth_conn, VACUUM_PAGES, pause)
+    finally:
+        auth_conn.close()
+
+    if archived or purged:
+        print(f"🗄️ Notification retention: archived {archived:,}, purged {purged:,}, freed {vacuumed:,} pages")
+    return {'archived': archived, 'purged': purged, 'vacuumed_pages': vacuumed}
+
+
+# --------------------------
+# Parallel prefetch
+# --------------------------
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "4"))
+PREFETCH_TIMEOUT = float(os.environ.get("PREFETCH_TIMEOUT", "30"))
+
+@st.cache_resource
+def get_prefetch_pool():
+    """One bounded pool per process, shared by all sessions and reruns."""
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+def prefetch(loaders, timeout=PREFETCH_TIMEOUT):
+    """
+    Run a page's independent loaders at the same time on a shared, bounded
+    thread pool, so the page waits for the slowest query instead of the sum.
+
+    `loaders` maps name -> (callable, default). Returns {name: result}; a loader
+    that raises or takes longer than `timeout` seconds yields its default.
+    """
+    # Let loaders see this session (session_state, memory report) from worker threads
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    def run(fn):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            return fn()
+        finally:
+            add_script_run_ctx(threading.current_thread(), None)
+
+    pool = get_prefetch_pool()
+    futures = {name: pool.submit(run, fn) for name, (fn, _) in loaders.items()}
+    deadline = time.monotonic() + timeout
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FuturesTimeout:
+            # The query keeps running in its worker; the page just stops waiting for it
+            print(f"⚠️ Prefetch '{name}' timed out after {timeout}s")
+            results[name] = loaders[name][1]
+        except Exception as e:
+            print(f"⚠️ Prefetch '{name}' failed: {e}")
+            results[name] = loaders[name][1]
+    return results
+
+
 # --------------------------
 # Dashboard stats (cross-db aggregation)
 # --------------------------
 def get_dashboard_stats():
     """Get dashboard statistics from actual tables"""
     try:
-        crm_conn = get_connection()
-        
-        # Get basic counts
-        customer_count = pd.read_sql_query("SELECT COUNT(*) as count FROM CRM_Customers", crm_conn)['count'].iloc[0]
-        service_count = pd.read_sql_query("SELECT COUNT(*) as count FROM CRM_Services", crm_conn)['count'].iloc[0]
-        invoice_count = pd.read_sql_query("SELECT COUNT(*) as count FROM CRM_Payments", crm_conn)['count'].iloc[0]
-        
-        # Service status distribution
-        service_status = pd.read_sql_query("SELECT Status, COUNT(*) as count FROM CRM_Services GROUP BY Status", crm_conn)
-        task_stats = list(service_status.itertuples(index=False, name=None))
-        
-        crm_conn.close()
-        
+        # Counts, status distribution, overdue tasks and customer progress in one batch
+        batch = query_batch({
+            'counts': (f'''
+                SELECT (SELECT COUNT(*) FROM CRM_Customers) AS customer_count,
+                       (SELECT COUNT(*) FROM CRM_Services) AS service_count,
+                       (SELECT COUNT(*) FROM CRM_Payments) AS invoice_count,
+                       (SELECT COUNT(DISTINCT {q("Group")}) FROM CRM_Customers WHERE {q("Group")} IS NOT NULL) AS group_count
+            ''', []),
+            'service_status': ('''
+                SELECT Status, COUNT(*) as Count
+                FROM CRM_Services
+                WHERE Status IS NOT NULL
+                GROUP BY Status
+                ORDER BY Count DESC
+            ''', []),
+            'overdue': overdue_tasks_query(([], [])),
+            'customer_progress': (CUSTOMER_PROGRESS_SQL, []),
+        })
+        counts = batch['counts'].iloc[0]
+        overdue_df = batch['overdue']
+
         return {
-            'customer_count': customer_count,
-            'service_count': service_count, 
-            'invoice_count': invoice_count,
-            'task_stats': task_stats,
-            'customer_progress': [],  # Would need more complex query
-            'overdue_tasks': []  # Would need WorkProgress table or equivalent
+            'customer_count': int(counts['customer_count']),
+            'service_count': int(counts['service_count']),
+            'invoice_count': int(counts['invoice_count']),
+            'group_count': int(counts['group_count']),
+            'task_stats': batch['service_status'],
+            'customer_progress': list(batch['customer_progress'].itertuples(index=False, name=None)),
+            'overdue_tasks': list(overdue_df[['TaskID', 'TaskName', 'Status', 'LastUpdated']].itertuples(index=False, name=None))
         }
     except Exception as e:
         print(f"Error getting dashboard stats: {e}")
@@ -762,10 +2389,12 @@ def get_dashboard_stats():
             'customer_count': 0,
             'service_count': 0,
             'invoice_count': 0,
-            'task_stats': [],
+            'group_count': 0,
+            'task_stats': pd.DataFrame(),
             'customer_progress': [],
             'overdue_tasks': []
         }
+
 def debug_database_tables():
     """Debug function to check what tables exist in the database"""
     try:
@@ -773,12 +2402,7 @@ def debug_database_tables():
         cursor = conn.cursor()
         
         # Get list of all tables in the database
-        cursor.execute("""
-            SELECT TABLE_NAME 
-            FROM INFORMATION_SCHEMA.TABLES 
-            WHERE TABLE_TYPE = 'BASE TABLE'
-            ORDER BY TABLE_NAME
-        """)
+        cursor.execute(get_backend().dialect.list_tables_sql())
         
         tables = cursor.fetchall()
         print("Available tables in database:")
@@ -794,6 +2418,85 @@ def debug_database_tables():
 
 # Add this to your main() function or call it when the error occurs
 # debug_database_tables()
+# --------------------------
+# UI helpers (fragments, selectbox labels)
+# --------------------------
+def track_run(scope):
+    """Count script runs per scope ('app' or a fragment name) in session state."""
+    counts = st.session_state.setdefault('run_counts', {})
+    counts[scope] = counts.get(scope, 0) + 1
+
+
+def rerun_fragment():
+    """Rerun only the current fragment (falls back to a full rerun during a full script run)."""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+
+def label_index(df, id_col, fmt):
+    """
+    Build {ID: display label} for a selectbox format_func in one pass over df.
+    fmt names the columns to show, e.g. "{ServiceID} - {ServiceType} ({CompanyName})".
+    """
+    fields = [name for _, name, _, _ in string.Formatter().parse(fmt) if name]
+    columns = list(dict.fromkeys([id_col] + fields))
+    return {
+        row[id_col]: fmt.format(**row)
+        for row in df[columns].to_dict('records')
+    }
+
+
+def search_picker(label, key, search, id_col, fmt):
+    """
+    Type-ahead picker: a search box whose text goes to `search` (see
+    search_rows) and a selectbox of the matches it returns. Returns the chosen
+    ID, or None. Widgets rerun the script, so keep it outside st.form.
+    """
+    text = st.text_input(f"Search {label.lower()}", key=f"{key}_search", placeholder="Type an ID or name")
+    matches = search(text)
+    if matches.empty:
+        st.caption(f"No {label.lower()} matches \"{text}\"")
+        return None
+    labels = label_index(matches, id_col, fmt)
+    if len(labels) == 1:
+        st.session_state[key] = next(iter(labels))  # a single match is the choice
+    choice = st.selectbox(label, options=list(labels), format_func=labels.get, key=key,
+                          index=None, placeholder=f"Choose from {len(labels)} matches")
+    if len(labels) >= PICKER_LIMIT:
+        st.caption(f"Showing the first {PICKER_LIMIT} matches, type more to narrow the list")
+    return choice
+
+
+def with_detail_batches(records, id_col, size=DETAIL_BATCH_SIZE):
+    """
+    Pair each list row with the IDs of its detail batch (itself and its
+    neighbours), so opening any row loads the details for the whole batch.
+    """
+    for start in range(0, len(records), size):
+        batch = records[start:start + size]
+        batch_ids = tuple(row[id_col] for row in batch)
+        for row in batch:
+            yield row, batch_ids
+
+
+def lazy_expander(label, key, show="Show details", hide="Hide details"):
+    """
+    Expander whose contents are only built once it has been opened with its
+    Show button. The open state is kept in st.session_state[key], since
+    st.expander itself reports no open state. Returns (expander, is_open).
+    """
+    is_open = st.session_state.get(key, False)
+    expander = st.expander(label, expanded=is_open)
+
+    def toggle():
+        st.session_state[key] = not is_open
+
+    expander.button(hide if is_open else show, key=f"{key}_toggle", on_click=toggle)
+    return expander, is_open
+
+
 def login_page():
     st.title("CRM System - Login")
     
@@ -822,6 +2525,50 @@ def login_page():
 def show_customers():
     st.header("Customer Management")
     
+    add_customer_form()
+
+    # Display customers
+    st.subheader("Customer List")
+    
+    customers_df = get_customers_enhanced(st.session_state.user['id'], st.session_state.user['role'])
+    
+    if len(customers_df) > 0:
+        # Filter options
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            group_filter = st.selectbox("Filter by Group", ['All'] + list(customers_df['Group'].unique()))
+        with col2:
+            country_filter = st.selectbox("Filter by Country", ['All'] + list(customers_df['Country'].unique()))
+        with col3:
+            status_filter = st.selectbox("Filter by Status", ['All'] + list(customers_df['status'].unique()))
+        
+        # Apply filters (each filter returns a new frame; the snapshot view is never modified)
+        filtered_df = customers_df
+        if group_filter != 'All':
+            filtered_df = filtered_df[filtered_df['Group'] == group_filter]
+        if country_filter != 'All':
+            filtered_df = filtered_df[filtered_df['Country'] == country_filter]
+        if status_filter != 'All':
+            filtered_df = filtered_df[filtered_df['status'] == status_filter]
+        
+        view_mode = st.radio("View", ["List", "Grid"], horizontal=True, key="customer_view_mode")
+        if view_mode == "Grid":
+            customer_grid(filtered_df.reset_index(drop=True))
+        else:
+            # Display customers (each row is its own fragment, see customer_row)
+            version = customers_df.attrs.get('snapshot_version')
+            for customer, batch_ids in with_detail_batches(filtered_df.to_dict('records'), 'CustomerID'):
+                customer_row(customer, batch_ids, version)
+    
+    else:
+        st.info("No customers found. Add your first customer above!")
+
+
+@st.fragment
+def add_customer_form():
+    """Add-customer form. Runs as a fragment so its widgets don't rerun the customer list."""
+    track_run('add_customer_form')
+
     # Add new customer (existing add_customer_enhanced handles cross-db correctly)
     with st.expander("Add New Customer"):
         with st.form("add_customer"):
@@ -832,8 +2579,9 @@ def show_customers():
                 customer_id = st.text_input("Customer ID")
                 tax_code = st.text_input("Tax Code")
                 
-                # Get customer groups (from SQL Server CRM_Customers table)
-                groups_df = get_customer_groups()
+                # Existing groups, sources and account managers (from SQL Server CRM_Customers table)
+                field_options = get_customer_field_options()
+                groups_df = field_options['Group']
                 if len(groups_df) > 0:
                     group_options = [''] + groups_df['Group'].tolist() + ['Other (Custom)']
                     group_selection = st.selectbox("Customer Group", 
@@ -877,9 +2625,7 @@ def show_customers():
                 industry = st.text_input("Industry")
                 
                 # Source
-                conn = get_connection()
-                sources_df = pd.read_sql_query('SELECT DISTINCT Source FROM CRM_Customers WHERE Source IS NOT NULL ORDER BY Source', conn)
-                conn.close()
+                sources_df = field_options['Source']
                 if len(sources_df) > 0:
                     source_options = [''] + sources_df['Source'].tolist() + ['Other']
                     source_selection = st.selectbox("Source",
@@ -895,10 +2641,8 @@ def show_customers():
                 else:
                     source = st.text_input("Source")
                 
-                # Assign to employee (from CRM_Users table)
-                conn = get_connection()
-                account_managers_df = pd.read_sql_query('SELECT DISTINCT AccountManager FROM CRM_Customers WHERE AccountManager IS NOT NULL ORDER BY AccountManager', conn)
-                conn.close()
+                # Assign to employee
+                account_managers_df = field_options['AccountManager']
 
                 if len(account_managers_df) > 0:
                     manager_options = [''] + account_managers_df['AccountManager'].tolist() + ['Other (Custom)']
@@ -950,220 +2694,277 @@ def show_customers():
                     st.rerun()
                 else:
                     st.error("Failed to add customer. Please try again.")
+
+
+@st.fragment
+def customer_grid(customers_df):
+    """
+    Spreadsheet-style editing of many customers at once. Cell edits stay in the
+    grid until Save, which writes only the changed cells in one batch.
+    """
+    track_run('customer_grid')
+
+    # The editable columns are detail columns, so load them for every row in one batch
+    details = load_details('customers', customers_df['CustomerID'].tolist())
+    details_df = pd.DataFrame([row for row in details.values() if row])
+    if not details_df.empty:
+        customers_df = customers_df.merge(details_df, on='CustomerID', how='left')
+
+    display_columns = ['CustomerID', 'Group', 'Country', 'status'] + CUSTOMER_EDITABLE_COLUMNS
+    grid_df = customers_df[[c for c in display_columns if c in customers_df.columns]]
+    editor_key = "customer_grid_editor"
+
+    st.data_editor(
+        grid_df,
+        key=editor_key,
+        hide_index=True,
+        num_rows="fixed",
+        use_container_width=True,
+        disabled=[c for c in grid_df.columns if c not in CUSTOMER_EDITABLE_COLUMNS],
+    )
+
+    edited_rows = st.session_state.get(editor_key, {}).get('edited_rows', {})
+    changes = diff_customer_edits(grid_df, edited_rows)
+
+    col_save, col_reset = st.columns(2)
+    with col_save:
+        save_grid = st.button(f"Save {len(changes)} changed customers", type="primary",
+                              disabled=not changes, key="customer_grid_save")
+    with col_reset:
+        reset_grid = st.button("Discard changes", disabled=not edited_rows, key="customer_grid_reset")
+
+    if save_grid:
+        try:
+            updated = update_customers_batch(changes)
+            st.success(f"Updated {updated} customers")
+            del st.session_state[editor_key]
+            # Other views (list rows, filters) need the new values
+            st.rerun()
+        except Exception as e:
+            st.error(f"Error updating customers: {str(e)}")
+
+    if reset_grid:
+        del st.session_state[editor_key]
+        rerun_fragment()
+
+
+def show_customer_360(customer_id):
+    """One tab per section of the customer's 360 view (one batch, see get_customer_360)."""
+    data = get_customer_360(customer_id)
+    tabs = st.tabs([f"{section.title()} ({len(df)})" for section, df in data.items()])
+    for tab, df in zip(tabs, data.values()):
+        with tab:
+            if df.empty:
+                st.caption("None")
+            else:
+                st.dataframe(df, hide_index=True, use_container_width=True)
+
+
+@st.fragment
+def customer_row(customer, batch_ids=(), version=None):
+    """
+    One customer expander. Its details load when it is opened, together with
+    the rest of its batch (batch_ids). Status changes, edit mode and delete
+    confirmation rerun only this fragment; a full rerun happens only when a
+    customer is deleted. `version` is the customer snapshot the row came from.
+    """
+    track_run('customer_row')
+    customer_id = customer['CustomerID']
+
+    expander, is_open = lazy_expander(f"{customer['CompanyName']}", f"customer_open_{customer_id}")
+    if is_open:
+        customer = {**customer, **load_details('customers', batch_ids or (customer_id,))[customer_id]}
+
+    # Values saved through the edit form since the list was loaded. Once the
+    # list comes from a newer snapshot, that snapshot has them (and any later edits).
+    saved_key = f"customer_saved_{customer_id}"
+    saved = st.session_state.get(saved_key)
+    if saved and saved['version'] != version:
+        del st.session_state[saved_key]
+    elif saved:
+        customer = {**customer, **saved['values']}
+
+    with expander:
+        if is_open:
+            col1, col2 = st.columns(2)
+        
+            with col1:
+                st.write(f"**Tax Code:** {customer.get('TaxCode') or 'N/A'}")
+                st.write(f"**Address:** {customer.get('Address') or 'N/A'}")
+                st.write(f"**Country:** {customer.get('Country')}")
+                st.write(f"**Category:** {customer.get('CustomerCategory')} - {customer.get('CompanyType')}")
+                st.write(f"**Industry:** {customer.get('Industry') or 'N/A'}")
+                st.write(f"**Source:** {customer.get('Source') or 'N/A'}")
+                st.write(f"**Created Date:** {customer.get('CreatedDate') or 'N/A'}")
+        
+            with col2:
+                st.write(f"**Primary Contact:** {customer.get('ContactPerson1')}")
+                st.write(f"**Primary Email:** {customer.get('ContactEmail1') or 'N/A'}")
+                st.write(f"**Primary Phone:** {customer.get('ContactPhone1') or 'N/A'}")
+                if customer.get('ContactPerson2'):
+                    st.write(f"**Secondary Contact:** {customer.get('ContactPerson2')}")
+                    st.write(f"**Secondary Email:** {customer.get('ContactEmail2') or 'N/A'}")
+                    st.write(f"**Secondary Phone:** {customer.get('ContactPhone2') or 'N/A'}")
+                st.write(f"**Assigned to:** {customer.get('AccountManager') or 'N/A'}")
+                st.write(f"**Group:** {customer.get('Group') or 'N/A'}")
+        
+            if st.toggle("Services, invoices, payments, documents & tasks", key=f"customer_360_{customer_id}"):
+                show_customer_360(customer_id)
+        
+            # Action buttons
+            col1, col2, col3 = st.columns(3)
+        
+            can_edit = (st.session_state.user['role'] == 'admin' or 
+                      customer.get('assigned_to') == st.session_state.user['id'])
+        
+            with col1:
+                if can_edit:
+                    conn = get_connection()
+                    status_df = pd.read_sql_query("""
+                        SELECT DISTINCT Status 
+                        FROM CRM_Services 
+                        WHERE CustomerID = ? AND Status IS NOT NULL
+                    """, conn, params=[customer_id])
+                    conn.close()
+
+                    if not status_df.empty:
+                        status_options = status_df["Status"].tolist()
+                        current_service_status = status_options[0] if status_options else None
+                        new_status = st.selectbox(
+                            "Status",
+                            status_options,
+                            index=status_options.index(current_service_status) if current_service_status in status_options else 0,
+                            key=f"status_{customer_id}"
+                        )
     
-    # Display customers
-    st.subheader("Customer List")
-    
-    customers_df = get_customers_enhanced(st.session_state.user['id'], st.session_state.user['role'])
-    
-    if len(customers_df) > 0:
-        # Filter options
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            group_filter = st.selectbox("Filter by Group", ['All'] + list(customers_df['Group'].unique()))
-        with col2:
-            country_filter = st.selectbox("Filter by Country", ['All'] + list(customers_df['Country'].unique()))
-        with col3:
-            status_filter = st.selectbox("Filter by Status", ['All'] + list(customers_df['status'].unique()))
+                        # Handle status change (inside the if block where variables are defined)
+                        if new_status != current_service_status:
+                            conn = get_connection()
+                            cursor = conn.cursor()
+                            cursor.execute("""
+                                UPDATE CRM_Services 
+                                SET Status = ? 
+                                WHERE CustomerID = ?
+                            """, (new_status, customer_id))
+                            conn.commit()
+                            conn.close()
+                            invalidate_snapshots('services')
+                            st.success(f"Service status updated to {new_status}")
+                            rerun_fragment()
+                    else:
+                        st.write("**Service Status:** No services found")
+                else:
+                    conn = get_connection()
+                    status_df = pd.read_sql_query("""
+                        SELECT DISTINCT Status FROM CRM_Services 
+                        WHERE CustomerID = ?
+                    """, conn, params=[customer_id])
+                    conn.close()
         
-        # Apply filters
-        filtered_df = customers_df.copy()
-        if group_filter != 'All':
-            filtered_df = filtered_df[filtered_df['Group'] == group_filter]
-        if country_filter != 'All':
-            filtered_df = filtered_df[filtered_df['Country'] == country_filter]
-        if status_filter != 'All':
-            filtered_df = filtered_df[filtered_df['status'] == status_filter]
+                    if not status_df.empty:
+                        statuses = status_df['Status'].dropna().tolist()
+                        st.write(f"**Service Status:** {', '.join(statuses) if statuses else 'N/A'}")
+                    else:
+                        st.write("**Service Status:** No services")
         
-        # Display customers
-        for idx, customer in filtered_df.iterrows():
-            with st.expander(f"{customer['CompanyName']}"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.write(f"**Tax Code:** {customer.get('TaxCode') or 'N/A'}")
-                    st.write(f"**Address:** {customer.get('Address') or 'N/A'}")
-                    st.write(f"**Country:** {customer.get('Country')}")
-                    st.write(f"**Category:** {customer.get('CustomerCategory')} - {customer.get('CompanyType')}")
-                    st.write(f"**Industry:** {customer.get('Industry') or 'N/A'}")
-                    st.write(f"**Source:** {customer.get('Source') or 'N/A'}")
-                    st.write(f"**Created Date:** {customer.get('CreatedDate') or 'N/A'}")
-                
-                with col2:
-                    st.write(f"**Primary Contact:** {customer.get('ContactPerson1')}")
-                    st.write(f"**Primary Email:** {customer.get('ContactEmail1') or 'N/A'}")
-                    st.write(f"**Primary Phone:** {customer.get('ContactPhone1') or 'N/A'}")
-                    if customer.get('ContactPerson2'):
-                        st.write(f"**Secondary Contact:** {customer.get('ContactPerson2')}")
-                        st.write(f"**Secondary Email:** {customer.get('ContactEmail2') or 'N/A'}")
-                        st.write(f"**Secondary Phone:** {customer.get('ContactPhone2') or 'N/A'}")
-                    st.write(f"**Assigned to:** {customer.get('AccountManager') or 'N/A'}")
-                    st.write(f"**Group:** {customer.get('Group') or 'N/A'}")
-                
-                # Action buttons
-                col1, col2, col3 = st.columns(3)
-                
-                # Status update
-                current_status = customer.get('status')
-                can_edit = (st.session_state.user['role'] == 'admin' or 
-                          customer.get('assigned_to') == st.session_state.user['id'])
-                
-                with col1:
-                    if can_edit:
-                        conn = get_connection()
-                        status_df = pd.read_sql_query("""
-
-                                                      SELECT DISTINCT Status 
-                                                      FROM CRM_Services 
-                                                    WHERE CustomerID = ? AND Status IS NOT NULL
-                                                      """, conn, params=[customer['CustomerID']])
-                        conn.close()
-
-                        if not status_df.empty:
-                            status_options = status_df["Status"].tolist()
-                            current_service_status = status_options[0] if status_options else None
-                            new_status = st.selectbox(
-                                "Status",
-                                status_options,
-                                index=status_options.index(current_service_status) if current_service_status in status_options else 0,
-                                key=f"status_{customer['CustomerID']}"
-                            )
+            edit_key = f"edit_mode_{customer_id}"
+            with col2:
+                if can_edit:
+                    if st.button("Edit", key=f"edit_{customer_id}"):
+                        st.session_state[edit_key] = not st.session_state.get(edit_key, False)
+                        rerun_fragment()
+        
+            with col3:
+                # Delete button (admin only)
+                if st.session_state.user['role'] == 'admin':
+                    if st.button("Delete", key=f"delete_{customer_id}", type="secondary"):
+                        st.session_state[f"confirm_delete_{customer_id}"] = True
+                        rerun_fragment()
+        
+            # Show edit form directly in the expander if edit mode is active
+            if can_edit and st.session_state.get(edit_key, False):
+                st.write("---")
+                st.write("**Edit Customer:**")
             
-                            # Handle status change (inside the if block where variables are defined)
-                            if new_status != current_service_status:
-                                conn = get_connection()
-                                cursor = conn.cursor()
-                                cursor.execute("""
-                                    UPDATE CRM_Services 
-                                    SET Status = ? 
-                                    WHERE CustomerID = ?
-                                """, (new_status, customer['CustomerID']))
-                                conn.commit()
-                                conn.close()
-                                st.success(f"Service status updated to {new_status}")
-                                st.rerun()
-                        else:
-                            st.write("**Service Status:** No services found")
-                    else:
-                        conn = get_connection()
-                        status_df = pd.read_sql_query("""
-                            SELECT DISTINCT Status FROM CRM_Services 
-                            WHERE CustomerID = ?
-                        """, conn, params=[customer['CustomerID']])
-                        conn.close()
+                with st.form(key=f"edit_form_{customer_id}"):
+                    col_edit1, col_edit2 = st.columns(2)
                 
-                        if not status_df.empty:
-                            statuses = status_df['Status'].dropna().tolist()
-                            st.write(f"**Service Status:** {', '.join(statuses) if statuses else 'N/A'}")
-                        else:
-                            st.write("**Service Status:** No services")
+                    with col_edit1:
+                        new_name = st.text_input("Company Name", value=str(customer.get("CompanyName", "")))
+                        new_address = st.text_area("Address", value=str(customer.get("Address", "")))
+                        new_email = st.text_input("Contact Email", value=str(customer.get("ContactEmail1", "")))
+                        new_phone = st.text_input("Contact Phone", value=str(customer.get("ContactPhone1", "")))
                 
-                with col2:
-                    if can_edit:
-                        edit_key = f"edit_mode_{customer['CustomerID']}"
-                        if st.button("Edit", key=f"edit_{customer['CustomerID']}"):
-                            st.session_state[edit_key] = not st.session_state.get(edit_key, False)
-                            st.rerun()
+                    with col_edit2:
+                        new_contact = st.text_input("Contact Person", value=str(customer.get("ContactPerson1", "")))
+                        new_industry = st.text_input("Industry", value=str(customer.get("Industry", "")))
+                        new_tax_code = st.text_input("Tax Code", value=str(customer.get("TaxCode", "")))
                 
-                # Show edit form directly in the expander if edit mode is active
-                if can_edit and st.session_state.get(f"edit_mode_{customer['CustomerID']}", False):
-                    st.write("---")
-                    st.write("**Edit Customer:**")
+                    col_save, col_cancel = st.columns(2)
+                    with col_save:
+                        save_changes = st.form_submit_button("Save Changes", type="primary")
+                    with col_cancel:
+                        cancel_edit = st.form_submit_button("Cancel")
+            
+                # Handle form submission
+                if save_changes:
+                    try:
+                        crm_conn = get_connection()
+                        cursor = crm_conn.cursor()
                     
-                    with st.form(key=f"edit_form_{customer['CustomerID']}"):
-                        col_edit1, col_edit2 = st.columns(2)
-                        
-                        with col_edit1:
-                            new_name = st.text_input("Company Name", value=str(customer.get("CompanyName", "")))
-                            new_address = st.text_area("Address", value=str(customer.get("Address", "")))
-                            new_email = st.text_input("Contact Email", value=str(customer.get("ContactEmail1", "")))
-                            new_phone = st.text_input("Contact Phone", value=str(customer.get("ContactPhone1", "")))
-                        
-                        with col_edit2:
-                            new_contact = st.text_input("Contact Person", value=str(customer.get("ContactPerson1", "")))
-                            new_industry = st.text_input("Industry", value=str(customer.get("Industry", "")))
-                            new_tax_code = st.text_input("Tax Code", value=str(customer.get("TaxCode", "")))
-                        
-                        col_save, col_cancel = st.columns(2)
-                        with col_save:
-                            save_changes = st.form_submit_button("Save Changes", type="primary")
-                        with col_cancel:
-                            cancel_edit = st.form_submit_button("Cancel")
+                        cursor.execute("""
+                            UPDATE CRM_Customers
+                            SET CompanyName = ?, Address = ?, ContactEmail1 = ?, 
+                                ContactPhone1 = ?, ContactPerson1 = ?, Industry = ?, TaxCode = ?
+                            WHERE CustomerID = ?
+                        """, (new_name, new_address, new_email, new_phone, 
+                              new_contact, new_industry, new_tax_code, customer_id))
+
+                        crm_conn.commit()
+                        crm_conn.close()
+                        invalidate_snapshots('customers', 'services')
                     
-                    # Handle form submission
-                    if save_changes:
-                        try:
-                            crm_conn = get_connection()
-                            cursor = crm_conn.cursor()
-                            
-                            cursor.execute("""
-                                UPDATE CRM_Customers
-                                SET CompanyName = ?, Address = ?, ContactEmail1 = ?, 
-                                    ContactPhone1 = ?, ContactPerson1 = ?, Industry = ?, TaxCode = ?
-                                WHERE CustomerID = ?
-                            """, (new_name, new_address, new_email, new_phone, 
-                                  new_contact, new_industry, new_tax_code, customer["CustomerID"]))
-                            
-                            crm_conn.commit()
-                            crm_conn.close()
-                            
-                            st.success("Customer updated successfully!")
-                            st.session_state[f"edit_mode_{customer['CustomerID']}"] = False
-                            st.rerun()
-                            
-                        except Exception as e:
-                            st.error(f"Error updating customer: {str(e)}")
+                        st.session_state[saved_key] = {'version': version, 'values': {
+                            'CompanyName': new_name, 'Address': new_address, 'ContactEmail1': new_email,
+                            'ContactPhone1': new_phone, 'ContactPerson1': new_contact,
+                            'Industry': new_industry, 'TaxCode': new_tax_code,
+                        }}
+                        st.success("Customer updated successfully!")
+                        st.session_state[edit_key] = False
+                        rerun_fragment()
                     
-                    if cancel_edit:
-                        st.session_state[f"edit_mode_{customer['CustomerID']}"] = False
-                        st.rerun()
-                        st.rerun()
-                        
-                        # Show edit form immediately if in edit mode
-                        if st.session_state.get(edit_key, False):
-                            st.write("---")
-                            st.write("**Edit Customer:**")
-                            
-                            with st.form(key=f"edit_form_{customer['CustomerID']}"):
-                                col_edit1, col_edit2 = st.columns(2)
-                                
-                                with col_edit1:
-                                    new_name = st.text_input()
-                
-                with col3:
-                    # Delete button (admin only)
-                    if st.session_state.user['role'] == 'admin':
-                        if st.button("Delete", key=f"delete_{customer['CustomerID']}", type="secondary"):
-                            st.session_state[f"confirm_delete_{customer['CustomerID']}"] = True
-        
-        # Handle delete confirmations
-        for idx, customer in filtered_df.iterrows():
-            if st.session_state.get(f"confirm_delete_{customer['CustomerID']}", False):
-                st.warning(f"⚠️ Delete {customer['CompanyName']}?")
-                st.write("This will also delete all related services and invoices.")
-                
-                col_yes, col_no = st.columns(2)
-                with col_yes:
-                    if st.button("Yes, Delete", key=f"confirm_yes_{customer['CustomerID']}", type="primary"):
-                        success, message = delete_customer(customer['CustomerID'])
-                        if success:
-                            st.success(message)
-                        else:
-                            st.error(message)
-                        # Clear confirmation state
-                        if f"confirm_delete_{customer['CustomerID']}" in st.session_state:
-                            del st.session_state[f"confirm_delete_{customer['CustomerID']}"]
-                        st.rerun()
-                
-                with col_no:
-                    if st.button("Cancel", key=f"confirm_no_{customer['CustomerID']}"):
-                        # Clear confirmation state
-                        if f"confirm_delete_{customer['CustomerID']}" in st.session_state:
-                            del st.session_state[f"confirm_delete_{customer['CustomerID']}"]
-                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error updating customer: {str(e)}")
+            
+                if cancel_edit:
+                    st.session_state[edit_key] = False
+                    rerun_fragment()
     
-    else:
-        st.info("No customers found. Add your first customer above!")
+    # Delete confirmation
+    confirm_key = f"confirm_delete_{customer_id}"
+    if st.session_state.get(confirm_key, False):
+        st.warning(f"⚠️ Delete {customer['CompanyName']}?")
+        st.write("This will also delete all related services, tasks, invoices, payments and documents.")
+        
+        col_yes, col_no = st.columns(2)
+        with col_yes:
+            if st.button("Yes, Delete", key=f"confirm_yes_{customer_id}", type="primary"):
+                success, message = delete_customer(customer_id)
+                if success:
+                    st.success(message)
+                else:
+                    st.error(message)
+                # Clear confirmation state
+                del st.session_state[confirm_key]
+                # The list itself changed, so rerun the whole page
+                st.rerun()
+        
+        with col_no:
+            if st.button("Cancel", key=f"confirm_no_{customer_id}"):
+                # Clear confirmation state
+                del st.session_state[confirm_key]
+                rerun_fragment()
+
 
 
 def add_customer_enhanced(customer_id, company_name, tax_code, group_name, address, country, customer_category,
@@ -1196,9 +2997,9 @@ def add_customer_enhanced(customer_id, company_name, tax_code, group_name, addre
         else:
             category_code = customer_category
         
-        crm_cursor.execute('''
+        crm_cursor.execute(f'''
             INSERT INTO CRM_Customers (
-                CustomerID, CompanyName, TaxCode, [Group], Address, Country, CustomerCategory,
+                CustomerID, CompanyName, TaxCode, {q("Group")}, Address, Country, CustomerCategory,
                 CompanyType, ContactPerson1, ContactEmail1, ContactPhone1,
                 ContactPerson2, ContactEmail2, ContactPhone2, Industry, Source, 
                 CreatedDate, AccountManager, AnnualRevenueSize
@@ -1240,6 +3041,7 @@ def add_customer_enhanced(customer_id, company_name, tax_code, group_name, addre
 
         auth_conn.commit()
         auth_conn.close()
+        invalidate_snapshots('customers', 'services')
         print("DEBUG: Successfully committed all auth.db changes")
         
         return customer_id
@@ -1366,164 +3168,160 @@ def show_user_management():
                                         del st.session_state[f"confirm_delete_user_{user['id']}"]
                                     st.rerun()
                     else:
-                        st.info("Cannot delete yourself")
-    else:
-        st.info("No users found.")
-
-def show_work_progress():
-    st.header("Work Progress & Tasks")
-    
-    # Add new task
-    with st.expander("Add New Task"):
-        with st.form("add_task"):
-            # Get services for task assignment
-            services_df = get_all_services(st.session_state.user['id'], st.session_state.user['role'])
-            
-            if len(services_df) > 0:
-                # Pre-select service if coming from services page
-                default_service = None
-                if 'selected_service_for_task' in st.session_state:
-                    default_service = st.session_state.selected_service_for_task
-                    del st.session_state.selected_service_for_task
-                
-                service_options = services_df['ServiceID'].tolist()
-                default_index = 0
-                if default_service and default_service in service_options:
-                    default_index = service_options.index(default_service)
-                
-                service_id = st.selectbox("Service", 
-                                        options=service_options,
-                                        index=default_index,
-                                        format_func=lambda x: f"{x} - {services_df[services_df['ServiceID']==x]['ServiceType'].iloc[0]} ({services_df[services_df['ServiceID']==x]['CompanyName'].iloc[0]})")
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    task_name = st.text_input("Task Name*")
-                    start_date = st.date_input("Start Date")
-                
-                with col2:
-                    expected_end_date = st.date_input("Expected End Date")
-                
-                task_description = st.text_area("Task Description")
-                
-                submit_task = st.form_submit_button("Add Task")
-                
-                if submit_task:
-                    if not task_name:
-                        st.error("Task Name is required!")
-                    else:
-                        task_id = add_work_task(service_id, task_name, task_description, 
-                                              start_date, expected_end_date, st.session_state.user['id'])
-                        st.success(f"Task added successfully! ID: {task_id}")
-                        st.rerun()
-            else:
-                st.warning("No services available. Add services first.")
-    
-    # Display tasks
-    st.subheader("Task List")
-
-def show_payments():
-    st.header("Payment Management")
-    
-    # Add new payment
-    with st.expander("Add New Payment"):
-        with st.form("add_payment"):
-            # Get services for payment assignment
-            services_df = get_all_services(st.session_state.user['id'], st.session_state.user['role'])
-            
-            if len(services_df) > 0:
-                service_id = st.selectbox("Service", 
-                                        options=services_df['ServiceID'].tolist(),
-                                        format_func=lambda x: f"{services_df[services_df['ServiceID']==x]['ServiceType'].iloc[0]} ({services_df[services_df['ServiceID']==x]['CompanyName'].iloc[0]})")
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    payment_date = st.date_input("Payment Date")
-                    type_of_payment = st.text_input("Type of Payment")
-                    currency = st.selectbox("Currency", ['VND', 'USD', 'EUR', 'SGD', 'HKD', 'JPY'])
-                    paid_amount = st.number_input("Paid Amount", min_value=0.0, format="%.2f")
-                    conn = get_connection()
-                    payment_types_df = pd.read_sql_query('SELECT DISTINCT PaymentType FROM CRM_Services WHERE PaymentType IS NOT NULL ORDER BY PaymentType', conn)
-                    conn.close()
-                    if len(payment_types_df) > 0:
-                        payment_type = st.selectbox("Payment Type",
-                                                options=[''] + payment_types_df['PaymentType'].tolist(),
-                                                format_func=lambda x: x if x else "Select Payment Type")
-                    else:
-                        st.warning("No payment types found")
-                        payment_type = st.text_input("Payment Type")
-                
-                with col2:
-                    exrate = st.number_input("Exchange Rate", min_value=0.0, value=1.0, format="%.4f")
-                    payer_name = st.text_input("Payer Name")
-                    received_account = st.text_input("Received Account")
-                    conn = get_connection()
-                    invoice_df = pd.read_sql_query('SELECT DISTINCT InvoiceID FROM CRM_Payments ORDER BY InvoiceID', conn)
-                    conn.close()
-                    invoice_id = st.selectbox("Select Invoice ID", 
-                        options=[''] + invoice_df['InvoiceID'].tolist(),
-                        format_func=lambda x: x if x else "Select Invoice ID")
-                
-                notes = st.text_area("Payment Notes")
-                
-                submit_payment = st.form_submit_button("Add Payment")
-                
-                if submit_payment:
-                    if not invoice_id:
-                        st.error("Invoice ID is required!")
-                    elif paid_amount <= 0:
-                        st.error("Paid Amount must be greater than 0!")
-                    elif not payer_name.strip():
-                        st.error("Payer Name is required!")
-                    else:
-                        try:
-                            # Add payment to database
-                            conn = get_connection()
-                            cursor = conn.cursor()
+                        st.info("Cannot delete yourself")
+    else:
+        st.info("No users found.")
+
+def show_work_progress():
+    st.header("Work Progress & Tasks")
+    
+    add_task_form()
+    
+    # Display tasks
+    st.subheader("Task List")
+    task_board()
 
-                            insert_query = """
-                            INSERT INTO CRM_Payments
-                            (PaymentDate, TypeOfPayment, PaidAmount, Currency, Exrate, PayerName,
-                            ReceivedAccount, Notes, InvoiceID, PaidAmountUSD, PaymentType)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            """
-                            paid_amount_usd = paid_amount / exrate if currency != 'USD' else paid_amount
-                            cursor.execute(insert_query, (payment_date,
-                                                          type_of_payment,
-                                                          paid_amount,
-                                                          currency,
-                                                          exrate,
-                                                          payer_name,
-                                                          received_account,
-                                                          notes,
-                                                          invoice_id,
-                                                          paid_amount_usd,
-                                                          payment_type                          
-                            ))
 
-                            conn.commit()
-                            conn.close()
+@st.fragment
+def add_task_form():
+    """Add-task form. Runs as a fragment so searching for a service only reruns the form."""
+    track_run('add_task_form')
+    user = st.session_state.user
 
-                            st.success(f"Payment record added successfully! ID: {invoice_id}")
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Error adding payment: {e}")
+    # Pre-select service if coming from services page
+    if 'selected_service_for_task' in st.session_state:
+        st.session_state.task_service_search = st.session_state.pop('selected_service_for_task')
+
+    # Add new task
+    with st.expander("Add New Task"):
+        service_id = search_picker("Service", "task_service",
+                                   lambda text: search_services(text, user['id'], user['role']),
+                                   'ServiceID', "{ServiceID} - {ServiceType} ({CompanyName})")
+        with st.form("add_task"):
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                task_name = st.text_input("Task Name*")
+                start_date = st.date_input("Start Date")
+            
+            with col2:
+                expected_end_date = st.date_input("Expected End Date")
+            
+            task_description = st.text_area("Task Description")
+            
+            submit_task = st.form_submit_button("Add Task")
+            
+            if submit_task:
+                if not service_id:
+                    st.error("Choose a service first!")
+                elif not task_name:
+                    st.error("Task Name is required!")
+                else:
+                    task_id = add_work_task(service_id, task_name, task_description, 
+                                          start_date, expected_end_date, user['id'])
+                    st.success(f"Task added successfully! ID: {task_id}")
+                    st.rerun()
+
+
+@st.fragment
+def task_board():
+    """
+    Tasks as a board: one column per status, TASK_PAGE_SIZE tasks per page,
+    earliest due date first. Paging and task updates rerun only this fragment.
+    """
+    track_run('task_board')
+    user_id, user_role = st.session_state.user['id'], st.session_state.user['role']
+
+    # Counts, overdue and the current page of each standard column in one batch
+    scope = task_scope(user_id, user_role)
+    if scope is None:
+        st.info("No tasks found. Add your first task above!")
+        return
+    requested = {status: st.session_state.get(f"task_page_{status}", 0) for status in TASK_STATUSES}
+    board = query_batch({
+        'counts': task_counts_query(scope),
+        'overdue': overdue_tasks_query(scope),
+        **{f"page_{status}": task_page_query(status, page, scope) for status, page in requested.items()},
+    })
+    counts = task_counts(board['counts'])
+    if not counts:
+        st.info("No tasks found. Add your first task above!")
+        return
+
+    overdue_count = len(board['overdue'])
+    if overdue_count:
+        more = "+" if overdue_count >= OVERDUE_LIMIT else ""
+        st.warning(f"⚠️ {overdue_count}{more} overdue tasks (see the Dashboard for the list)")
+
+    statuses = TASK_STATUSES + sorted(status for status in counts if status not in TASK_STATUSES)
+    for status, column in zip(statuses, st.columns(len(statuses))):
+        with column:
+            total = counts.get(status, 0)
+            pages = max(1, math.ceil(total / TASK_PAGE_SIZE))
+            page_key = f"task_page_{status}"
+            page = min(st.session_state.get(page_key, 0), pages - 1)
+
+            st.markdown(f"**{status}** ({total})")
+            if requested.get(status) == page:
+                tasks = board[f"page_{status}"]
+            else:  # other statuses, or a page past the end since the last run
+                tasks = query_batch({'page': task_page_query(status, page, scope)})['page']
+            for task in tasks.to_dict('records'):
+                task_card(task)
+
+            if pages > 1:
+                col_prev, col_page, col_next = st.columns([1, 2, 1])
+                with col_prev:
+                    if st.button("◀", key=f"task_prev_{status}", disabled=page == 0):
+                        st.session_state[page_key] = page - 1
+                        rerun_fragment()
+                with col_page:
+                    st.caption(f"Page {page + 1} of {pages}")
+                with col_next:
+                    if st.button("▶", key=f"task_next_{status}", disabled=page >= pages - 1):
+                        st.session_state[page_key] = page + 1
+                        rerun_fragment()
+
+
+def task_card(task):
+    """One task on the board; the update form renders only when opened."""
+    task_id = task['TaskID']
+    progress = 0 if pd.isna(task['Progress']) else int(task['Progress'])
+    overdue = task['PastDue'] and task['Status'] != TASK_DONE_STATUS
+
+    with st.container(border=True):
+        st.markdown(f"**{task['TaskName']}**" + (" ⚠️" if overdue else ""))
+        st.caption(f"{task_id} · {task.get('CompanyName') or task['ServiceID']} · due {task['ExpectedEndDate']}")
+        st.progress(progress / 100)
+
+        update, is_open = lazy_expander("Update", f"task_open_{task_id}", show="Edit task", hide="Close")
+        if is_open:
+            with update:
+                with st.form(key=f"task_form_{task_id}"):
+                    status_options = TASK_STATUSES if task['Status'] in TASK_STATUSES else TASK_STATUSES + [task['Status']]
+                    new_status = st.selectbox("Status", status_options, index=status_options.index(task['Status']))
+                    new_progress = st.slider("Progress", 0, 100, progress)
+                    notes = st.text_area("Notes", value=task.get('Notes') or "")
+                    save_task = st.form_submit_button("Save")
+                if save_task:
+                    update_task_status(task_id, new_status, new_progress, st.session_state.user['id'], notes)
+                    rerun_fragment()
+
+def show_payments():
+    st.header("Payment Management")
     
+    add_payment_form()
     
     # Display payments
     st.subheader("Payment List")
     
     try:
         conn = get_connection()
-        payments_df = pd.read_sql_query("""
-    SELECT p.PaymentID, p.PaymentDate, p.TypeOfPayment, p.PaidAmount, p.Currency, 
-           p.Exrate, p.PayerName, p.ReceivedAccount, p.Notes, p.InvoiceID, p.PaidAmountUSD, 
-           s.PaymentType
-    FROM CRM_Payments p
-    LEFT JOIN CRM_Invoice i ON p.InvoiceID = i.InvoiceCode
-    LEFT JOIN CRM_Services s ON i.ServiceID = s.ServiceID
-    ORDER BY p.PaymentID DESC
+        # Amounts, accounts and notes are row details, loaded when a payment is opened
+        payments_df = read_frame("""
+    SELECT PaymentID, PaymentDate, PayerName
+    FROM CRM_Payments
+    ORDER BY PaymentID DESC
 """, conn)
         conn.close()
         
@@ -1537,8 +3335,13 @@ def show_payments():
             else:
                 filtered_payments = payments_df
 
-            for _, payment in filtered_payments.iterrows():
-                with st.expander(f"{payment['PaymentID']} ({payment['PaymentDate']})"):
+            for payment, batch_ids in with_detail_batches(filtered_payments.to_dict('records'), 'PaymentID'):
+                expander, is_open = lazy_expander(f"{payment['PaymentID']} ({payment['PaymentDate']})",
+                                                  f"payment_open_{payment['PaymentID']}")
+                if not is_open:
+                    continue
+                payment = {**payment, **load_details('payments', batch_ids)[payment['PaymentID']]}
+                with expander:
                     col1, col2 = st.columns(2)
                     
                     with col1:
@@ -1563,13 +3366,84 @@ def show_payments():
     except Exception as e:
         st.error(f"Error loading payments: {e}")
 
+
+@st.fragment
+def add_payment_form():
+    """Add-payment form. Runs as a fragment so searching for a service or invoice only reruns the form."""
+    track_run('add_payment_form')
+    user = st.session_state.user
+
+    # Add new payment
+    with st.expander("Add New Payment"):
+        pick_service, pick_invoice = st.columns(2)
+        with pick_service:
+            service_id = search_picker("Service", "payment_service",
+                                       lambda text: search_services(text, user['id'], user['role']),
+                                       'ServiceID', "{ServiceID} - {ServiceType} ({CompanyName})")
+        with pick_invoice:
+            if service_id:
+                invoice_id = search_picker("Invoice ID", f"payment_invoice_{service_id}",
+                                           lambda text: search_invoices(text, service_id, user['id'], user['role']),
+                                           'InvoiceID', "{InvoiceID}")
+            else:
+                invoice_id = None
+                st.caption("Choose a service to pick one of its invoices")
+        with st.form("add_payment"):
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                payment_date = st.date_input("Payment Date")
+                type_of_payment = st.text_input("Type of Payment")
+                currency = st.selectbox("Currency", ['VND', 'USD', 'EUR', 'SGD', 'HKD', 'JPY'])
+                paid_amount = st.number_input("Paid Amount", min_value=0.0, format="%.2f")
+                conn = get_connection()
+                payment_types_df = pd.read_sql_query('SELECT DISTINCT PaymentType FROM CRM_Services WHERE PaymentType IS NOT NULL ORDER BY PaymentType', conn)
+                conn.close()
+                if len(payment_types_df) > 0:
+                    payment_type = st.selectbox("Payment Type",
+                                            options=[''] + payment_types_df['PaymentType'].tolist(),
+                                            format_func=lambda x: x if x else "Select Payment Type")
+                else:
+                    st.warning("No payment types found")
+                    payment_type = st.text_input("Payment Type")
+            
+            with col2:
+                exrate = st.number_input("Exchange Rate", min_value=0.0, value=1.0, format="%.4f")
+                payer_name = st.text_input("Payer Name")
+                received_account = st.text_input("Received Account")
+            
+            notes = st.text_area("Payment Notes")
+            
+            submit_payment = st.form_submit_button("Add Payment")
+            
+            if submit_payment:
+                if not invoice_id:
+                    st.error("Invoice ID is required!")
+                elif paid_amount <= 0:
+                    st.error("Paid Amount must be greater than 0!")
+                elif not payer_name.strip():
+                    st.error("Payer Name is required!")
+                else:
+                    try:
+                        # Insert the payment and update the invoice balance in one transaction
+                        balance = add_payment(invoice_id, payment_date, type_of_payment, paid_amount, currency,
+                                              exrate, payer_name, received_account, notes, payment_type,
+                                              service_id)
+                        if balance:
+                            st.toast(f"{invoice_id}: {balance[1]}, ${balance[0]:,.2f} outstanding")
+                        st.success(f"Payment record added successfully! ID: {invoice_id}")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error adding payment: {e}")
+
+
 def show_payment_progress():
     st.header("Payment Progress")
     
     try:
         conn = get_connection()
         # Get the billing data with minimum outstanding amount per invoice code
-        billing_df = pd.read_sql_query("""
+        billing_df = read_frame("""
             SELECT Date, InvoiceID, InvoiceCode, PaymentID, 
                                        FullAmount, PaymentAmount, OutstandingAmount
             FROM CRM_Billing 
@@ -1671,24 +3545,51 @@ def show_payment_progress():
 def show_documents():
     st.header("Document Management")
     
+    add_document_form()
+    
+    # Display documents
+    st.subheader("Document List")
+    
+    documents_df = get_documents(st.session_state.user['id'], st.session_state.user['role'])
+    
+    if len(documents_df) > 0:
+        # Filter by document type
+        doc_types = ['All'] + list(documents_df['DocumentType'].unique())
+        type_filter = st.selectbox("Filter by Type", doc_types)
+        
+        if type_filter != 'All':
+            filtered_df = documents_df[documents_df['DocumentType'] == type_filter]
+        else:
+            filtered_df = documents_df
+        
+        # Each row is its own fragment, see document_row
+        for doc in filtered_df.to_dict('records'):
+            document_row(doc)
+    else:
+        st.info("No documents found. Add your first document above!")
+
+
+@st.fragment
+def add_document_form():
+    """Add-document form. Runs as a fragment so searching for a customer only reruns the form."""
+    track_run('add_document_form')
+
     # Add new document
+    user = st.session_state.user
     with st.expander("Add New Document"):
+        customer_id = search_picker("Customer", "document_customer",
+                                    lambda text: search_customers(text, user['id'], user['role']),
+                                    'CustomerID', "{CustomerID} - {CompanyName}")
         with st.form("add_document"):
-            # Get customers and services
-            customers_df = get_customers_enhanced(st.session_state.user['id'], st.session_state.user['role'])
-            
-            if len(customers_df) > 0:
-                customer_id = st.selectbox("Customer", 
-                                         options=customers_df['CustomerID'].tolist(),
-                                         format_func=lambda x: f"{x} - {customers_df[customers_df['CustomerID']==x]['CompanyName'].iloc[0]}")
-                
+            if customer_id:
                 # Get services for selected customer
                 services_df = get_services_by_customer(customer_id)
                 service_id = None
                 if len(services_df) > 0:
+                    service_labels = label_index(services_df, 'ServiceID', "{ServiceID} - {ServiceType}")
                     service_id = st.selectbox("Service (Optional)", 
                                             options=[''] + services_df['ServiceID'].tolist(),
-                                            format_func=lambda x: f"{x} - {services_df[services_df['ServiceID']==x]['ServiceType'].iloc[0]}" if x else "No Service")
+                                            format_func=lambda x: service_labels[x] if x else "No Service")
                     if service_id == '':
                         service_id = None
                 
@@ -1703,10 +3604,11 @@ def show_documents():
                     # Get users for responsible person
                     users_df = get_all_users()
                     responsible_person = st.selectbox("Responsible Person", 
-                                                    options=users_df['id'].tolist(),
-                                                    format_func=lambda x: users_df[users_df['id']==x]['name'].iloc[0])
+                                                    options=users_df['UserID'].tolist(),
+                                                    format_func=label_index(users_df, 'UserID', "{Name}").get)
                 
                 notes = st.text_area("Document Notes")
+                uploaded_file = st.file_uploader("File (optional)")
                 
                 submit_document = st.form_submit_button("Add Document")
                 
@@ -1716,65 +3618,103 @@ def show_documents():
                     else:
                         doc_id = add_document(customer_id, service_id, document_type, 
                                             document_name, responsible_person, notes)
+                        if uploaded_file is not None:
+                            attach_document_file(doc_id, uploaded_file, uploaded_file.name, uploaded_file.type)
                         st.success(f"Document added successfully! ID: {doc_id}")
                         st.rerun()
             else:
-                st.warning("No customers available. Add customers first.")
-    
-    # Display documents
-    st.subheader("Document List")
-    
-    documents_df = get_documents(st.session_state.user['id'], st.session_state.user['role'])
-    
-    if len(documents_df) > 0:
-        # Filter by document type
-        doc_types = ['All'] + list(documents_df['DocumentType'].unique())
-        type_filter = st.selectbox("Filter by Type", doc_types)
+                st.info("Choose a customer above to add a document.")
+                st.form_submit_button("Add Document", disabled=True)
+
+
+@st.fragment
+def document_row(doc):
+    """One document expander. Status updates rerun only this fragment."""
+    track_run('document_row')
+
+    # Status saved since the list was loaded
+    saved_status = st.session_state.get(f"doc_saved_status_{doc['DocumentID']}")
+    if saved_status:
+        doc = {**doc, 'Status': saved_status}
+
+    with st.expander(f"{doc['DocumentName']} ({doc['CompanyName']})"):
+        col1, col2 = st.columns(2)
         
-        if type_filter != 'All':
-            filtered_df = documents_df[documents_df['DocumentType'] == type_filter]
-        else:
-            filtered_df = documents_df
+        with col1:
+            st.write(f"**Customer:** {doc['CompanyName']}")
+            st.write(f"**Service:** {doc['ServiceType'] or 'N/A'}")
+            st.write(f"**Document Type:** {doc['DocumentType']}")
+            st.write(f"**Status:** {doc['Status']}")
         
-        for idx, doc in filtered_df.iterrows():
-            with st.expander(f"{doc['DocumentName']} ({doc['CompanyName']})"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.write(f"**Customer:** {doc['CompanyName']}")
-                    st.write(f"**Service:** {doc['ServiceType'] or 'N/A'}")
-                    st.write(f"**Document Type:** {doc['DocumentType']}")
-                    st.write(f"**Status:** {doc['Status']}")
-                
-                with col2:
-                    st.write(f"**Created Date:** {doc['CreatedDate']}")
-                    st.write(f"**Responsible Person:** {doc['responsible_name']}")
-                
-                if doc['Notes']:
-                    st.write(f"**Notes:** {doc['Notes']}")
-                
-                # Status update
-                can_edit = (st.session_state.user['role'] == 'admin' or 
-                          doc['responsible_name'] == st.session_state.user['name'])
-                
-                if can_edit:
-                    status_options = ['Đang xử lý', 'Đã ký', 'Đã gửi', 'Đã nhận', 'Hủy bỏ']
-                    new_status =new_status = st.selectbox("Update Status", 
-                                             status_options,
-                                             index=status_options.index(doc['Status']) if doc['Status'] in status_options else 0,
-                                             key=f"doc_status_{doc['DocumentID']}")
-                    
-                    if st.button(f"Update Status", key=f"update_doc_{doc['DocumentID']}"):
-                        update_document_status(doc['DocumentID'], new_status)
-                        st.success(f"Document status updated to {new_status}")
-                        st.rerun()
-    else:
-        st.info("No documents found. Add your first document above!")
+        with col2:
+            st.write(f"**Created Date:** {doc['CreatedDate']}")
+            st.write(f"**Responsible Person:** {doc['responsible_name']}")
+        
+        if doc['Notes']:
+            st.write(f"**Notes:** {doc['Notes']}")
+
+        if pd.notna(doc.get('ContentHash')):
+            document_download(doc)
+        
+        # Status update
+        can_edit = (st.session_state.user['role'] == 'admin' or 
+                  doc['responsible_name'] == st.session_state.user['name'])
+        
+        if can_edit:
+            status_options = ['Đang xử lý', 'Đã ký', 'Đã gửi', 'Đã nhận', 'Hủy bỏ']
+            new_status = st.selectbox("Update Status", 
+                                     status_options,
+                                     index=status_options.index(doc['Status']) if doc['Status'] in status_options else 0,
+                                     key=f"doc_status_{doc['DocumentID']}")
+            
+            if st.button(f"Update Status", key=f"update_doc_{doc['DocumentID']}"):
+                update_document_status(doc['DocumentID'], new_status)
+                st.session_state[f"doc_saved_status_{doc['DocumentID']}"] = new_status
+                st.success(f"Document status updated to {new_status}")
+                rerun_fragment()
+
+
+def document_download(doc):
+    """
+    Download button for a document's file. The file is read from the store only
+    after "Prepare download" is clicked, and dropped again once downloaded.
+    """
+    store = get_document_store()
+    digest = doc['ContentHash']
+    if not store.exists(digest):
+        st.warning(f"📎 {doc['FileName']} is not in this server's document store.")
+        return
+    size = f"{doc['FileSize'] / 1024:,.0f} KB" if pd.notna(doc['FileSize']) else ""
+    ready_key = f"doc_ready_{doc['DocumentID']}"
+
+    if not st.session_state.get(ready_key):
+        if st.button(f"📎 Prepare download {size}".strip(), key=f"doc_prepare_{doc['DocumentID']}"):
+            st.session_state[ready_key] = True
+            rerun_fragment()
+        return
+
+    def downloaded():
+        st.session_state[ready_key] = False
+
+    st.download_button(f"⬇️ {doc['FileName']} {size}".strip(),
+                       data=store.read(digest),
+                       file_name=doc['FileName'],
+                       mime=doc['ContentType'] if pd.notna(doc['ContentType']) else None,
+                       on_click=downloaded,
+                       key=f"doc_download_{doc['DocumentID']}")
 
 def show_notifications():
     st.header("Notifications")
-    
-    notifications_df = get_notifications(st.session_state.user['id'], st.session_state.user['role'])
+    notification_list()
+
+
+@st.fragment(run_every=NOTIFICATION_POLL_SECONDS)
+def notification_list():
+    """Notification feed; polls like notification_badge and re-queries only on change."""
+    track_run('notification_list')
+    user_id, user_role = st.session_state.user['id'], st.session_state.user['role']
+    notifications_df = reload_on_change(f"list:{user_id}", get_notification_seq(),
+                                        lambda: get_notifications(user_id, user_role))
     
     if len(notifications_df) > 0:
         st.subheader("Recent Notifications")
@@ -1804,43 +3744,43 @@ def show_approvals():
     if len(pending_customers) > 0:
         st.subheader("Pending Customer Approvals")
         
-        for idx, customer in pending_customers.iterrows():
-            with st.expander(f"PENDING: {customer['CustomerID']} - {customer['CompanyName']}"):
+        for customer, batch_ids in with_detail_batches(pending_customers.to_dict('records'), 'CustomerID'):
+            expander, is_open = lazy_expander(f"PENDING: {customer['CustomerID']} - {customer['CompanyName']}",
+                                              f"pending_open_{customer['CustomerID']}")
+            if not is_open:
+                continue
+            customer = {**customer, **load_details('customers', batch_ids)[customer['CustomerID']]}
+            with expander:
                 col1, col2 = st.columns(2)
-                
+            
                 with col1:
                     st.write(f"**Company Name:** {customer['CompanyName']}")
-                    st.write(f"**Tax Code:** {customer['TaxCode'] or 'N/A'}")
-                    st.write(f"**Address:** {customer['Address'] or 'N/A'}")
+                    st.write(f"**Tax Code:** {customer.get('TaxCode') or 'N/A'}")
+                    st.write(f"**Address:** {customer.get('Address') or 'N/A'}")
                     st.write(f"**Country:** {customer['Country']}")
-                    st.write(f"**Category:** {customer['CustomerCategory']} - {customer['CompanyType']}")
-                    st.write(f"**Created Date:** {customer['CreatedDate']}")
-                
+                    st.write(f"**Category:** {customer.get('CustomerCategory')} - {customer.get('CompanyType')}")
+                    st.write(f"**Created Date:** {customer.get('CreatedDate')}")
+            
                 with col2:
-                    st.write(f"**Primary Contact:** {customer['ContactPerson1']}")
-                    st.write(f"**Primary Email:** {customer['ContactEmail1'] or 'N/A'}")
-                    st.write(f"**Primary Phone:** {customer['ContactPhone1'] or 'N/A'}")
-                    st.write(f"**Industry:** {customer['Industry'] or 'N/A'}")
-                    st.write(f"**Source:** {customer['Source'] or 'N/A'}")
+                    st.write(f"**Primary Contact:** {customer.get('ContactPerson1')}")
+                    st.write(f"**Primary Email:** {customer.get('ContactEmail1') or 'N/A'}")
+                    st.write(f"**Primary Phone:** {customer.get('ContactPhone1') or 'N/A'}")
+                    st.write(f"**Industry:** {customer.get('Industry') or 'N/A'}")
+                    st.write(f"**Source:** {customer.get('Source') or 'N/A'}")
                     st.write(f"**Assigned to:** {customer.get('AccountManager') or 'N/A'}")
                     st.write(f"**DEBUG - AccountManager value:** '{customer.get('AccountManager')}'")  # Remove this after testing
-                
+            
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.button(f"✅ Approve", key=f"approve_{customer['CustomerID']}", type="primary"):
                         approve_customer(customer['CustomerID'])
                         st.success(f"Customer {customer['CompanyName']} approved!")
                         st.rerun()
-                
+            
                 with col2:
                     if st.button(f"❌ Reject", key=f"reject_{customer['CustomerID']}"):
-                        # FIXED: Simplified delete
-                        conn = get_connection()
-                        cursor = conn.cursor()
-                        cursor.execute("DELETE FROM CRM_Customers WHERE CustomerID = ?", (customer['CustomerID'],))
-                        conn.commit()
-                        conn.close()
-                        
+                        delete_customers([customer['CustomerID']])
+                    
                         st.success(f"Customer {customer['CompanyName']} rejected and removed!")
                         st.rerun()
     else:
@@ -1855,10 +3795,17 @@ def show_reports():
     
     col1, col2, col3, col4 = st.columns(4)
     
-    customers_df = get_customers_enhanced(st.session_state.user['id'], st.session_state.user['role'])
-    services_df = get_all_services(st.session_state.user['id'], st.session_state.user['role'])
-    work_df = get_work_progress(st.session_state.user['id'], st.session_state.user['role'])
-    documents_df = get_documents(st.session_state.user['id'], st.session_state.user['role'])
+    user_id, user_role = st.session_state.user['id'], st.session_state.user['role']
+    data = prefetch({
+        'customers': (lambda: get_customers_enhanced(user_id, user_role), pd.DataFrame()),
+        'services': (lambda: get_all_services(user_id, user_role), pd.DataFrame()),
+        'work': (lambda: get_work_progress(user_id, user_role), pd.DataFrame()),
+        'documents': (lambda: get_documents(user_id, user_role), pd.DataFrame()),
+    })
+    customers_df = data['customers']
+    services_df = data['services']
+    work_df = data['work']
+    documents_df = data['documents']
     
     with col1:
         st.metric("Total Customers", len(customers_df))
@@ -1896,6 +3843,67 @@ def show_reports():
         # Progress histogram
         st.bar_chart(work_df['Progress'].value_counts().sort_index())
 
+def show_revenue_report():
+    st.header("Revenue Report")
+
+    # Fold in payments added since the last visit (usually none or a few)
+    try:
+        folded = refresh_revenue_rollups()
+        if folded:
+            st.caption(f"Added {folded:,} new payments to the revenue rollups")
+    except Exception as e:
+        st.warning(f"Could not refresh revenue rollups, showing the last refresh: {e}")
+
+    revenue_report(get_rollup_options())
+
+
+REVENUE_TOP_SEGMENTS = 8
+
+@st.fragment
+def revenue_report(options):
+    """
+    Revenue trend sliced from CRM_RevenueRollup. Filter changes rerun only
+    this fragment, which reuses `options` (get_rollup_options) from the page run.
+    """
+    track_run('revenue_report')
+
+    months = options['Month']
+    if not months:
+        st.info("No payments recorded yet.")
+        return
+
+    if len(months) > 1:
+        first, last = st.select_slider("Months", options=months, value=(months[max(0, len(months) - 12)], months[-1]))
+    else:
+        first = last = months[0]
+    filters = {}
+    for (label, column), filter_col in zip(ROLLUP_DIMENSIONS.items(), st.columns(len(ROLLUP_DIMENSIONS))):
+        with filter_col:
+            filters[column] = st.multiselect(label, options[column], format_func=lambda value: value or "(none)")
+    split_label = st.radio("Split by", list(ROLLUP_DIMENSIONS), horizontal=True)
+
+    df = get_revenue_slice(ROLLUP_DIMENSIONS[split_label], filters, (first, last))
+    if df.empty:
+        st.info("No revenue for this selection.")
+        return
+    df['Segment'] = df['Segment'].replace('', "(none)")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Revenue (USD)", f"${df['RevenueUSD'].sum():,.2f}")
+    with col2:
+        st.metric("Payments", f"{int(df['Payments'].sum()):,}")
+
+    totals = df.groupby('Segment')[['RevenueUSD', 'Payments']].sum().sort_values('RevenueUSD', ascending=False)
+    # Keep the chart readable: the largest segments, the rest as Other
+    top = set(totals.index[:REVENUE_TOP_SEGMENTS])
+    df['Segment'] = df['Segment'].where(df['Segment'].isin(top), "Other")
+    st.subheader(f"Monthly revenue by {split_label.lower()}")
+    st.bar_chart(df.pivot_table(index='Month', columns='Segment', values='RevenueUSD', aggfunc='sum', fill_value=0))
+
+    st.subheader(f"Totals by {split_label.lower()}")
+    st.dataframe(totals.rename(columns={'RevenueUSD': 'Revenue (USD)'}), use_container_width=True)
+
 # Add this to the end of your app.py file
 
 def main():
@@ -1906,6 +3914,8 @@ def main():
         initial_sidebar_state="expanded"
     )
     
+    track_run('app')
+
     # Initialize databases on startup
     if 'db_initialized' not in st.session_state:
         with st.spinner("Initializing databases..."):
@@ -1921,6 +3931,7 @@ def main():
 
 def show_dashboard():
     """Main dashboard with sidebar navigation"""
+    schedule_notification_rules()
     st.sidebar.title("Navigation")
     
     # Navigation menu
@@ -1936,7 +3947,8 @@ def show_dashboard():
             "User Management",
             "Customer Approvals",
             "Notifications",
-            "Reports"
+            "Reports",
+            "Revenue Report"
         ]
     else:
         menu_options = [
@@ -1972,11 +3984,46 @@ def show_dashboard():
     
     # Display notifications count in sidebar
     if st.session_state.user:
-        unread_count = get_unread_count(st.session_state.user['id'], st.session_state.user['role'])
-        if unread_count > 0:
-            st.sidebar.error(f"📢 {unread_count} unread notifications")
+        with st.sidebar:
+            notification_badge()
     
-    # Route to appropriate page
+    crm_status_banner()
+
+    try:
+        if crm_unavailable():
+            raise CircuitOpenError()  # skip the page's queries (and its fragments) entirely
+        show_page(selected_page)
+    except CircuitOpenError:
+        st.info("This page needs the CRM database. It will load again once the connection recovers.")
+
+    if st.session_state.user['role'] == 'admin':
+        show_session_diagnostics()
+
+@st.fragment(run_every=5)
+def crm_status_banner():
+    """
+    Degraded-mode banner while the CRM circuit is open (see storage.CircuitBreaker).
+    Polls the breaker, not the database, and reloads the page once it closes.
+    """
+    breaker = getattr(get_backend(), 'breaker', None)
+    if breaker is None:
+        return
+    if crm_unavailable():
+        st.session_state['crm_degraded'] = True
+        down_for = int(time.time() - breaker.opened_at)
+        st.error(f"⚠️ CRM database unavailable for {down_for}s, running in degraded mode. "
+                 f"Logins and notifications still work; CRM pages load again automatically "
+                 f"once a background check reconnects. Last error: {breaker.last_error}")
+    elif st.session_state.pop('crm_degraded', False):
+        st.rerun()
+
+def crm_unavailable():
+    """True while the CRM backend's circuit breaker is open."""
+    breaker = getattr(get_backend(), 'breaker', None)
+    return breaker is not None and breaker.is_open
+
+def show_page(selected_page):
+    """Route to the selected page."""
     if selected_page == "Dashboard":
         show_dashboard_home()
     elif selected_page == "Customer Management":
@@ -1999,41 +4046,63 @@ def show_dashboard():
         show_notifications()
     elif selected_page == "Reports":
         show_reports()
+    elif selected_page == "Revenue Report":
+        show_revenue_report()
+
+def show_session_diagnostics():
+    """Sidebar panel: full vs fragment runs and memory held by this session's loaded frames."""
+    with st.sidebar.expander("Session diagnostics"):
+        st.write("**Script runs**")
+        st.json(st.session_state.get('run_counts', {}))
+
+        frame_memory = st.session_state.get('frame_memory', {})
+        if frame_memory:
+            total_mb = sum(frame_memory.values()) / (1024 * 1024)
+            st.write(f"**Loaded frames:** {total_mb:.2f} MB")
+            st.json({name: f"{size / (1024 * 1024):.2f} MB" for name, size in frame_memory.items()})
+
+@st.fragment(run_every=NOTIFICATION_POLL_SECONDS)
+def notification_badge():
+    """
+    Unread-notification badge. Polls the notifications change sequence every
+    NOTIFICATION_POLL_SECONDS and recounts only when it has moved.
+    """
+    track_run('notification_badge')
+    user_id, user_role = st.session_state.user['id'], st.session_state.user['role']
+    unread_count = reload_on_change(f"unread:{user_id}", get_notification_seq(),
+                                    lambda: get_unread_count(user_id, user_role))
+    if unread_count > 0:
+        st.error(f"📢 {unread_count} unread notifications")
 
 def show_dashboard_home():
     st.title("📊 CRM Dashboard")
 
-    conn = get_connection()
-    
-    # Get dashboard statistics
-    stats = get_dashboard_stats()
+    user_id, user_role = st.session_state.user['id'], st.session_state.user['role']
+    empty_stats = {'customer_count': 0, 'service_count': 0, 'invoice_count': 0, 'group_count': 0,
+                   'task_stats': pd.DataFrame(), 'customer_progress': [], 'overdue_tasks': []}
+
+    # Independent queries, fetched concurrently
+    data = prefetch({
+        'stats': (get_dashboard_stats, empty_stats),
+        'services': (lambda: get_all_services(user_id, user_role), pd.DataFrame()),
+        'pending': ((get_pending_customers if user_role == 'admin' else pd.DataFrame), pd.DataFrame()),
+        'unread': (lambda: get_unread_count(user_id, user_role), 0),
+    })
+    stats = data['stats']
+    services_df = data['services']
+    task_stats_df = stats['task_stats']
     
     # Key metrics
     col1, col2, col3, col4 = st.columns(4)
     
-    customers_df = get_customers_enhanced(st.session_state.user['id'], st.session_state.user['role'])
-    services_df = get_all_services(st.session_state.user['id'], st.session_state.user['role'])
-    
     with col1:
-        count_df = pd.read_sql_query('SELECT COUNT(DISTINCT [Group]) as group_count FROM CRM_Customers WHERE [Group] IS NOT NULL', conn)
-        st.metric("Customer", len(count_df))
+        st.metric("Customer", stats['group_count'])
     with col2:
         st.metric("Active Services", len(services_df))
     with col3:
-        pending_count = len(get_pending_customers()) if st.session_state.user['role'] == 'admin' else 0
-        st.metric("Pending Approvals", pending_count)
+        st.metric("Pending Approvals", len(data['pending']))
     with col4:
-        unread_count = get_unread_count(st.session_state.user['id'], st.session_state.user['role'])
-        st.metric("Unread Notifications", unread_count)
-
-    task_stats_df = pd.read_sql_query("""
-                                      SELECT Status, COUNT(*) as Count
-                                      FROM CRM_Services 
-                                      WHERE Status IS NOT NULL
-                                      GROUP BY Status
-                                      ORDER BY Count DESC
-                                      """, conn)
-    conn.close()
+        st.metric("Unread Notifications", data['unread'])
 
     if len(task_stats_df) > 0:
         st.subheader("📋 Task Overview")
@@ -2049,58 +4118,28 @@ def show_dashboard_home():
     # Customer progress
     if stats['customer_progress']:
         st.subheader("📈 Customer Progress")
-        progress_df = pd.DataFrame(stats['customer_progress'], 
-                                 columns=['Customer ID', 'Company', 'Total Tasks', 'Completed'])
+        progress_df = pd.DataFrame(stats['customer_progress'],
+                                 columns=['Customer ID', 'Company', 'Total Tasks', 'Completed', 'Avg Progress %'])
         progress_df['Completion %'] = (progress_df['Completed'] / progress_df['Total Tasks'] * 100).round(1)
+        progress_df['Avg Progress %'] = progress_df['Avg Progress %'].round(1)
         st.dataframe(progress_df)
 
 def show_services():
     """Service management page"""
     st.header("Service Management")
     
-    # Add new service
-    with st.expander("Add New Service"):
-        with st.form("add_service"):
-            customers_df = get_customers_enhanced(st.session_state.user['id'], st.session_state.user['role'])
-            
-            if len(customers_df) > 0:
-                customer_id = st.selectbox("Customer", 
-                                         options=customers_df['CustomerID'].tolist(),
-                                         format_func=lambda x: f"{x} - {customers_df[customers_df['CustomerID']==x]['CompanyName'].iloc[0]}")
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    service_type = st.selectbox("Service Type", 
-                                                options=pd.read_sql_query('SELECT DISTINCT ServiceType FROM CRM_ServiceCatalog ORDER BY ServiceType', get_connection())['ServiceType'].tolist())
-                    start_date = st.date_input("Start Date")
-                    package_code = st.text_input("Package Code")
-                
-                with col2:
-                    expected_end_date = st.date_input("Expected End Date")
-                    partner = st.text_input("Partner")
-                
-                description = st.text_area("Service Description")
-                
-                submit_service = st.form_submit_button("Add Service")
-                
-                if submit_service:
-                    service_id = add_service(customer_id, service_type, description, 
-                                           start_date, expected_end_date, package_code, partner)
-                    st.success(f"Service added successfully! ID: {service_id}")
-                    st.rerun()
-            else:
-                st.warning("No customers available. Add customers first.")
+    add_service_form()
     
     # Display services
     st.subheader("Previous Service")
     try:
         conn = get_connection()
-        services_df = pd.read_sql_query("""
-           SELECT s.*, c.[Group] as CustomerGroup, c.CompanyName
+        services_df = pd.read_sql_query(f"""
+           SELECT s.ServiceID, s.CustomerID, s.ServiceType, s.StartDate, s.ExpectedEndDate,
+                  c.{q("Group")} as CustomerGroup, c.CompanyName
            FROM CRM_Services s
            JOIN CRM_Customers c ON s.CustomerID = c.CustomerID
-           ORDER BY c.[Group], s.ServiceID DESC
+           ORDER BY c.{q("Group")}, s.ServiceID DESC
         """, conn)
         conn.close()
         if len(services_df) > 0:
@@ -2114,8 +4153,12 @@ def show_services():
             else:
                 filtered_services = services_df
         
-            for idx, service in filtered_services.iterrows():
-                with st.expander(f"{service['ServiceType']}"):
+            for service, batch_ids in with_detail_batches(filtered_services.to_dict('records'), 'ServiceID'):
+                expander, is_open = lazy_expander(f"{service['ServiceType']}", f"service_open_{service['ServiceID']}")
+                if not is_open:
+                    continue
+                service = {**service, **load_details('services', batch_ids)[service['ServiceID']]}
+                with expander:
                     col1, col2 = st.columns(2)
                 
                     with col1:
@@ -2149,30 +4192,141 @@ def show_services():
     except:
         st.error(f"Error loading services: {e}")
 
-# Add missing utility functions
-def delete_customer(customer_id):
-    """Delete customer and related records"""
+
+@st.fragment
+def add_service_form():
+    """Add-service form. Runs as a fragment so searching for a customer only reruns the form."""
+    track_run('add_service_form')
+    user = st.session_state.user
+
+    # Add new service
+    with st.expander("Add New Service"):
+        customer_id = search_picker("Customer", "service_customer",
+                                    lambda text: search_customers(text, user['id'], user['role']),
+                                    'CustomerID', "{CustomerID} - {CompanyName}")
+        with st.form("add_service"):
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                service_type = st.selectbox("Service Type", 
+                                            options=pd.read_sql_query('SELECT DISTINCT ServiceType FROM CRM_ServiceCatalog ORDER BY ServiceType', get_connection())['ServiceType'].tolist())
+                start_date = st.date_input("Start Date")
+                package_code = st.text_input("Package Code")
+            
+            with col2:
+                expected_end_date = st.date_input("Expected End Date")
+                partner = st.text_input("Partner")
+            
+            description = st.text_area("Service Description")
+            
+            submit_service = st.form_submit_button("Add Service")
+            
+            if submit_service:
+                if not customer_id:
+                    st.error("Choose a customer first!")
+                else:
+                    service_id = add_service(customer_id, service_type, description, 
+                                           start_date, expected_end_date, package_code, partner)
+                    st.success(f"Service added successfully! ID: {service_id}")
+                    st.rerun()
+
+
+# ---------- Customer deletion (SQL Server + auth.db) ----------
+# Dependent rows, children before parents: (table, condition). {keys} is the
+# scratch table holding the customer IDs being deleted.
+CUSTOMER_CASCADE = [
+    ('CRM_DocumentFiles', "DocumentID IN (SELECT d.DocumentID FROM ClientDocuments d JOIN {keys} k ON d.CustomerID = k.CustomerID)"),
+    ('ClientDocuments', "CustomerID IN (SELECT CustomerID FROM {keys})"),
+    ('WorkProgress', "ServiceID IN (SELECT s.ServiceID FROM CRM_Services s JOIN {keys} k ON s.CustomerID = k.CustomerID)"),
+    # Payments entered through the payment form carry only the InvoiceID
+    ('CRM_Payments', "InvoiceID IN (SELECT i.InvoiceID FROM CRM_Payments i JOIN {keys} k ON i.CustomerID = k.CustomerID)"),
+    ('CRM_Invoice', "ServiceID IN (SELECT s.ServiceID FROM CRM_Services s JOIN {keys} k ON s.CustomerID = k.CustomerID)"),
+    ('CRM_Payments', "CustomerID IN (SELECT CustomerID FROM {keys})"),
+    ('CRM_Services', "CustomerID IN (SELECT CustomerID FROM {keys})"),
+    ('CRM_CustomerProgress', "CustomerID IN (SELECT CustomerID FROM {keys})"),
+    ('CRM_Customers', "CustomerID IN (SELECT CustomerID FROM {keys})"),
+]
+# Rule notifications (invoice_due, service_due) relate to an invoice or
+# service, so they are found through the customer on their notification_keys row
+CUSTOMER_NOTIFICATIONS = ("id IN (SELECT nk.notification_id FROM notification_keys nk "
+                          "JOIN {keys} k ON nk.customer_id = k.CustomerID)")
+AUTH_CUSTOMER_CASCADE = [
+    ('customer_meta', "CustomerID IN (SELECT CustomerID FROM {keys})"),
+    ('notifications', CUSTOMER_NOTIFICATIONS),
+    ('notifications_archive', CUSTOMER_NOTIFICATIONS),
+    ('notifications', "related_id IN (SELECT CustomerID FROM {keys})"),
+    ('notifications_archive', "related_id IN (SELECT CustomerID FROM {keys})"),
+    ('notification_keys', "customer_id IN (SELECT CustomerID FROM {keys})"),
+]
+
+def drop_temp_table(cursor, dialect, table):
+    """
+    Drop a scratch table if it exists. Runs from `finally` blocks, so a failure
+    is only logged and never replaces the exception being handled.
+    """
     try:
-        crm_conn = get_connection()
-        cursor = crm_conn.cursor()
-        
-        # Delete in order: invoices -> services -> customer
-        cursor.execute("DELETE FROM CRM_Payments WHERE CustomerID = ?", (customer_id,))
-        cursor.execute("DELETE FROM CRM_Services WHERE CustomerID = ?", (customer_id,))
-        cursor.execute("DELETE FROM CRM_Customers WHERE CustomerID = ?", (customer_id,))
-        
-        crm_conn.commit()
+        cursor.execute(dialect.drop_temp_table_sql(table))
+    except Exception as e:
+        print(f"⚠️ Could not drop {table}: {e}")
+
+def delete_cascade(conn, dialect, customer_ids, cascade):
+    """
+    Load the IDs into a scratch table once, then clear each table in `cascade`
+    with one DELETE against it. One transaction; returns {table: rows deleted}.
+    """
+    keys = dialect.temp_table('delete_customers')
+    cursor = conn.cursor()
+    if hasattr(cursor, 'fast_executemany'):
+        cursor.fast_executemany = True  # pyodbc: send the IDs in one round trip
+    counts = {}
+    try:
+        cursor.execute(f"CREATE TABLE {keys} (CustomerID {dialect.types['key']} PRIMARY KEY)")
+        cursor.executemany(f"INSERT INTO {keys} (CustomerID) VALUES (?)", [(cid,) for cid in customer_ids])
+        for table, condition in cascade:
+            cursor.execute(f"DELETE FROM {table} WHERE {condition.format(keys=keys)}")
+            counts[table] = counts.get(table, 0) + max(cursor.rowcount, 0)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        drop_temp_table(cursor, dialect, keys)
+    return counts
+
+def delete_customers(customer_ids):
+    """
+    Delete customers with their services, tasks, invoices, payments, documents
+    and auth.db metadata/notifications, set-based, one transaction per
+    database. Returns {table: rows deleted}. Stored document files are
+    content-addressed and possibly shared, so they stay in the store.
+    """
+    customer_ids = list(dict.fromkeys(customer_ids))
+    if not customer_ids:
+        return {}
+
+    crm_conn = get_connection()
+    try:
+        counts = delete_cascade(crm_conn, get_backend().dialect, customer_ids, CUSTOMER_CASCADE)
+    finally:
         crm_conn.close()
-        
-        # Delete from auth.db
-        auth_conn = get_auth_connection()
-        cursor = auth_conn.cursor()
-        cursor.execute("DELETE FROM customer_meta WHERE CustomerID = ?", (customer_id,))
-        cursor.execute("DELETE FROM notifications WHERE related_id = ?", (customer_id,))
-        auth_conn.commit()
+    invalidate_snapshots()
+
+    auth_conn = get_auth_connection()
+    try:
+        counts.update(delete_cascade(auth_conn, SQLITE, customer_ids, AUTH_CUSTOMER_CASCADE))
+    finally:
         auth_conn.close()
-        
-        return True, "Customer deleted successfully!"
+
+    print(f"🗑️ Deleted {counts['CRM_Customers']:,} customers: "
+          + ", ".join(f"{table} {count:,}" for table, count in counts.items() if count and table != 'CRM_Customers'))
+    return counts
+
+def delete_customer(customer_id):
+    """Delete customer and related records"""
+    try:
+        counts = delete_customers([customer_id])
+        related = sum(count for table, count in counts.items() if table != 'CRM_Customers')
+        return True, f"Customer deleted successfully! ({related} related records removed)"
     except Exception as e:
         return False, f"Error deleting customer: {str(e)}"
 
@@ -2188,9 +4342,10 @@ def delete_user(user_id):
         cursor.execute("DELETE FROM notifications WHERE user_id = ?", (user_id,))
         # Delete user
         cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        
+
         auth_conn.commit()
         auth_conn.close()
+        invalidate_snapshots('customers', 'services')
         
         return True, "User deleted successfully!"
     except Exception as e:
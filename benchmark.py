@@ -0,0 +1,772 @@
+"""
+Benchmark suite for the CRM data functions and page renders.
+
+Runs against the SQLite stand-in built by seed_data.py, so no SQL Server is
+needed. Every data function is timed directly and every page is rendered
+through Streamlit's AppTest; p50/p95 latency and peak traced memory are
+reported for each.
+
+Usage:
+    python benchmark.py --rows 10000                 # seed bench_data/ and run everything
+    python benchmark.py --data bench_data --skip-pages
+    python benchmark.py --rows 1000 --json bench_output.json
+    python benchmark.py --data bench_data --document-mb 100 --skip-pages
+    python benchmark.py --data bench_data --without-indexes   # "before" numbers for the index catalog
+
+One section on its own: skip the others. The full set of section flags is
+    --skip-functions --skip-compact --skip-labels --skip-documents --skip-breaker --skip-rollups
+    --skip-fetch --skip-notifications --skip-retention --skip-round-trips --skip-pages
+and each example below passes all of them but its own:
+    # circuit breaker against a fake SQL Server driver
+    python benchmark.py --data bench_data --skip-functions --skip-compact --skip-labels --skip-documents --skip-rollups \\
+        --skip-fetch --skip-notifications --skip-retention --skip-round-trips --skip-pages
+    # revenue rollups against aggregating every payment, plus rebuild and refresh
+    python benchmark.py --data bench_data --skip-functions --skip-compact --skip-labels --skip-documents --skip-breaker \\
+        --skip-fetch --skip-notifications --skip-retention --skip-round-trips --skip-pages
+    # large reads: read_sql_query vs columnar read_frame
+    python benchmark.py --data bench_data --skip-functions --skip-compact --skip-labels --skip-documents --skip-breaker \\
+        --skip-rollups --skip-notifications --skip-retention --skip-round-trips --skip-pages
+    # notification rules
+    python benchmark.py --data bench_data --skip-functions --skip-compact --skip-labels --skip-documents --skip-breaker \\
+        --skip-rollups --skip-fetch --skip-retention --skip-round-trips --skip-pages
+    # notification retention job against a live session
+    python benchmark.py --data bench_data --skip-functions --skip-compact --skip-labels --skip-documents --skip-breaker \\
+        --skip-rollups --skip-fetch --skip-notifications --skip-round-trips --skip-pages
+    # CRM round trips per page render (query batches)
+    python benchmark.py --rows 100 --skip-functions --skip-compact --skip-labels --skip-documents --skip-breaker \\
+        --skip-rollups --skip-fetch --skip-notifications --skip-retention --skip-pages
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import seed_data
+import storage
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+ADMIN_USER = {'id': 'ADMIN', 'email': 'admin@company.com', 'role': 'admin', 'name': 'Admin User'}
+
+PAGES = [
+    "Dashboard",
+    "Customer Management",
+    "Service Management",
+    "Work Progress",
+    "Document Management",
+    "Payment Management",
+    "Payment Progress",
+    "User Management",
+    "Customer Approvals",
+    "Notifications",
+    "Reports",
+    "Revenue Report",
+]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def measure(fn, iterations):
+    """
+    Call fn() `iterations` times untraced for latency (ms), then once more under
+    tracemalloc for peak memory (MB). Returns (latencies, peak_mb, last result).
+    """
+    latencies = []
+    result = None
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return latencies, peak / (1024 * 1024), result
+
+
+def summarize(name, latencies, peak_mb, **extra):
+    return {
+        'name': name,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'peak_mb': round(peak_mb, 2),
+        **extra,
+    }
+
+
+def data_functions(app, user):
+    """Named zero-argument callables covering the data layer."""
+    uid, role = user['id'], user['role']
+    return [
+        ('get_customers_enhanced', lambda: app.get_customers_enhanced(uid, role)),
+        ('get_pending_customers', app.get_pending_customers),
+        ('get_customer_field_options', app.get_customer_field_options),
+        ('get_all_users', app.get_all_users),
+        ('get_all_services', lambda: app.get_all_services(uid, role)),
+        ('get_work_progress', lambda: app.get_work_progress(uid, role)),
+        ('get_documents', lambda: app.get_documents(uid, role)),
+        ('get_notifications', lambda: app.get_notifications(uid, role)),
+        ('get_unread_count', lambda: app.get_unread_count(uid, role)),
+        ('get_notification_seq', app.get_notification_seq),
+        ('get_dashboard_stats', app.get_dashboard_stats),
+        ('get_task_counts', lambda: app.get_task_counts(uid, role)),
+        ('get_task_page (page 10)', lambda: app.get_task_page(app.TASK_STATUSES[0], 10, uid, role)),
+        ('get_overdue_tasks', lambda: app.get_overdue_tasks(app.OVERDUE_LIMIT, uid, role)),
+        ('reports loaders (serial)', lambda: {name: fn() for name, (fn, _) in report_loaders(app, uid, role).items()}),
+        ('reports loaders (prefetch)', lambda: app.prefetch(report_loaders(app, uid, role))),
+    ]
+
+
+def report_loaders(app, uid, role):
+    """The show_reports datasets, in the shape app.prefetch() takes."""
+    return {
+        'customers': (lambda: app.get_customers_enhanced(uid, role), None),
+        'services': (lambda: app.get_all_services(uid, role), None),
+        'work': (lambda: app.get_work_progress(uid, role), None),
+        'documents': (lambda: app.get_documents(uid, role), None),
+    }
+
+
+def simulate_rtt(app, rtt_ms):
+    """Delay every CRM connect by rtt_ms, approximating a WAN round trip to SQL Server."""
+    connect = app.get_connection
+
+    def slow_connect():
+        time.sleep(rtt_ms / 1000)
+        return connect()
+
+    app.get_connection = slow_connect
+
+
+def bench_functions(iterations, user=ADMIN_USER, rtt_ms=0):
+    import app
+
+    if rtt_ms:
+        simulate_rtt(app, rtt_ms)
+    results = []
+    for name, fn in data_functions(app, user):
+        latencies, peak_mb, result = measure(fn, iterations)
+        rows = len(result) if hasattr(result, '__len__') and not isinstance(result, dict) else None
+        frame_mb = None
+        if hasattr(result, 'memory_usage'):
+            frame_mb = round(result.memory_usage(deep=True).sum() / (1024 * 1024), 2)
+        results.append(summarize(name, latencies, peak_mb, rows=rows, frame_mb=frame_mb))
+    return results
+
+
+def bench_compact(iterations, user=ADMIN_USER):
+    """
+    Compare loader frames as plain object columns against app.compact_frame:
+    in-memory size and the cost of the page filters (Group / Country / status).
+    """
+    import app
+
+    results = []
+    frames = [
+        ('customers', app.get_customers_enhanced(user['id'], user['role']), ['Group', 'Country', 'status']),
+        ('services', app.get_all_services(user['id'], user['role']), ['ServiceType', 'Status']),
+    ]
+    for name, compact_df, filter_columns in frames:
+        if compact_df.empty:
+            continue
+        object_df = compact_df.astype({c: object for c in compact_df.columns
+                                       if str(compact_df[c].dtype) == 'category'})
+        for label, df in (('object', object_df), ('compact', compact_df)):
+            values = {c: df[c].dropna().iloc[0] for c in filter_columns}
+
+            def run_filters():
+                return [df[df[c] == v] for c, v in values.items()]
+
+            latencies, peak_mb, _ = measure(run_filters, iterations)
+            frame_mb = round(df.memory_usage(deep=True).sum() / (1024 * 1024), 2)
+            results.append(summarize(f"{name} filters ({label})", latencies, peak_mb,
+                                     rows=len(df), frame_mb=frame_mb))
+    return results
+
+
+def bench_pages(iterations, user=ADMIN_USER, timeout=600):
+    from streamlit.testing.v1 import AppTest
+
+    results = []
+    for page in PAGES:
+        errors = []
+
+        def render():
+            at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+            at.session_state['db_initialized'] = True
+            at.session_state['user'] = dict(user)
+            at.session_state['current_page'] = page
+            at.run()
+            errors[:] = [e.message for e in at.exception]
+            return at
+
+        latencies, peak_mb, _ = measure(render, iterations)
+        results.append(summarize(page, latencies, peak_mb, errors=errors[:1]))
+    return results
+
+
+def bench_labels(sizes, iterations):
+    """
+    Time building every selectbox label for n services: the old per-option
+    DataFrame filter (O(n^2)) against app.label_index (O(n)).
+    """
+    import pandas as pd
+    import app
+
+    results = []
+    for n in sizes:
+        services_df = pd.DataFrame({
+            'ServiceID': [f"DV{i:08d}" for i in range(n)],
+            'ServiceType': [seed_data.SERVICE_TYPES[i % len(seed_data.SERVICE_TYPES)] for i in range(n)],
+            'CompanyName': [f"Company {i}" for i in range(n)],
+        })
+        options = services_df['ServiceID'].tolist()
+
+        def filtered():
+            fmt = lambda x: f"{x} - {services_df[services_df['ServiceID']==x]['ServiceType'].iloc[0]} ({services_df[services_df['ServiceID']==x]['CompanyName'].iloc[0]})"
+            return [fmt(x) for x in options]
+
+        def indexed():
+            labels = app.label_index(services_df, 'ServiceID', "{ServiceID} - {ServiceType} ({CompanyName})")
+            return [labels[x] for x in options]
+
+        for name, fn in (('filter per option', filtered), ('label_index', indexed)):
+            latencies, peak_mb, _ = measure(fn, iterations)
+            results.append(summarize(f"{name} n={n}", latencies, peak_mb, rows=n))
+    return results
+
+
+def bench_documents(size_mb, iterations):
+    """
+    Stream a size_mb file into a scratch document store, read it back in
+    chunks and verify it. Peak memory should stay near filestore.CHUNK_SIZE.
+    """
+    import filestore
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        store = filestore.ContentStore(root)
+        source = os.path.join(root, "scan.bin")
+        with open(source, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+        def put():
+            with open(source, "rb") as f:
+                return store.put(f)
+
+        digest = put()[0]
+
+        def stream():
+            return sum(len(chunk) for chunk in store.iter_chunks(digest))
+
+        for name, fn in (('put (dedup)', put), ('iter_chunks', stream), ('verify', lambda: store.verify(digest))):
+            latencies, peak_mb, _ = measure(fn, iterations)
+            results.append(summarize(f"{name} {size_mb} MB", latencies, peak_mb))
+    return results
+
+
+def strip_indexes(crm_path, auth_path):
+    """
+    Copy the stand-in to a scratch directory and drop every catalog index from
+    the copy (storage.INDEX_CATALOGS). The migrations stay recorded, so the app
+    does not recreate them. Returns the copied (crm_path, auth_path).
+    """
+    scratch = tempfile.mkdtemp(prefix="bench_noindex_")
+    paths = {'crm': os.path.join(scratch, "crm.db"), 'auth': os.path.join(scratch, "auth.db")}
+    for database, source in (('crm', crm_path), ('auth', auth_path)):
+        shutil.copyfile(source, paths[database])
+        conn = sqlite3.connect(paths[database])
+        for name, (table, _) in storage.INDEX_CATALOGS[database].items():
+            conn.execute(storage.SQLITE.drop_index_sql(name, table))
+        conn.commit()
+        conn.close()
+    print(f"Catalog indexes dropped in a copy at {scratch}")
+    return paths['crm'], paths['auth']
+
+
+class FakeDriver:
+    """
+    Stand-in for pyodbc with injectable faults, for exercising the SQL Server
+    path without a server. `latency` delays every connect (a login that takes
+    longer than its timeout fails like a real login timeout); `down` makes
+    every connect fail.
+    """
+
+    class Error(Exception):
+        pass
+
+    class Connection:
+        timeout = 0
+
+        def close(self):
+            pass
+
+    def __init__(self, latency=0.0, down=False):
+        self.latency = latency
+        self.down = down
+        self.connects = 0
+
+    def connect(self, conn_str, timeout=0):
+        self.connects += 1
+        if timeout and self.latency > timeout:
+            time.sleep(timeout)
+            raise self.Error("Login timeout expired")
+        time.sleep(self.latency)
+        if self.down:
+            raise self.Error("TCP Provider: No connection could be made")
+        return self.Connection()
+
+
+class CountingConnection:
+    """
+    Wraps a sqlite3 connection and counts every execute() as one round trip
+    to the server. With `batches`, an execute() may carry several statements
+    separated by ";\\n" (app.query_batch on SQL Server); they run one by one
+    here and their result sets are read back with nextset() as from pyodbc.
+    """
+
+    def __init__(self, conn, counts, batches=False):
+        self._conn = conn
+        self._counts = counts
+        self._batches = batches
+
+    def cursor(self):
+        return CountingCursor(self._conn.cursor(), self._counts, self._batches)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class CountingCursor:
+    def __init__(self, cursor, counts, batches):
+        self._cursor = cursor
+        self._counts = counts
+        self._batches = batches
+        self._sets = None
+
+    def execute(self, sql, params=()):
+        self._counts['round_trips'] += 1
+        statements = [part for part in sql.split(";\n") if part.strip() and part.strip() != "SET NOCOUNT ON"]
+        if not self._batches or len(statements) < 2:
+            self._sets = None
+            self._cursor.execute(sql, params)
+            return self
+        params = list(params)
+        self._sets = []
+        for statement in statements:
+            count = statement.count("?")
+            self._cursor.execute(statement, params[:count])
+            params = params[count:]
+            self._sets.append((self._cursor.description, self._cursor.fetchall()))
+        return self
+
+    def executemany(self, sql, rows):
+        self._counts['round_trips'] += 1
+        self._cursor.executemany(sql, rows)
+        return self
+
+    @property
+    def description(self):
+        return self._sets[0][0] if self._sets else self._cursor.description
+
+    def fetchall(self):
+        return self._sets[0][1] if self._sets else self._cursor.fetchall()
+
+    def nextset(self):
+        if not self._sets:
+            return False
+        self._sets.pop(0)
+        return bool(self._sets)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def bench_round_trips(user=ADMIN_USER, batches=True, timeout=600):
+    """
+    CRM round trips and connections per page render (warm caches), counted
+    through CountingConnection. With `batches` the SQLite backend accepts
+    multi-statement batches the way SQL Server does, so app.query_batch
+    takes its one-round-trip path.
+    """
+    import warnings
+    from streamlit.testing.v1 import AppTest
+
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+    backend = storage.get_backend()
+    connect, dialect = backend.connect, backend.dialect
+    counts = {'round_trips': 0, 'connections': 0}
+
+    def counting_connect():
+        counts['connections'] += 1
+        return CountingConnection(connect(), counts, batches)
+
+    backend.connect = counting_connect
+    if batches:
+        backend.dialect = type("BatchingSQLiteDialect", (type(dialect),), {'multiple_result_sets': True})()
+    results = []
+    try:
+        for page in PAGES:
+            at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+            at.session_state['db_initialized'] = True
+            at.session_state['user'] = dict(user)
+            at.session_state['current_page'] = page
+            at.run()  # warm the shared snapshots and caches
+            counts.update(round_trips=0, connections=0)
+            at.run()
+            results.append({'name': page, **counts, 'errors': [e.message for e in at.exception][:1]})
+    finally:
+        backend.connect, backend.dialect = connect, dialect
+    return results
+
+
+def bench_breaker(iterations, latency=0.02, login_timeout=1, probe_interval=0.5):
+    """
+    Connect latency on the SQL Server path through FakeDriver: healthy, a
+    hung server before the circuit opens (bounded by the login timeout per
+    connection string), with the circuit open, and after the probe recovers.
+    """
+    driver = FakeDriver(latency)
+    backend = storage.SQLServerBackend("fake", "1433", "crm", "user", "password", driver=driver,
+                                       login_timeout=login_timeout,
+                                       breaker_options={'failures': 2, 'probe_interval': probe_interval})
+
+    def connect():
+        try:
+            backend.connect().close()
+            return True
+        except Exception:
+            return False
+
+    results = []
+    latencies, peak_mb, _ = measure(connect, iterations)
+    results.append(summarize("healthy", latencies, peak_mb))
+
+    driver.latency = login_timeout * 10  # server hangs on login
+    before = driver.connects
+    latencies = []
+    while not backend.breaker.is_open:
+        started = time.perf_counter()
+        connect()
+        latencies.append((time.perf_counter() - started) * 1000)
+    results.append(summarize("hung, circuit closed", latencies, 0, connects=driver.connects - before))
+
+    before = driver.connects
+    latencies, peak_mb, _ = measure(connect, iterations)
+    results.append(summarize("circuit open", latencies, peak_mb, connects=driver.connects - before))
+
+    driver.latency = latency
+    started = time.perf_counter()
+    while backend.breaker.is_open:
+        time.sleep(0.01)
+    recovered_ms = (time.perf_counter() - started) * 1000
+    latencies, peak_mb, _ = measure(connect, iterations)
+    results.append(summarize("recovered", latencies, peak_mb, recovered_after_ms=round(recovered_ms)))
+    return results
+
+
+def bench_rollups(iterations):
+    """
+    Revenue report reads: slicing CRM_RevenueRollup against aggregating every
+    payment on the fly, plus the cost of a rebuild and of a refresh with
+    nothing new to fold in.
+    """
+    import app
+
+    results = []
+    started = time.perf_counter()
+    folded = app.refresh_revenue_rollups(rebuild=True, settle_seconds=0)  # nothing writes payments here
+    results.append(summarize("rebuild", [(time.perf_counter() - started) * 1000], 0, payments=folded))
+    latencies, peak_mb, _ = measure(app.refresh_revenue_rollups, iterations)
+    results.append(summarize("refresh (nothing new)", latencies, peak_mb))
+
+    months = app.get_rollup_options()['Month']
+    span = (months[0], months[-1]) if months else ('', '')
+    latencies, peak_mb, _ = measure(lambda: app.get_revenue_slice('CustomerGroup', {}, span), iterations)
+    results.append(summarize("slice rollup by group", latencies, peak_mb))
+
+    def scan():
+        conn = app.get_connection()
+        try:
+            return conn.execute(app.revenue_delta_sql(app.get_backend().dialect), (0, 2 ** 62)).fetchall()
+        finally:
+            conn.close()
+
+    latencies, peak_mb, _ = measure(scan, iterations)
+    results.append(summarize("aggregate all payments", latencies, peak_mb))
+    return results
+
+
+def bench_notifications(iterations):
+    """
+    Notification rules with a due window wide enough to match every open
+    invoice and unfinished service: the first run raises one notification
+    per match, reruns find them all in notification_keys. Runs against a
+    scratch copy of auth.db.
+    """
+    import datetime
+    import app
+
+    auth_path = os.environ["AUTH_DB_PATH"]
+    due_days = app.NOTIFY_DUE_DAYS
+    today = datetime.date(2015, 1, 1)
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        os.environ["AUTH_DB_PATH"] = shutil.copy(auth_path, os.path.join(scratch, "auth.db"))
+        app.NOTIFY_DUE_DAYS = 365 * 20
+        try:
+            started = time.perf_counter()
+            added = app.run_notification_rules(today)
+            results.append(summarize("first run", [(time.perf_counter() - started) * 1000], 0,
+                                     rows=sum(added.values())))
+            latencies, peak_mb, added = measure(lambda: app.run_notification_rules(today), iterations)
+            results.append(summarize("rerun (all deduplicated)", latencies, peak_mb, rows=sum(added.values())))
+        finally:
+            app.NOTIFY_DUE_DAYS = due_days
+            os.environ["AUTH_DB_PATH"] = auth_path
+    return results
+
+
+def bench_retention(rows=100000):
+    """
+    Notification retention over `rows` old read notifications, batched
+    (ARCHIVE_BATCH_SIZE rows per transaction) against one transaction for
+    the lot. While the job runs, a live session keeps reading the unread
+    count and marking a notification read; its latencies and lock errors
+    show whether the job blocks sessions. Each run gets a scratch copy of
+    auth.db.
+    """
+    import threading
+    import app
+
+    auth_path = os.environ["AUTH_DB_PATH"]
+    results = []
+    for label, batch_size in ((f"batches of {app.ARCHIVE_BATCH_SIZE}", app.ARCHIVE_BATCH_SIZE),
+                              ("one transaction", rows + 1)):
+        with tempfile.TemporaryDirectory() as scratch:
+            os.environ["AUTH_DB_PATH"] = shutil.copy(auth_path, os.path.join(scratch, "auth.db"))
+            try:
+                conn = app.get_auth_connection()
+                conn.executescript(app.NOTIFICATION_ARCHIVE_SQL + ";" + app.NOTIFICATION_KEYS_SQL)
+                conn.execute('''
+                    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                    INSERT INTO notifications (id, user_id, message, type, related_id, read, created_at)
+                    SELECT 'old-' || i, NULL, 'Invoice ' || i || ' is due', 'invoice_due', i, 1,
+                           datetime('now', '-' || (60 + i % 300) || ' days')
+                    FROM n
+                ''', (rows,))
+                conn.execute("INSERT INTO notifications (id, message, type) VALUES ('live', 'live', 'test')")
+                conn.commit()
+                conn.close()
+
+                result = {}
+                job = threading.Thread(target=lambda: result.update(app.archive_notifications(archive_days=0,
+                                                                                              batch_size=batch_size)))
+                latencies, errors = [], 0
+                started = time.perf_counter()
+                job.start()
+                while job.is_alive():
+                    call_started = time.perf_counter()
+                    try:
+                        app.get_unread_count('ADMIN', 'admin')
+                        app.mark_notification_read('live')
+                    except sqlite3.OperationalError:
+                        errors += 1
+                    latencies.append((time.perf_counter() - call_started) * 1000)
+                    time.sleep(0.01)
+                job.join()
+                results.append({**summarize(f"retention, {label}", latencies, 0, rows=result.get('archived', 0)),
+                                'job_s': round(time.perf_counter() - started, 1),
+                                'max_ms': round(max(latencies, default=0), 1), 'lock_errors': errors})
+            finally:
+                os.environ["AUTH_DB_PATH"] = auth_path
+    return results
+
+
+def print_retention(title, results):
+    print(f"\n{title}")
+    print(f"  {'name':<34} {'job s':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'locked':>7}")
+    for r in results:
+        print(f"  {r['name']:<34} {r['job_s']:>7.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['max_ms']:>8.1f} {r['lock_errors']:>7}  ({r['rows']:,} archived)")
+
+
+FETCH_QUERIES = [
+    ('customers', 'SELECT * FROM CRM_Customers'),
+    ('billing', 'SELECT Date, InvoiceID, InvoiceCode, PaymentID, FullAmount, PaymentAmount, OutstandingAmount '
+                'FROM CRM_Billing WHERE InvoiceCode IS NOT NULL ORDER BY InvoiceCode'),
+    ('tasks', 'SELECT wp.*, s.ServiceType, s.CustomerID FROM WorkProgress wp '
+              'JOIN CRM_Services s ON wp.ServiceID = s.ServiceID'),
+]
+
+
+def bench_fetch(iterations):
+    """
+    Large reads through pd.read_sql_query against app.read_frame (fetchmany
+    batches into Arrow), plain and with FRAME_DTYPES applied (read_sql_query +
+    compact_frame against read_frame typing in Arrow). Peak memory adds
+    Arrow's allocations to tracemalloc's, since Arrow-backed columns
+    (strings, categoricals) don't go through Python's allocator.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import app
+
+    def measure_arrow(fn):
+        latencies, traced_mb, df = measure(fn, iterations)
+        default_pool = pa.default_memory_pool()
+        pool = pa.proxy_memory_pool(default_pool)
+        pa.set_memory_pool(pool)
+        try:
+            tracemalloc.start()
+            fn()
+            traced_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        finally:
+            pa.set_memory_pool(default_pool)
+        return latencies, traced_mb + pool.max_memory() / (1024 * 1024), df
+
+    results = []
+    conn = app.get_connection()
+    try:
+        for name, sql in FETCH_QUERIES:
+            paths = [
+                ("pandas", lambda: pd.read_sql_query(sql, conn)),
+                ("columnar", lambda: app.read_frame(sql, conn)),
+                ("pandas+compact", lambda: app.compact_frame(pd.read_sql_query(sql, conn))),
+                ("columnar typed", lambda: app.read_frame(sql, conn, dtypes=app.FRAME_DTYPES)),
+            ]
+            for label, fn in paths:
+                latencies, peak_mb, df = measure_arrow(fn)
+                frame_mb = round(df.memory_usage(deep=True).sum() / (1024 * 1024), 2)
+                results.append(summarize(f"{name}: {label}", latencies, peak_mb, rows=len(df), frame_mb=frame_mb))
+    finally:
+        conn.close()
+    return results
+
+
+def print_table(title, results):
+    print(f"\n{title}")
+    print(f"  {'name':<26} {'p50 ms':>10} {'p95 ms':>10} {'peak MB':>10}")
+    for r in results:
+        note = ""
+        if r.get('rows') is not None:
+            note = f"  ({r['rows']:,} rows)"
+        if r.get('frame_mb') is not None:
+            note = f"  ({r['rows']:,} rows, frame {r['frame_mb']:.2f} MB)"
+        if r.get('errors'):
+            note = f"  ⚠️ {r['errors'][0][:60]}"
+        print(f"  {r['name']:<26} {r['p50_ms']:>10.1f} {r['p95_ms']:>10.1f} {r['peak_mb']:>10.1f}{note}")
+
+
+def print_round_trips(title, results):
+    print(f"\n{title}")
+    print(f"  {'name':<26} {'round trips':>12} {'connections':>12}")
+    for r in results:
+        note = f"  ⚠️ {r['errors'][0][:60]}" if r.get('errors') else ""
+        print(f"  {r['name']:<26} {r['round_trips']:>12} {r['connections']:>12}{note}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CRM data functions and page renders.")
+    parser.add_argument("--rows", type=int, default=1000, help="customers to seed when generating data")
+    parser.add_argument("--data", help="use an existing seed_data.py output directory instead of generating")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--skip-functions", action="store_true")
+    parser.add_argument("--rtt-ms", type=float, default=0,
+                        help="simulated network delay per CRM connection for the function benchmarks")
+    parser.add_argument("--skip-pages", action="store_true")
+    parser.add_argument("--skip-labels", action="store_true")
+    parser.add_argument("--skip-compact", action="store_true")
+    parser.add_argument("--label-sizes", default="250,500,1000,2000",
+                        help="comma-separated option counts for the selectbox label benchmark")
+    parser.add_argument("--document-mb", type=int, default=100,
+                        help="file size for the document store benchmark")
+    parser.add_argument("--skip-documents", action="store_true")
+    parser.add_argument("--skip-breaker", action="store_true")
+    parser.add_argument("--skip-rollups", action="store_true")
+    parser.add_argument("--skip-fetch", action="store_true")
+    parser.add_argument("--skip-notifications", action="store_true")
+    parser.add_argument("--skip-retention", action="store_true")
+    parser.add_argument("--skip-round-trips", action="store_true")
+    parser.add_argument("--without-indexes", action="store_true",
+                        help="run against a copy of the data without the catalog indexes")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    if args.data:
+        crm_path = os.path.join(args.data, "crm.db")
+        auth_path = os.path.join(args.data, "auth.db")
+    else:
+        crm_path, auth_path = seed_data.generate("bench_data", args.rows, args.seed)
+    if args.without_indexes:
+        crm_path, auth_path = strip_indexes(crm_path, auth_path)
+
+    # Must be set before app is imported or rendered
+    os.environ["CRM_BACKEND"] = "sqlite"
+    os.environ["CRM_SQLITE_PATH"] = os.path.abspath(crm_path)
+    os.environ["AUTH_DB_PATH"] = os.path.abspath(auth_path)
+
+    report = {'rows': args.rows if not args.data else None, 'iterations': args.iterations,
+              'indexes': not args.without_indexes}
+    if not args.skip_functions:
+        report['functions'] = bench_functions(args.iterations, rtt_ms=args.rtt_ms)
+        print_table("Data functions", report['functions'])
+    if not args.skip_compact:
+        report['compact'] = bench_compact(args.iterations)
+        print_table("Compact frames", report['compact'])
+    if not args.skip_labels:
+        sizes = [int(n) for n in args.label_sizes.split(",")]
+        report['labels'] = bench_labels(sizes, args.iterations)
+        print_table("Selectbox labels", report['labels'])
+    if not args.skip_documents:
+        report['documents'] = bench_documents(args.document_mb, args.iterations)
+        print_table("Document store", report['documents'])
+    if not args.skip_breaker:
+        report['breaker'] = bench_breaker(args.iterations)
+        print_table("SQL Server connect (fake driver)", report['breaker'])
+    if not args.skip_rollups:
+        report['rollups'] = bench_rollups(args.iterations)
+        print_table("Revenue rollups", report['rollups'])
+    if not args.skip_fetch:
+        report['fetch'] = bench_fetch(args.iterations)
+        print_table("Large reads: read_sql_query vs columnar read_frame", report['fetch'])
+    if not args.skip_notifications:
+        report['notifications'] = bench_notifications(args.iterations)
+        print_table("Notification rules", report['notifications'])
+    if not args.skip_retention:
+        report['retention'] = bench_retention()
+        print_retention("Notification retention: live session during the job", report['retention'])
+    if not args.skip_round_trips:
+        report['round_trips'] = bench_round_trips()
+        print_round_trips("CRM round trips per page render (warm)", report['round_trips'])
+    if not args.skip_pages:
+        report['pages'] = bench_pages(args.iterations)
+        print_table("Page renders (AppTest)", report['pages'])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Content-addressed file store for client documents.
+
+Files are stored once under their SHA-256 digest, so the same NDA uploaded
+for several customers takes the space of one copy. The database keeps only
+the digest against each DocumentID (CRM_DocumentFiles, see storage.py).
+
+    DOCUMENT_STORE_PATH=document_store   root directory of the store
+
+Layout: <root>/<ab>/<cd>/<digest>, fanned out on the first four hex digits
+so no directory grows past a few thousand entries. Uploads are streamed in
+CHUNK_SIZE pieces into <root>/tmp and renamed into place once hashed, so a
+reader never sees a partial file and memory stays at one chunk whatever the
+file size. Reads go through mmap.
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ContentStore:
+    """Files keyed by the SHA-256 of their contents."""
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, fileobj, chunk_size=CHUNK_SIZE):
+        """
+        Stream `fileobj` into the store. Returns (digest, size, stored), where
+        `stored` is False if identical content was already there.
+        """
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            digest = sha.hexdigest()
+            target = self.path(digest)
+            if os.path.exists(target):
+                return digest, size, False
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+            return digest, size, True
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @contextmanager
+    def open(self, digest):
+        """Read-only memory map of a stored file (b"" for empty files)."""
+        with open(self.path(digest), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def iter_chunks(self, digest, chunk_size=CHUNK_SIZE):
+        """Yield a stored file in `chunk_size` pieces."""
+        with self.open(digest) as mapped:
+            for offset in range(0, len(mapped), chunk_size):
+                yield mapped[offset:offset + chunk_size]
+
+    def read(self, digest):
+        """Whole file as bytes, copied once out of the memory map."""
+        with self.open(digest) as mapped:
+            return mapped[:]
+
+    def verify(self, digest):
+        """Re-hash a stored file chunk by chunk; True if it still matches its digest."""
+        sha = hashlib.sha256()
+        for chunk in self.iter_chunks(digest):
+            sha.update(chunk)
+        return sha.hexdigest() == digest
+
+
+def get_store(root=None):
+    return ContentStore(root or os.environ.get("DOCUMENT_STORE_PATH", "document_store"))
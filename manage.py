@@ -0,0 +1,388 @@
+"""
+Maintenance commands for the CRM databases.
+
+Runs against the same databases as the app: the CRM backend from
+CRM_BACKEND / CRM_SQLITE_PATH / CRM_SQL_* and auth.db from AUTH_DB_PATH
+(see storage.py).
+
+Usage:
+    python manage.py rebuild-progress        # recompute CRM_CustomerProgress from WorkProgress
+    python manage.py rebuild-ledger          # recompute invoice balances and statuses from payments
+    python manage.py verify-ledger           # list invoices whose balance disagrees with their payments
+    python manage.py refresh-rollups         # fold new payments into the revenue rollups
+    python manage.py refresh-rollups --rebuild   # recompute the revenue rollups from all payments
+    python manage.py refresh-rollups --rebuild --settle 0   # ... up to the newest payment (no writers running)
+    python manage.py notify                  # raise due-date and stale-approval notifications (cron)
+    python manage.py archive-notifications   # archive old read notifications, then incremental vacuum
+    python manage.py compact-auth            # one-off: switch auth.db to incremental vacuum (full VACUUM)
+    python manage.py migrate                 # apply pending index migrations (storage.MIGRATIONS)
+    python manage.py migrate --status        # list applied and pending migrations
+    python manage.py advise                  # check the index catalog against the app's queries
+    python manage.py delete-customers KH0000001 KH0000002
+    python manage.py delete-customers --file test_customers.txt   # one ID per line, - for stdin
+    python manage.py stress-ids --processes 8 --count 500000     # check the ID allocator for collisions
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+from array import array
+from datetime import datetime
+
+import app
+import storage
+
+
+def rebuild_progress(args):
+    started = time.perf_counter()
+    rows = app.rebuild_customer_progress()
+    print(f"Rebuilt CRM_CustomerProgress: {rows:,} customers in {time.perf_counter() - started:.1f}s ✅")
+    return 0
+
+
+def rebuild_ledger(args):
+    started = time.perf_counter()
+    corrected = app.rebuild_invoice_ledger()
+    print(f"Rebuilt invoice ledger: corrected {corrected:,} invoices in {time.perf_counter() - started:.1f}s ✅")
+    return 0
+
+
+def verify_ledger(args):
+    started = time.perf_counter()
+    mismatches = app.verify_invoice_ledger()
+    elapsed = time.perf_counter() - started
+    if mismatches.empty:
+        print(f"Invoice ledger matches payments ({elapsed:.1f}s) ✅")
+        return 0
+    print(mismatches.head(args.show).to_string(index=False))
+    print(f"❌ {len(mismatches):,} invoices disagree with their payments ({elapsed:.1f}s); "
+          f"run `python manage.py rebuild-ledger`")
+    return 1
+
+
+def refresh_rollups(args):
+    started = time.perf_counter()
+    folded = app.refresh_revenue_rollups(rebuild=args.rebuild, settle_seconds=args.settle)
+    action = "Rebuilt revenue rollups from" if args.rebuild else "Folded into revenue rollups:"
+    print(f"{action} {folded:,} payments in {time.perf_counter() - started:.1f}s ✅")
+    return 0
+
+
+def notify(args):
+    started = time.perf_counter()
+    today = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None
+    added = app.run_notification_rules(today)
+    print(", ".join(f"{rule}: +{count:,}" for rule, count in added.items())
+          + f" in {time.perf_counter() - started:.1f}s ✅")
+    return 0
+
+
+def archive_notifications(args):
+    started = time.perf_counter()
+    result = app.archive_notifications(days=args.days, archive_days=args.archive_days, batch_size=args.batch_size)
+    print(f"Archived {result['archived']:,} notifications, purged {result['purged']:,} archived ones, "
+          f"freed {result['vacuumed_pages']:,} pages in {time.perf_counter() - started:.1f}s ✅")
+    return 0
+
+
+def compact_auth(args):
+    """Switch auth.db to auto_vacuum=INCREMENTAL. The full VACUUM this needs locks auth.db while it runs."""
+    path = os.environ.get("AUTH_DB_PATH", "auth.db")
+    before = os.path.getsize(path)
+    auth_conn = app.get_auth_connection()
+    try:
+        if auth_conn.execute('PRAGMA auto_vacuum').fetchone()[0] == app.INCREMENTAL_VACUUM:
+            print("auth.db already uses incremental vacuum ✅")
+            return 0
+        auth_conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        auth_conn.execute('VACUUM')
+    finally:
+        auth_conn.close()
+    print(f"auth.db now uses incremental vacuum: {before / 1024:,.0f} KB -> {os.path.getsize(path) / 1024:,.0f} KB ✅")
+    return 0
+
+
+def migration_targets():
+    """(database, open connection, dialect) for the CRM backend and auth.db."""
+    return [
+        ('crm', app.get_connection(), storage.get_backend().dialect),
+        ('auth', app.get_auth_connection(), storage.SQLITE),
+    ]
+
+
+def run_migrate(args):
+    for database, conn, dialect in migration_targets():
+        try:
+            if args.status:
+                done = storage.applied_migrations(conn, dialect)
+                for version, target, description, names in storage.MIGRATIONS:
+                    if target == database:
+                        state = "applied" if version in done else "pending"
+                        print(f"{database:<5} {version:>3}  {state:<8} {description}")
+                continue
+            applied = storage.migrate(conn, dialect, database)
+            print(f"{database}: " + (f"applied {', '.join(map(str, applied))} ✅" if applied else "up to date ✅"))
+        finally:
+            conn.close()
+    return 0
+
+
+def delete_customers(args):
+    ids = list(args.ids)
+    if args.file:
+        source = sys.stdin if args.file == "-" else open(args.file)
+        with source:
+            ids += [line.strip() for line in source if line.strip()]
+    if not ids:
+        print("No customer IDs given")
+        return 1
+    started = time.perf_counter()
+    counts = app.delete_customers(ids)
+    for table, count in counts.items():
+        print(f"  {table:<22} {count:>10,} rows")
+    print(f"Deleted {counts.get('CRM_Customers', 0):,} of {len(set(ids)):,} customers "
+          f"in {time.perf_counter() - started:.1f}s ✅")
+    return 0
+
+
+STRESS_SEQUENCE = 'stress_test'
+
+
+def allocate_ids(count, block_size):
+    """Worker for stress-ids: `count` values from a fresh allocator, as packed int64 bytes."""
+    allocator = app.IdAllocator(app.get_connection, block_size)
+    return array('q', (allocator.next_value(STRESS_SEQUENCE) for _ in range(count))).tobytes()
+
+
+def stress_ids(args):
+    """
+    Allocate --count IDs in each of --processes processes against the CRM
+    database, each with its own allocator, and check that none repeat.
+    Uses a scratch sequence, removed afterwards.
+    """
+    conn = app.get_connection()
+    conn.cursor().execute('DELETE FROM CRM_Sequences WHERE Name = ?', (STRESS_SEQUENCE,))
+    conn.commit()
+    conn.close()
+
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.starmap(allocate_ids, [(args.count, args.block_size)] * args.processes)
+    elapsed = time.perf_counter() - started
+
+    seen = set()
+    total = 0
+    for packed in results:
+        values = array('q')
+        values.frombytes(packed)
+        total += len(values)
+        seen.update(values)
+
+    conn = app.get_connection()
+    conn.cursor().execute('DELETE FROM CRM_Sequences WHERE Name = ?', (STRESS_SEQUENCE,))
+    conn.commit()
+    conn.close()
+
+    blocks = total // args.block_size
+    print(f"{total:,} IDs from {args.processes} processes in {elapsed:.1f}s "
+          f"({blocks:,} block reservations, {total / elapsed:,.0f} IDs/s)")
+    if len(seen) != total:
+        print(f"❌ {total - len(seen):,} duplicate IDs")
+        return 1
+    print("No duplicates ✅")
+    return 0
+
+
+# ---------- Index advisor ----------
+# Runs the app's read paths (benchmark.data_functions plus the per-row
+# lookups) with every statement traced, then explains each one on the same
+# database. Reports which catalog indexes the plans use and which filtered
+# queries still scan a whole table. Tracing needs SQLite, so on SQL Server
+# the CRM side reads the server's own missing-index statistics instead.
+INDEX_USE = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def trace_connections(statements):
+    """Patch app's connection getters to record (database, sql) for every statement."""
+    for name, database in (('get_connection', 'crm'), ('get_auth_connection', 'auth')):
+        connect = getattr(app, name)
+
+        def traced(connect=connect, database=database):
+            conn = connect()
+            if hasattr(conn, 'set_trace_callback'):
+                conn.set_trace_callback(lambda sql: statements.append((database, sql)))
+            return conn
+
+        setattr(app, name, traced)
+
+
+def advisor_workload():
+    """Zero-argument callables covering the app's reads, as an admin and as an employee."""
+    import benchmark
+
+    auth_conn = app.get_auth_connection()
+    row = auth_conn.execute('''
+        SELECT u.id, u.name FROM users u JOIN customer_meta m ON m.assigned_to = u.id
+        WHERE u.role <> 'admin' GROUP BY u.id, u.name ORDER BY COUNT(*) DESC LIMIT 1
+    ''').fetchone()
+    auth_conn.close()
+    users = [benchmark.ADMIN_USER] + ([{'id': row[0], 'role': 'user', 'name': row[1]}] if row else [])
+
+    calls = [fn for user in users for _, fn in benchmark.data_functions(app, user)]
+    customers = app.get_customers_enhanced('ADMIN', 'admin')
+    services = app.get_all_services('ADMIN', 'admin')
+    if not customers.empty:
+        customer_id = customers['CustomerID'].iloc[0]
+        calls.append(lambda: app.get_services_by_customer(customer_id))
+        calls.append(lambda: app.load_details('customers', customers['CustomerID'].head(app.DETAIL_BATCH_SIZE).tolist()))
+    if not services.empty:
+        service_id = services['ServiceID'].iloc[0]
+        calls.append(lambda: app.get_invoices_by_service(service_id))
+        calls.append(lambda: app.load_details('services', services['ServiceID'].head(app.DETAIL_BATCH_SIZE).tolist()))
+    return calls
+
+
+def explain(conn, sql):
+    """SQLite query plan details for one statement."""
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+
+
+def sqlserver_missing_indexes(conn, limit=20):
+    """SQL Server's own missing-index suggestions for this database, most valuable first."""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT TOP {int(limit)} d.statement, d.equality_columns, d.inequality_columns,
+               d.included_columns, s.user_seeks, s.avg_user_impact
+        FROM sys.dm_db_missing_index_details d
+        JOIN sys.dm_db_missing_index_groups g ON d.index_handle = g.index_handle
+        JOIN sys.dm_db_missing_index_group_stats s ON g.index_group_handle = s.group_handle
+        WHERE d.database_id = DB_ID()
+        ORDER BY s.user_seeks * s.avg_user_impact DESC
+    ''')
+    return cursor.fetchall()
+
+
+def advise(args):
+    crm_traced = storage.get_backend().embedded
+    connect = {'crm': app.get_connection, 'auth': app.get_auth_connection}
+    calls = advisor_workload()
+    app.invalidate_snapshots()  # so the traced run reads from the database, not the shared caches
+    statements = []
+    trace_connections(statements)
+    for call in calls:
+        call()
+
+    queries = {}
+    for database, sql in statements:
+        sql = " ".join(sql.split())
+        if sql.upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE")) and (database == 'auth' or crm_traced):
+            queries.setdefault((database, sql), None)
+
+    used, scans = {}, []
+    conns = {database: connect[database]() for database in connect}
+    try:
+        for database, sql in queries:
+            plan = explain(conns[database], sql)
+            for detail in plan:
+                for name in INDEX_USE.findall(detail):
+                    used[name] = used.get(name, 0) + 1
+                scanned = FULL_SCAN.match(detail)
+                if scanned and " WHERE " in sql.upper():
+                    scans.append((database, scanned.group(1), sql))
+        missing = [] if crm_traced else sqlserver_missing_indexes(conns['crm'])
+    finally:
+        for conn in conns.values():
+            conn.close()
+
+    print(f"Explained {len(queries):,} distinct statements from {len(statements):,} executed")
+    print("\nCatalog indexes")
+    for database, catalog in storage.INDEX_CATALOGS.items():
+        if database == 'crm' and not crm_traced:
+            continue
+        for name, (table, columns) in catalog.items():
+            mark = f"✅ used by {used[name]} statements" if name in used else "⚪ not used by this workload"
+            print(f"  {database:<5} {name:<36} {mark}")
+
+    print("\nFiltered queries scanning a whole table")
+    for database, table, sql in scans:
+        print(f"  ⚠️ {database:<5} SCAN {table:<12} {sql[:110]}")
+    if not scans:
+        print("  none ✅")
+
+    if not crm_traced:
+        print("\nSQL Server missing-index suggestions (sys.dm_db_missing_index_details)")
+        for statement, equality, inequality, included, seeks, impact in missing:
+            print(f"  {statement}: = {equality or '-'}  range {inequality or '-'}  include {included or '-'}"
+                  f"  ({seeks:,} seeks, {impact:.0f}% impact)")
+        if not missing:
+            print("  none ✅")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CRM maintenance commands.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = commands.add_parser("rebuild-progress",
+                                  help="recompute the per-customer task aggregates from WorkProgress")
+    rebuild.set_defaults(func=rebuild_progress)
+
+    ledger = commands.add_parser("rebuild-ledger",
+                                 help="recompute every invoice's outstanding balance and status from its payments")
+    ledger.set_defaults(func=rebuild_ledger)
+
+    verify = commands.add_parser("verify-ledger", help="list invoices whose balance disagrees with their payments")
+    verify.add_argument("--show", type=int, default=20, help="mismatches to print")
+    verify.set_defaults(func=verify_ledger)
+
+    rollups = commands.add_parser("refresh-rollups", help="fold payments added since the last refresh into the revenue rollups")
+    rollups.add_argument("--rebuild", action="store_true", help="recompute the rollups from all payments")
+    rollups.add_argument("--settle", type=float,
+                         help=f"seconds a payment ID must have been seen before it is folded in "
+                              f"(default {app.ROLLUP_SETTLE_SECONDS:g}; 0 only while nothing writes payments)")
+    rollups.set_defaults(func=refresh_rollups)
+
+    notifications = commands.add_parser("notify", help="run the notification rules (due invoices/services, stale approvals)")
+    notifications.add_argument("--date", help="evaluate as of this day (YYYY-MM-DD) instead of today")
+    notifications.set_defaults(func=notify)
+
+    archive = commands.add_parser("archive-notifications",
+                                  help="move old read notifications to the archive and vacuum auth.db incrementally")
+    archive.add_argument("--days", type=int, help=f"archive read notifications older than this "
+                                                  f"(default {app.NOTIFICATION_RETENTION_DAYS})")
+    archive.add_argument("--archive-days", type=int, help=f"drop archived notifications older than this, 0 keeps them "
+                                                          f"(default {app.NOTIFICATION_ARCHIVE_DAYS})")
+    archive.add_argument("--batch-size", type=int, help=f"rows per transaction (default {app.ARCHIVE_BATCH_SIZE})")
+    archive.set_defaults(func=archive_notifications)
+
+    compact = commands.add_parser("compact-auth", help="switch auth.db to incremental vacuum (one full VACUUM)")
+    compact.set_defaults(func=compact_auth)
+
+    migrate = commands.add_parser("migrate", help="apply pending index migrations to the CRM database and auth.db")
+    migrate.add_argument("--status", action="store_true", help="list migrations without applying them")
+    migrate.set_defaults(func=run_migrate)
+
+    advisor = commands.add_parser("advise", help="check the index catalog against the queries the app issues")
+    advisor.set_defaults(func=advise)
+
+    delete = commands.add_parser("delete-customers",
+                                 help="delete customers and all their dependent rows in both databases")
+    delete.add_argument("ids", nargs="*", help="customer IDs")
+    delete.add_argument("--file", help="read more IDs from this file, one per line (- for stdin)")
+    delete.set_defaults(func=delete_customers)
+
+    stress = commands.add_parser("stress-ids", help="allocate IDs from several processes and check for duplicates")
+    stress.add_argument("--processes", type=int, default=4)
+    stress.add_argument("--count", type=int, default=250000, help="IDs per process")
+    stress.add_argument("--block-size", type=int, default=app.ID_BLOCK_SIZE)
+    stress.set_defaults(func=stress_ids)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""
+Synthetic data generator for the CRM.
+
+Builds the CRM schema (storage.CRM_TABLES) in a local SQLite file plus a
+matching auth.db, so the app and the benchmark suite can run without the
+production server.
+
+Usage:
+    python seed_data.py --rows 10000 --out bench_data
+    CRM_BACKEND=sqlite CRM_SQLITE_PATH=bench_data/crm.db AUTH_DB_PATH=bench_data/auth.db streamlit run app.py
+
+Every seeded login uses the password "bench123".
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+import uuid
+from datetime import date, timedelta
+
+import bcrypt
+
+import storage
+
+# Rows per table relative to --rows (the customer count).
+TABLE_RATIOS = {
+    'CRM_Services': 2,
+    'CRM_Payments': 3,
+    'CRM_Billing': 3,
+    'WorkProgress': 4,
+    'ClientDocuments': 1,
+}
+
+GROUPS = ['Sliner Group', 'FDI', 'Startup', 'SME', 'Enterprise', 'Individual', 'Partner Referral']
+COUNTRIES = ['Vietnam', 'United States', 'Singapore', 'Hong Kong', 'Japan']
+CATEGORIES = [('I', 'Cá nhân'), ('H', 'Hộ kinh doanh'), ('C', 'Doanh nghiệp')]
+INDUSTRIES = ['Manufacturing', 'Retail', 'Software', 'Logistics', 'F&B', 'Real Estate', 'Education']
+SOURCES = ['Website', 'Referral', 'Partner', 'Event', 'Cold Call']
+SERVICE_TYPES = ['Company Formation', 'Accounting', 'Tax Filing', 'Payroll', 'Work Permit',
+                 'Trademark', 'Audit', 'License Amendment']
+SERVICE_STATUSES = ['Chưa bắt đầu', 'Đang thực hiện', 'Hoàn thành', 'Tạm dừng']
+TASK_STATUSES = ['Chưa bắt đầu', 'Đang thực hiện', 'Hoàn thành']
+DOCUMENT_TYPES = ['NDA', 'Invoice', 'Payment Receipt', 'Contract', 'Proposal', 'Report', 'Other']
+DOCUMENT_STATUSES = ['Đang xử lý', 'Đã ký', 'Đã gửi', 'Đã nhận', 'Hủy bỏ']
+CURRENCIES = ['VND', 'USD', 'EUR', 'SGD', 'HKD', 'JPY']
+PAYMENT_TYPES = ['Bank Transfer', 'Cash', 'Credit Card']
+
+SEED_PASSWORD = "bench123"
+BATCH_SIZE = 10000
+
+
+def _batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(conn, table, columns, rows):
+    placeholders = ", ".join("?" for _ in columns)
+    column_list = ", ".join(storage.SQLITE.quote(c) for c in columns)
+    sql = f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})"
+    count = 0
+    for batch in _batched(rows):
+        conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def _day(rng, start=date(2020, 1, 1), span=2000):
+    return (start + timedelta(days=rng.randrange(span))).isoformat()
+
+
+def generate_crm(conn, rows, seed=42):
+    """Populate the CRM stand-in. Returns {table: row_count}."""
+    rng = random.Random(seed)
+    storage.ensure_schema(conn, storage.SQLITE, indexes={})  # indexes are built after the bulk load
+
+    user_count = max(5, rows // 1000)
+    user_ids = [f"NV{i:04d}" for i in range(1, user_count + 1)]
+    counts = {}
+
+    counts['CRM_Users'] = _insert(conn, 'CRM_Users', ['UserID', 'Name', 'Email', 'Role'], (
+        (uid, f"Employee {uid}", f"{uid.lower()}@company.com", 'employee') for uid in user_ids
+    ))
+    counts['CRM_ServiceCatalog'] = _insert(conn, 'CRM_ServiceCatalog', ['ServiceType', 'Description'], (
+        (t, f"{t} service") for t in SERVICE_TYPES
+    ))
+
+    customer_ids = [f"KH{i:07d}" for i in range(1, rows + 1)]
+
+    def customers():
+        for cid in customer_ids:
+            code, company_type = rng.choice(CATEGORIES)
+            has_second = rng.random() < 0.3
+            yield (
+                cid, f"Company {cid}", f"{rng.randrange(10**9, 10**10)}", rng.choice(GROUPS),
+                f"{rng.randrange(1, 999)} Street {rng.randrange(1, 50)}", rng.choice(COUNTRIES), code,
+                company_type, f"Contact {cid}", f"contact@{cid.lower()}.com", f"09{rng.randrange(10**8):08d}",
+                f"Second {cid}" if has_second else None,
+                f"second@{cid.lower()}.com" if has_second else None,
+                f"08{rng.randrange(10**8):08d}" if has_second else None,
+                rng.choice(INDUSTRIES), rng.choice(SOURCES), _day(rng), rng.choice(user_ids), None,
+            )
+
+    counts['CRM_Customers'] = _insert(conn, 'CRM_Customers', [
+        'CustomerID', 'CompanyName', 'TaxCode', 'Group', 'Address', 'Country', 'CustomerCategory',
+        'CompanyType', 'ContactPerson1', 'ContactEmail1', 'ContactPhone1',
+        'ContactPerson2', 'ContactEmail2', 'ContactPhone2', 'Industry', 'Source',
+        'CreatedDate', 'AccountManager', 'AnnualRevenueSize',
+    ], customers())
+
+    service_count = rows * TABLE_RATIOS['CRM_Services']
+    service_ids = [f"DV{i:08d}" for i in range(1, service_count + 1)]
+    service_customer = [rng.choice(customer_ids) for _ in service_ids]
+
+    def services():
+        for sid, cid in zip(service_ids, service_customer):
+            start = _day(rng)
+            end = (date.fromisoformat(start) + timedelta(days=rng.randrange(30, 365))).isoformat()
+            yield (sid, cid, rng.choice(SERVICE_TYPES), f"Service {sid} for {cid}", start, end,
+                   f"PKG{rng.randrange(100):03d}", rng.choice(['', 'Partner A', 'Partner B']),
+                   rng.choice(SERVICE_STATUSES), rng.choice(PAYMENT_TYPES))
+
+    counts['CRM_Services'] = _insert(conn, 'CRM_Services', [
+        'ServiceID', 'CustomerID', 'ServiceType', 'Description', 'StartDate', 'ExpectedEndDate',
+        'PackageCode', 'Partner', 'Status', 'PaymentType',
+    ], services())
+
+    payment_count = rows * TABLE_RATIOS['CRM_Payments']
+    invoice_rows = []
+
+    def payments():
+        for i in range(1, payment_count + 1):
+            idx = rng.randrange(service_count)
+            sid, cid = service_ids[idx], service_customer[idx]
+            invoice_id = f"INV{i:08d}"
+            invoice_code = f"CODE{i:08d}"
+            amount = round(rng.uniform(100, 20000), 2)
+            paid = round(amount * rng.choice([0, 0.5, 1]), 2)
+            currency = rng.choice(CURRENCIES)
+            invoice_date = _day(rng)
+            invoice_rows.append((invoice_code, sid))
+            yield (
+                i, invoice_code, invoice_id, sid, cid, invoice_date,
+                (date.fromisoformat(invoice_date) + timedelta(days=30)).isoformat(),
+                amount, amount, 'Paid' if paid == amount else 'Partially Paid' if paid else 'Pending', None, amount - paid,
+                _day(rng), rng.choice(['Deposit', 'Final', 'Installment']), paid, currency, 1.0,
+                f"Payer {cid}", f"ACC{rng.randrange(100):03d}", None, paid, rng.choice(PAYMENT_TYPES),
+            )
+
+    counts['CRM_Payments'] = _insert(conn, 'CRM_Payments', [
+        'PaymentID', 'InvoiceCode', 'InvoiceID', 'ServiceID', 'CustomerID', 'InvoiceDate', 'DueDate',
+        'AmountOriginal', 'AmountUSD', 'Status', 'Note', 'OutstandingUSD', 'PaymentDate',
+        'TypeOfPayment', 'PaidAmount', 'Currency', 'Exrate', 'PayerName', 'ReceivedAccount',
+        'Notes', 'PaidAmountUSD', 'PaymentType',
+    ], payments())
+    counts['CRM_Invoice'] = _insert(conn, 'CRM_Invoice', ['InvoiceCode', 'ServiceID'], invoice_rows)
+
+    def billing():
+        for i in range(1, rows * TABLE_RATIOS['CRM_Billing'] + 1):
+            full = round(rng.uniform(100, 20000), 2)
+            paid = round(full * rng.choice([0, 0.3, 0.5, 1]), 2)
+            yield (_day(rng), f"INV{i:08d}", f"CODE{i:08d}", i, full, paid, full - paid)
+
+    counts['CRM_Billing'] = _insert(conn, 'CRM_Billing', [
+        'Date', 'InvoiceID', 'InvoiceCode', 'PaymentID', 'FullAmount', 'PaymentAmount', 'OutstandingAmount',
+    ], billing())
+
+    def tasks():
+        for i in range(1, rows * TABLE_RATIOS['WorkProgress'] + 1):
+            start = _day(rng)
+            status = rng.choice(TASK_STATUSES)
+            progress = 100 if status == 'Hoàn thành' else (0 if status == 'Chưa bắt đầu' else rng.randrange(5, 95))
+            yield (f"CV{i:08d}", rng.choice(service_ids), f"Task {i}", f"Description for task {i}", start,
+                   (date.fromisoformat(start) + timedelta(days=rng.randrange(7, 120))).isoformat(),
+                   status, progress, rng.choice(user_ids), None, _day(rng))
+
+    counts['WorkProgress'] = _insert(conn, 'WorkProgress', [
+        'TaskID', 'ServiceID', 'TaskName', 'TaskDescription', 'StartDate', 'ExpectedEndDate',
+        'Status', 'Progress', 'UpdatedBy', 'Notes', 'LastUpdated',
+    ], tasks())
+
+    def documents():
+        for i in range(1, rows * TABLE_RATIOS['ClientDocuments'] + 1):
+            idx = rng.randrange(service_count)
+            yield (f"DOC{i:08d}", service_customer[idx], service_ids[idx], rng.choice(DOCUMENT_TYPES),
+                   f"Document {i}", rng.choice(user_ids), None, rng.choice(DOCUMENT_STATUSES), _day(rng))
+
+    counts['ClientDocuments'] = _insert(conn, 'ClientDocuments', [
+        'DocumentID', 'CustomerID', 'ServiceID', 'DocumentType', 'DocumentName',
+        'ResponsiblePerson', 'Notes', 'Status', 'CreatedDate',
+    ], documents())
+
+    conn.execute(storage.CUSTOMER_PROGRESS_REBUILD_SQL, ('Hoàn thành',))
+    conn.commit()
+    storage.migrate(conn, storage.SQLITE, 'crm')
+    return counts
+
+
+def generate_auth(auth_conn, crm_conn, seed=42):
+    """
+    Populate auth.db to match the CRM stand-in: one login per CRM_Users row
+    (same id), an admin, customer_meta for every customer and some notifications.
+    """
+    rng = random.Random(seed + 1)
+    import app  # same schema as an app-created auth.db
+    app.create_auth_schema(auth_conn)
+
+    # Low bcrypt cost: these are throwaway benchmark logins.
+    hashed = bcrypt.hashpw(SEED_PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds=4)).decode('utf-8')
+    users = crm_conn.execute('SELECT UserID, Name, Email FROM CRM_Users').fetchall()
+    counts = {}
+    counts['users'] = _insert(auth_conn, 'users', ['id', 'email', 'password_hash', 'role', 'name'],
+                              [('ADMIN', 'admin@company.com', hashed, 'admin', 'Admin User')] +
+                              [(uid, email, hashed, 'employee', name) for uid, name, email in users])
+
+    def meta():
+        for cid, manager in crm_conn.execute('SELECT CustomerID, AccountManager FROM CRM_Customers'):
+            yield (cid, manager, rng.choice(SERVICE_STATUSES), 1 if rng.random() < 0.95 else 0, 'ADMIN')
+
+    counts['customer_meta'] = _insert(auth_conn, 'customer_meta',
+                                      ['CustomerID', 'assigned_to', 'status', 'approved', 'created_by'], meta())
+
+    def notifications():
+        pending = auth_conn.execute('SELECT CustomerID FROM customer_meta WHERE approved = 0').fetchall()
+        for (cid,) in pending:
+            yield (str(uuid.UUID(int=rng.getrandbits(128))), None, f"New customer '{cid}' needs approval",
+                   'customer_approval', cid, 1 if rng.random() < 0.5 else 0)
+
+    counts['notifications'] = _insert(auth_conn, 'notifications',
+                                      ['id', 'user_id', 'message', 'type', 'related_id', 'read'],
+                                      list(notifications()))
+    auth_conn.commit()
+    storage.migrate(auth_conn, storage.SQLITE, 'auth')
+    return counts
+
+
+def generate(out_dir, rows, seed=42):
+    """Create <out_dir>/crm.db and <out_dir>/auth.db from scratch. Returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    crm_path = os.path.join(out_dir, "crm.db")
+    auth_path = os.path.join(out_dir, "auth.db")
+    for path in (crm_path, auth_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    started = time.perf_counter()
+    crm_conn = sqlite3.connect(crm_path)
+    auth_conn = sqlite3.connect(auth_path)
+    # Must precede WAL, which writes the header of the new file (see app.create_auth_schema)
+    auth_conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    for conn in (crm_conn, auth_conn):
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+    try:
+        counts = generate_crm(crm_conn, rows, seed)
+        counts.update(generate_auth(auth_conn, crm_conn, seed))
+    finally:
+        crm_conn.close()
+        auth_conn.close()
+
+    for table, count in counts.items():
+        print(f"  {table:<20} {count:>10,} rows")
+    print(f"Seeded {crm_path} and {auth_path} in {time.perf_counter() - started:.1f}s ✅")
+    return crm_path, auth_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic CRM dataset in SQLite.")
+    parser.add_argument("--rows", type=int, default=1000,
+                        help="number of customers (1k to 1M); other tables scale from it")
+    parser.add_argument("--out", default="bench_data", help="output directory for crm.db and auth.db")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate(args.out, args.rows, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,736 @@
+"""
+Storage backends for the CRM database.
+
+The CRM tables normally live on the remote SQL Server. Branch offices and
+benchmarks can run the same schema in an embedded SQLite file instead.
+Select the backend with environment variables:
+
+    CRM_BACKEND=sqlserver            (default) remote SQL Server over ODBC
+    CRM_BACKEND=sqlite               embedded SQLite file
+    CRM_SQLITE_PATH=crm.db           file used by the sqlite backend
+
+SQL Server connects go through a CircuitBreaker and are bounded by:
+
+    CRM_LOGIN_TIMEOUT=5              seconds per connection string attempt
+    CRM_QUERY_TIMEOUT=30             seconds per query
+    CRM_BREAKER_FAILURES=2           failed connects in a row that open the circuit
+    CRM_BREAKER_PROBE_SECONDS=15     how often the open circuit probes for recovery
+
+Queries written against the DB-API connection use `?` placeholders on both
+backends. Anything that differs in syntax (identifier quoting, paging,
+DDL types) goes through the backend's Dialect.
+"""
+import abc
+import os
+import platform
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+# ---------- Dialects ----------
+def like_escape(text):
+    """Escape LIKE wildcards in user input, for patterns used with ESCAPE '\\'."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('[', '\\[')
+
+
+class Dialect(abc.ABC):
+    """SQL syntax that differs between backends."""
+
+    name = None
+    types = {}
+    # Can one execute() carry several statements and return their result
+    # sets one after another (cursor.nextset())?
+    multiple_result_sets = False
+
+    def quote(self, identifier):
+        return f'"{identifier}"'
+
+    def literal(self, value):
+        if value is None:
+            return "NULL"
+        if isinstance(value, (int, float)):
+            return str(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    def paginate(self, limit, offset=0):
+        """Suffix appended after ORDER BY to fetch one page of rows."""
+        return f" LIMIT {int(limit)} OFFSET {int(offset)}"
+
+    def column_sql(self, column):
+        name, col_type, options = column
+        parts = [self.quote(name), self.types[col_type]]
+        if options.get('not_null'):
+            parts.append("NOT NULL")
+        if options.get('default') is not None:
+            parts.append(f"DEFAULT {self.literal(options['default'])}")
+        return " ".join(parts)
+
+    def create_table_sql(self, table, columns):
+        body = ",\n    ".join(self.column_sql(c) for c in columns)
+        keys = [c[0] for c in columns if c[2].get('primary_key') and c[1] != 'serial']
+        if keys:
+            body += ",\n    PRIMARY KEY (" + ", ".join(self.quote(k) for k in keys) + ")"
+        return f"CREATE TABLE IF NOT EXISTS {table} (\n    {body}\n)"
+
+    def create_index_sql(self, name, table, columns):
+        cols = ", ".join(self.quote(c) for c in columns)
+        return f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})"
+
+    def drop_index_sql(self, name, table):
+        return f"DROP INDEX IF EXISTS {name}"
+
+    def temp_table(self, name):
+        """Name for a scratch table private to the connection."""
+        return f"temp.{name}"
+
+    def drop_temp_table_sql(self, table):
+        return f"DROP TABLE IF EXISTS {table}"
+
+    def month_sql(self, column):
+        """'YYYY-MM' of a date column."""
+        return f"substr({column}, 1, 7)"
+
+    def prefix_match(self, column, prefix):
+        """
+        Condition and params for `column` starting with `prefix`, as an index
+        range read. SQLite only uses an index for LIKE under a NOCASE column,
+        so this is a range up to the prefix with its last character bumped.
+        """
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return f"({column} >= ? AND {column} < ?)", [prefix, upper]
+
+    def contains_match(self, column, text):
+        """Condition and params for `column` containing `text` (a scan, so callers limit it)."""
+        return f"{column} LIKE ? ESCAPE '\\'", ['%' + like_escape(text) + '%']
+
+    def insert_missing_sql(self, table, columns, key, select_sql):
+        """
+        INSERT of select_sql's rows that skips keys already in `table`, so
+        two writers creating the same row don't fail on the primary key.
+        """
+        cols = ", ".join(columns)
+        return f"INSERT OR IGNORE INTO {table} ({cols})\n{select_sql}"
+
+    @abc.abstractmethod
+    def list_tables_sql(self):
+        """Query listing the database's tables, one TABLE_NAME column."""
+
+
+class SQLiteDialect(Dialect):
+    name = "sqlite"
+    types = {
+        'key': 'TEXT',
+        'text': 'TEXT',
+        'longtext': 'TEXT',
+        'int': 'INTEGER',
+        'real': 'REAL',
+        'date': 'DATE',
+        'timestamp': 'TIMESTAMP',
+        'serial': 'INTEGER PRIMARY KEY',
+    }
+
+    def list_tables_sql(self):
+        return "SELECT name AS TABLE_NAME FROM sqlite_master WHERE type = 'table' ORDER BY name"
+
+
+class SQLServerDialect(Dialect):
+    name = "sqlserver"
+    multiple_result_sets = True
+    types = {
+        'key': 'NVARCHAR(50)',
+        'text': 'NVARCHAR(255)',
+        'longtext': 'NVARCHAR(MAX)',
+        'int': 'INT',
+        'real': 'FLOAT',
+        'date': 'DATE',
+        'timestamp': 'DATETIME2',
+        'serial': 'INT IDENTITY(1,1) PRIMARY KEY',
+    }
+
+    def quote(self, identifier):
+        return f"[{identifier}]"
+
+    def literal(self, value):
+        if isinstance(value, str):
+            return "N" + super().literal(value)
+        return super().literal(value)
+
+    def paginate(self, limit, offset=0):
+        # Requires an ORDER BY in the statement
+        return f" OFFSET {int(offset)} ROWS FETCH NEXT {int(limit)} ROWS ONLY"
+
+    def create_table_sql(self, table, columns):
+        create = super().create_table_sql(table, columns).replace("CREATE TABLE IF NOT EXISTS", "CREATE TABLE", 1)
+        return f"IF OBJECT_ID(N'{table}', N'U') IS NULL\n{create}"
+
+    def create_index_sql(self, name, table, columns):
+        create = super().create_index_sql(name, table, columns).replace("CREATE INDEX IF NOT EXISTS", "CREATE INDEX", 1)
+        return (f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'{name}' "
+                f"AND object_id = OBJECT_ID(N'{table}'))\n{create}")
+
+    def drop_index_sql(self, name, table):
+        return f"DROP INDEX IF EXISTS {name} ON {table}"
+
+    def temp_table(self, name):
+        return f"#{name}"
+
+    def drop_temp_table_sql(self, table):
+        return f"IF OBJECT_ID(N'tempdb..{table}', N'U') IS NOT NULL DROP TABLE {table}"
+
+    def month_sql(self, column):
+        return f"CONVERT(CHAR(7), {column}, 120)"
+
+    def insert_missing_sql(self, table, columns, key, select_sql):
+        # UPDLOCK/HOLDLOCK keeps the key range locked from the check to the insert
+        cols = ", ".join(columns)
+        return (f"INSERT INTO {table} ({cols})\nSELECT {cols} FROM ({select_sql}) src\n"
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} WITH (UPDLOCK, HOLDLOCK) "
+                f"WHERE {table}.{key} = src.{key})")
+
+    def prefix_match(self, column, prefix):
+        # Sargable on SQL Server, and follows the column's collation
+        return f"{column} LIKE ? ESCAPE '\\'", [like_escape(prefix) + '%']
+
+    def list_tables_sql(self):
+        return """
+            SELECT TABLE_NAME
+            FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_TYPE = 'BASE TABLE'
+            ORDER BY TABLE_NAME
+        """
+
+
+SQLITE = SQLiteDialect()
+SQLSERVER = SQLServerDialect()
+
+
+# ---------- CRM schema ----------
+def col(name, col_type, primary_key=False, not_null=False, default=None, category=False):
+    """
+    One column definition. `category` marks low-cardinality text that loaders
+    keep as a pandas categorical (see frame_dtypes).
+    """
+    return (name, col_type, {'primary_key': primary_key, 'not_null': not_null, 'default': default,
+                             'category': category})
+
+
+CRM_TABLES = {
+    'CRM_Users': [
+        col('UserID', 'key', primary_key=True),
+        col('Name', 'text', not_null=True),
+        col('Email', 'text'),
+        col('Role', 'text', category=True),
+    ],
+    'CRM_Customers': [
+        col('CustomerID', 'key', primary_key=True),
+        col('CompanyName', 'text', not_null=True),
+        col('TaxCode', 'text'),
+        col('Group', 'text', category=True),
+        col('Address', 'longtext'),
+        col('Country', 'text', category=True),
+        col('CustomerCategory', 'text', category=True),
+        col('CompanyType', 'text', category=True),
+        col('ContactPerson1', 'text'),
+        col('ContactEmail1', 'text'),
+        col('ContactPhone1', 'text'),
+        col('ContactPerson2', 'text'),
+        col('ContactEmail2', 'text'),
+        col('ContactPhone2', 'text'),
+        col('Industry', 'text'),
+        col('Source', 'text', category=True),
+        col('CreatedDate', 'date'),
+        col('AccountManager', 'text', category=True),
+        col('AnnualRevenueSize', 'text'),
+    ],
+    'CRM_ServiceCatalog': [
+        col('ServiceType', 'text', primary_key=True),
+        col('Description', 'longtext'),
+    ],
+    'CRM_Services': [
+        col('ServiceID', 'key', primary_key=True),
+        col('CustomerID', 'key'),
+        col('ServiceType', 'text', category=True),
+        col('Description', 'longtext'),
+        col('StartDate', 'date'),
+        col('ExpectedEndDate', 'date'),
+        col('PackageCode', 'text'),
+        col('Partner', 'text', category=True),
+        col('Status', 'text', category=True),
+        col('PaymentType', 'text', category=True),
+    ],
+    'CRM_Invoice': [
+        col('InvoiceCode', 'key', primary_key=True),
+        col('ServiceID', 'key'),
+    ],
+    'CRM_Payments': [
+        col('PaymentID', 'serial', primary_key=True),
+        col('InvoiceCode', 'key'),
+        col('InvoiceID', 'key'),
+        col('ServiceID', 'key'),
+        col('CustomerID', 'key'),
+        col('InvoiceDate', 'date'),
+        col('DueDate', 'date'),
+        col('AmountOriginal', 'real'),
+        col('AmountUSD', 'real'),
+        col('Status', 'text', category=True),
+        col('Note', 'longtext'),
+        col('OutstandingUSD', 'real'),
+        col('PaymentDate', 'date'),
+        col('TypeOfPayment', 'text', category=True),
+        col('PaidAmount', 'real'),
+        col('Currency', 'text', category=True),
+        col('Exrate', 'real'),
+        col('PayerName', 'text'),
+        col('ReceivedAccount', 'text'),
+        col('Notes', 'longtext'),
+        col('PaidAmountUSD', 'real'),
+        col('PaymentType', 'text', category=True),
+    ],
+    'CRM_Billing': [
+        col('Date', 'date'),
+        col('InvoiceID', 'key'),
+        col('InvoiceCode', 'key'),
+        col('PaymentID', 'int'),
+        col('FullAmount', 'real'),
+        col('PaymentAmount', 'real'),
+        col('OutstandingAmount', 'real'),
+    ],
+    'WorkProgress': [
+        col('TaskID', 'key', primary_key=True),
+        col('ServiceID', 'key'),
+        col('TaskName', 'text'),
+        col('TaskDescription', 'longtext'),
+        col('StartDate', 'date'),
+        col('ExpectedEndDate', 'date'),
+        col('Status', 'text', default='Chưa bắt đầu', category=True),
+        col('Progress', 'int', default=0),
+        col('UpdatedBy', 'key', category=True),
+        col('Notes', 'longtext'),
+        col('LastUpdated', 'date'),
+    ],
+    'ClientDocuments': [
+        col('DocumentID', 'key', primary_key=True),
+        col('CustomerID', 'key'),
+        col('ServiceID', 'key'),
+        col('DocumentType', 'text', category=True),
+        col('DocumentName', 'text'),
+        col('ResponsiblePerson', 'key', category=True),
+        col('Notes', 'longtext'),
+        col('Status', 'text', default='Đang xử lý', category=True),
+        col('CreatedDate', 'date'),
+    ],
+    # Uploaded file behind a document: SHA-256 of the contents in the local
+    # content-addressed store (filestore.py); documents may share a hash
+    'CRM_DocumentFiles': [
+        col('DocumentID', 'key', primary_key=True),
+        col('ContentHash', 'text', not_null=True),  # 64 hex digits, longer than a 'key'
+        col('FileName', 'text'),
+        col('ContentType', 'text'),
+        col('FileSize', 'int'),
+        col('UploadedDate', 'date'),
+    ],
+    # hi/lo ID allocation: next unreserved number per sequence (app.IdAllocator)
+    'CRM_Sequences': [
+        col('Name', 'key', primary_key=True),
+        col('NextValue', 'int', not_null=True),
+    ],
+    # Derived: per-customer task totals, kept current by the app on every task
+    # write and rebuilt from WorkProgress by CUSTOMER_PROGRESS_REBUILD_SQL
+    'CRM_CustomerProgress': [
+        col('CustomerID', 'key', primary_key=True),
+        col('TotalTasks', 'int', not_null=True, default=0),
+        col('CompletedTasks', 'int', not_null=True, default=0),
+        col('ProgressSum', 'int', not_null=True, default=0),
+    ],
+    # Derived: paid revenue per month x customer group x country x service type
+    # x account manager, folded in from new payments past a watermark
+    'CRM_RevenueRollup': [
+        col('RollupID', 'serial', primary_key=True),
+        col('Month', 'key', not_null=True),
+        col('CustomerGroup', 'text', not_null=True),
+        col('Country', 'text', not_null=True),
+        col('ServiceType', 'text', not_null=True),
+        col('AccountManager', 'text', not_null=True),
+        col('RevenueUSD', 'real', not_null=True, default=0),
+        col('Payments', 'int', not_null=True, default=0),
+    ],
+    # Incremental jobs: highest source row ID already processed
+    'CRM_Watermarks': [
+        col('Name', 'key', primary_key=True),
+        col('LastID', 'int', not_null=True, default=0),
+        col('RefreshedAt', 'timestamp'),
+    ],
+}
+
+# Recomputes CRM_CustomerProgress from scratch; the parameter is the task
+# status that counts as completed. Run after clearing the table.
+CUSTOMER_PROGRESS_REBUILD_SQL = '''
+    INSERT INTO CRM_CustomerProgress (CustomerID, TotalTasks, CompletedTasks, ProgressSum)
+    SELECT s.CustomerID, COUNT(*),
+           SUM(CASE WHEN wp.Status = ? THEN 1 ELSE 0 END),
+           SUM(COALESCE(wp.Progress, 0))
+    FROM WorkProgress wp
+    JOIN CRM_Services s ON wp.ServiceID = s.ServiceID
+    GROUP BY s.CustomerID
+'''
+
+# Expected balance of each invoice (rows of CRM_Payments with AmountUSD) from
+# the PaidAmountUSD of every row carrying its InvoiceID, one IX_Payments_Invoice
+# lookup per invoice. Parameters: paid tolerance, then the paid / partially
+# paid / pending statuses, then any parameters of `{where}` (e.g.
+# "AND i.InvoiceID = ?", or empty for all invoices).
+INVOICE_LEDGER_SQL = '''
+    SELECT InvoiceID, AmountUSD - PaidUSD AS OutstandingUSD,
+           CASE WHEN AmountUSD - PaidUSD <= ? THEN ? WHEN PaidUSD > 0 THEN ? ELSE ? END AS Status
+    FROM (
+        SELECT i.InvoiceID, i.AmountUSD,
+               COALESCE((SELECT SUM(p.PaidAmountUSD) FROM CRM_Payments p WHERE p.InvoiceID = i.InvoiceID), 0) AS PaidUSD
+        FROM CRM_Payments i
+        WHERE i.AmountUSD IS NOT NULL AND i.InvoiceID IS NOT NULL {where}
+    ) ledger
+'''
+
+
+# ---------- Index catalog & migrations ----------
+# Secondary indexes: name -> (table, columns). Applied to existing databases
+# by MIGRATIONS below; `python manage.py advise` checks them against the
+# queries the app issues.
+CRM_INDEXES = {
+    # Task board: one status column per service set, ordered by due date
+    'IX_WorkProgress_Service_Status_Due': ('WorkProgress', ['ServiceID', 'Status', 'ExpectedEndDate']),
+    # Task board for admins (all services) and per-status counts; TaskID
+    # completes the board's ORDER BY so pages are read in index order
+    'IX_WorkProgress_Status_Due': ('WorkProgress', ['Status', 'ExpectedEndDate', 'TaskID']),
+    # Overdue detection: one range scan on the due date
+    'IX_WorkProgress_Due': ('WorkProgress', ['ExpectedEndDate', 'Status']),
+    # Documents sharing a stored file (the store is keyed by hash)
+    'IX_DocumentFiles_Hash': ('CRM_DocumentFiles', ['ContentHash']),
+    # Per-customer and per-service lookups (service/invoice pickers, details,
+    # customer deletion)
+    'IX_Services_Customer': ('CRM_Services', ['CustomerID']),
+    'IX_Payments_Invoice': ('CRM_Payments', ['InvoiceID']),
+    'IX_Payments_Service': ('CRM_Payments', ['ServiceID']),
+    'IX_Payments_Customer': ('CRM_Payments', ['CustomerID']),
+    'IX_ClientDocuments_Customer': ('ClientDocuments', ['CustomerID']),
+    # Type-ahead pickers: company name prefix
+    'IX_Customers_CompanyName': ('CRM_Customers', ['CompanyName']),
+    # Revenue report month ranges and the rollup refresh's row matching
+    'IX_RevenueRollup_Month': ('CRM_RevenueRollup', ['Month']),
+    # Notification rules: invoices and services coming due, one range scan each
+    'IX_Payments_Due': ('CRM_Payments', ['DueDate', 'Status']),
+    'IX_Services_Due': ('CRM_Services', ['ExpectedEndDate', 'Status']),
+}
+
+# auth.db (always SQLite; its tables are created by app.init_auth_database)
+AUTH_INDEXES = {
+    # Non-admin customer lists and the user-deletion unassign
+    'IX_customer_meta_assigned': ('customer_meta', ['assigned_to', 'approved']),
+    # Pending approvals
+    'IX_customer_meta_approved': ('customer_meta', ['approved']),
+    # Mark-read on approval and customer deletion
+    'IX_notifications_related': ('notifications', ['related_id', 'type']),
+    # Per-user feed and unread badge
+    'IX_notifications_user_read': ('notifications', ['user_id', 'read']),
+    # Retention: read notifications past the cutoff, oldest first
+    'IX_notifications_read_created': ('notifications', ['read', 'created_at']),
+}
+
+INDEX_CATALOGS = {'crm': CRM_INDEXES, 'auth': AUTH_INDEXES}
+
+# Versioned schema changes: (version, database, description, index names).
+# Append only; each database records the versions it has applied in
+# schema_migrations, so a migration runs once per database.
+MIGRATIONS = [
+    (1, 'crm', "Task board and overdue indexes",
+     ['IX_WorkProgress_Service_Status_Due', 'IX_WorkProgress_Status_Due', 'IX_WorkProgress_Due']),
+    (2, 'crm', "Document file hash index", ['IX_DocumentFiles_Hash']),
+    (3, 'crm', "Customer, service and invoice lookups",
+     ['IX_Services_Customer', 'IX_Payments_Invoice', 'IX_Payments_Service', 'IX_Payments_Customer',
+      'IX_ClientDocuments_Customer']),
+    (4, 'auth', "customer_meta and notifications lookups",
+     ['IX_customer_meta_assigned', 'IX_customer_meta_approved', 'IX_notifications_related',
+      'IX_notifications_user_read']),
+    (5, 'crm', "Company name prefix search", ['IX_Customers_CompanyName']),
+    (6, 'crm', "Revenue rollup months", ['IX_RevenueRollup_Month']),
+    (7, 'crm', "Invoice and service due dates", ['IX_Payments_Due', 'IX_Services_Due']),
+    (8, 'auth', "Notification retention", ['IX_notifications_read_created']),
+]
+
+MIGRATIONS_TABLE = [
+    col('Version', 'int', primary_key=True),
+    col('Description', 'text'),
+    col('AppliedAt', 'timestamp'),
+]
+
+
+# pandas dtypes for loader output, by generic column type
+FRAME_TYPES = {
+    'int': 'Int32',
+}
+
+
+def frame_dtypes(tables=CRM_TABLES):
+    """
+    {column name: pandas dtype} derived from the schema: categorical for
+    columns flagged `category`, nullable integers for int columns.
+    """
+    dtypes = {}
+    for columns in tables.values():
+        for name, col_type, options in columns:
+            if options.get('category'):
+                dtypes[name] = 'category'
+            elif col_type in FRAME_TYPES:
+                dtypes.setdefault(name, FRAME_TYPES[col_type])
+    return dtypes
+
+
+def ensure_schema(conn, dialect, tables=CRM_TABLES, indexes=CRM_INDEXES):
+    """Create any missing tables in `tables` and indexes in `indexes` on an open connection."""
+    cursor = conn.cursor()
+    for table, columns in tables.items():
+        cursor.execute(dialect.create_table_sql(table, columns))
+    conn.commit()
+    ensure_indexes(conn, dialect, {name: index for name, index in indexes.items() if index[0] in tables})
+
+
+def ensure_indexes(conn, dialect, indexes=CRM_INDEXES):
+    """Create any missing indexes in `indexes` on an open connection."""
+    cursor = conn.cursor()
+    for name, (table, columns) in indexes.items():
+        cursor.execute(dialect.create_index_sql(name, table, columns))
+    conn.commit()
+
+
+def applied_migrations(conn, dialect):
+    """Versions recorded in this database's schema_migrations table."""
+    cursor = conn.cursor()
+    cursor.execute(dialect.create_table_sql('schema_migrations', MIGRATIONS_TABLE))
+    conn.commit()
+    cursor.execute('SELECT Version FROM schema_migrations')
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn, dialect, database='crm', migrations=MIGRATIONS):
+    """
+    Apply the pending MIGRATIONS for `database` ('crm' or 'auth') in version
+    order, committing each with its schema_migrations row. Returns the
+    versions applied.
+    """
+    catalog = INDEX_CATALOGS[database]
+    done = applied_migrations(conn, dialect)
+    cursor = conn.cursor()
+    applied = []
+    for version, target, description, names in sorted(migrations):
+        if target != database or version in done:
+            continue
+        for name in names:
+            table, columns = catalog[name]
+            cursor.execute(dialect.create_index_sql(name, table, columns))
+        cursor.execute('INSERT INTO schema_migrations (Version, Description, AppliedAt) VALUES (?, ?, ?)',
+                       (version, description, datetime.now()))
+        conn.commit()
+        applied.append(version)
+    return applied
+
+
+# ---------- Circuit breaker ----------
+LOGIN_TIMEOUT = int(os.environ.get("CRM_LOGIN_TIMEOUT", "5"))
+QUERY_TIMEOUT = int(os.environ.get("CRM_QUERY_TIMEOUT", "30"))
+BREAKER_FAILURES = int(os.environ.get("CRM_BREAKER_FAILURES", "2"))
+BREAKER_PROBE_SECONDS = float(os.environ.get("CRM_BREAKER_PROBE_SECONDS", "15"))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of connecting while the CRM database is marked unavailable."""
+
+
+class CircuitBreaker:
+    """
+    Fails connects fast while the server is down. After `failures` failed
+    connects in a row the circuit opens: connect() raises CircuitOpenError
+    without touching the network, and a background thread retries every
+    `probe_interval` seconds until one succeeds and closes it again.
+    """
+
+    def __init__(self, connect, failures=BREAKER_FAILURES, probe_interval=BREAKER_PROBE_SECONDS):
+        self._connect = connect
+        self.failures = failures
+        self.probe_interval = probe_interval
+        self.opened_at = None
+        self.last_error = None
+        self._failed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def connect(self):
+        if self.is_open:
+            raise CircuitOpenError(f"CRM database unavailable: {self.last_error}")
+        try:
+            conn = self._connect()
+        except Exception as e:
+            self._record_failure(e)
+            raise
+        with self._lock:
+            self._failed = 0
+        return conn
+
+    def _record_failure(self, error):
+        with self._lock:
+            self._failed += 1
+            self.last_error = error
+            if self._failed < self.failures or self.is_open:
+                return
+            self.opened_at = time.time()
+        print(f"⚠️ CRM circuit open after {self._failed} failed connects, probing every {self.probe_interval:g}s")
+        threading.Thread(target=self._probe, name="crm-circuit-probe", daemon=True).start()
+
+    def _probe(self):
+        while True:
+            time.sleep(self.probe_interval)
+            try:
+                self._connect().close()
+            except Exception as e:
+                self.last_error = e
+                continue
+            with self._lock:
+                self._failed = 0
+                self.opened_at = None
+            print("✅ CRM database reachable again, circuit closed")
+            return
+
+
+# ---------- Backends ----------
+class SQLServerBackend:
+    """
+    Remote SQL Server reached through pyodbc (or any DB-API `driver` with the
+    same connect(conn_str, timeout=...) signature and Error class).
+    """
+
+    name = "sqlserver"
+    dialect = SQLSERVER
+    embedded = False
+
+    def __init__(self, server, port, database, username, password, driver=None,
+                 login_timeout=LOGIN_TIMEOUT, query_timeout=QUERY_TIMEOUT, breaker_options=None):
+        self.server = server
+        self.port = port
+        self.database = database
+        self.username = username
+        self.password = password
+        self.login_timeout = login_timeout
+        self.query_timeout = query_timeout
+        self._driver = driver
+        self._working_conn_str = None
+        self.breaker = CircuitBreaker(self._open, **(breaker_options or {}))
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            import pyodbc  # only needed for this backend
+            self._driver = pyodbc
+        return self._driver
+
+    def connection_strings(self):
+        server, port, database = self.server, self.port, self.database
+        username, password = self.username, self.password
+
+        # For Mac/Windows (local development)
+        if platform.system() in ['Darwin', 'Windows']:
+            return [
+                f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password}",
+                f"DRIVER={{ODBC Driver 18 for SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password}",
+                f"DRIVER={{SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password}"
+            ]
+
+        # For Linux (Render deployment)
+        return [
+            f"DRIVER={{FreeTDS}};SERVER={server};PORT={port};DATABASE={database};UID={username};PWD={password};TDS_Version=8.0",
+            f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server},{port};DATABASE={database};UID={username};PWD={password}",
+            f"SERVER={server},{port};DATABASE={database};UID={username};PWD={password}"
+        ]
+
+    def connect(self):
+        """Create and return a SQL Server connection; fails fast while the circuit is open."""
+        return self.breaker.connect()
+
+    def _open(self):
+        """
+        Try each connection string, the last one that worked first, each bounded
+        by login_timeout. Connections get query_timeout on every statement.
+        """
+        driver = self.driver
+        connection_attempts = self.connection_strings()
+        if self._working_conn_str in connection_attempts:
+            connection_attempts.remove(self._working_conn_str)
+            connection_attempts.insert(0, self._working_conn_str)
+
+        for conn_str in connection_attempts:
+            try:
+                conn = driver.connect(conn_str, timeout=self.login_timeout)
+                conn.timeout = self.query_timeout
+                if conn_str != self._working_conn_str:
+                    print(f"✅ Connected with: {conn_str.split(';')[0]}")
+                    self._working_conn_str = conn_str
+                return conn
+            except driver.Error as e:
+                print(f"❌ Failed: {conn_str.split(';')[0]}: {e}")
+                continue
+
+        raise Exception(f"Could not connect to database. Tried {len(connection_attempts)} different approaches.")
+
+
+class SQLiteBackend:
+    """Embedded SQLite file holding the same CRM schema, for offline/edge use."""
+
+    name = "sqlite"
+    dialect = SQLITE
+    embedded = True
+
+    def __init__(self, path):
+        self.path = path
+        self._schema_ready = False
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        if not self._schema_ready:
+            ensure_schema(conn, self.dialect, indexes={})
+            migrate(conn, self.dialect)
+            self._schema_ready = True
+        return conn
+
+
+_backends = {}
+
+
+def backend_config():
+    """Read the backend selection from the environment."""
+    sqlite_path = os.environ.get("CRM_SQLITE_PATH")
+    kind = os.environ.get("CRM_BACKEND") or ("sqlite" if sqlite_path else "sqlserver")
+    if kind == "sqlite":
+        return ("sqlite", sqlite_path or "crm.db")
+    if kind == "sqlserver":
+        return (
+            "sqlserver",
+            os.environ.get("CRM_SQL_SERVER", "14.224.227.37"),
+            os.environ.get("CRM_SQL_PORT", "1434"),
+            os.environ.get("CRM_SQL_DATABASE", "SlinerNB"),
+            os.environ.get("CRM_SQL_USER", "SlinerOwner"),
+            os.environ.get("CRM_SQL_PASSWORD", "Sliner!19870310"),
+        )
+    raise ValueError(f"Unknown CRM_BACKEND '{kind}' (expected 'sqlserver' or 'sqlite')")
+
+
+def get_backend():
+    """Return the configured backend (one instance per configuration)."""
+    config = backend_config()
+    if config not in _backends:
+        if config[0] == "sqlite":
+            _backends[config] = SQLiteBackend(config[1])
+        else:
+            _backends[config] = SQLServerBackend(*config[1:])
+    return _backends[config]
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def crm(tmp_path, monkeypatch):
+    """The app on scratch SQLite CRM and auth databases under tmp_path."""
+    monkeypatch.setenv("CRM_BACKEND", "sqlite")
+    monkeypatch.setenv("CRM_SQLITE_PATH", str(tmp_path / "crm.db"))
+    monkeypatch.setenv("AUTH_DB_PATH", str(tmp_path / "auth.db"))
+    monkeypatch.setenv("DOCUMENT_STORE_PATH", str(tmp_path / "document_store"))
+
+    import app
+    app.get_id_allocator.clear()
+    app.init_auth_database()
+    return app
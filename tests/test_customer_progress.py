@@ -0,0 +1,56 @@
+class RacingCursor:
+    """Cursor whose first UPDATE misses, with another writer creating the row just after it."""
+
+    def __init__(self, cursor, on_miss):
+        self.cursor = cursor
+        self.on_miss = on_miss
+        self.missed = False
+        self.rowcount = -1
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(sql, params)
+        self.rowcount = self.cursor.rowcount
+        if not self.missed and sql.lstrip().startswith('UPDATE'):
+            self.missed = True
+            self.rowcount = 0
+            self.on_miss()
+        return self
+
+
+def progress_row(app, customer_id):
+    conn = app.get_connection()
+    try:
+        return conn.execute("SELECT TotalTasks, CompletedTasks, ProgressSum FROM CRM_CustomerProgress "
+                            "WHERE CustomerID = ?", (customer_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_concurrent_first_task_write_adds_to_the_row_it_lost_to(crm):
+    conn = crm.get_connection()
+    conn.execute("INSERT INTO CRM_Services (ServiceID, CustomerID) VALUES ('DV0000001', 'KH0000001')")
+    conn.execute("INSERT INTO WorkProgress (TaskID, ServiceID, Status, Progress) "
+                 "VALUES ('CV0000001', 'DV0000001', 'Đang thực hiện', 40)")
+    cursor = conn.cursor()
+
+    def other_writer():
+        cursor.execute("INSERT INTO CRM_CustomerProgress (CustomerID, TotalTasks, CompletedTasks, ProgressSum) "
+                       "VALUES ('KH0000001', 5, 2, 300)")
+
+    crm.apply_progress_delta(RacingCursor(cursor, other_writer), 'KH0000001', tasks=1, progress=40)
+    conn.commit()
+    conn.close()
+
+    assert progress_row(crm, 'KH0000001') == (6, 2, 340)
+
+
+def test_first_task_write_counts_the_customer_from_source(crm):
+    conn = crm.get_connection()
+    conn.execute("INSERT INTO CRM_Services (ServiceID, CustomerID) VALUES ('DV0000001', 'KH0000001')")
+    conn.executemany("INSERT INTO WorkProgress (TaskID, ServiceID, Status, Progress) VALUES (?, 'DV0000001', ?, ?)",
+                     [('CV0000001', crm.TASK_DONE_STATUS, 100), ('CV0000002', 'Đang thực hiện', 30)])
+    crm.apply_progress_delta(conn.cursor(), 'KH0000001', tasks=1, progress=30)
+    conn.commit()
+    conn.close()
+
+    assert progress_row(crm, 'KH0000001') == (2, 1, 130)
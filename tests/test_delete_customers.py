@@ -0,0 +1,66 @@
+from datetime import date
+
+
+def count(app, sql, params=()):
+    conn = app.get_connection()
+    try:
+        return conn.execute(sql, params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def add_customer(app, customer_id):
+    conn = app.get_connection()
+    conn.execute("INSERT INTO CRM_Customers (CustomerID, CompanyName) VALUES (?, ?)",
+                 (customer_id, f"Company {customer_id}"))
+    conn.commit()
+    conn.close()
+
+
+def add_paid_invoice(app, customer_id):
+    """A service and invoice for the customer, with a payment entered the way the payment form does."""
+    service_id = app.add_service(customer_id, "Audit", "", date(2024, 1, 1), date(2024, 6, 30), "", "")
+    invoice_id = app.add_invoice(service_id, customer_id, 1000.0, "USD", date(2024, 2, 1))
+    app.add_payment(invoice_id, date(2024, 1, 15), "Transfer", 400.0, "USD", 1.0,
+                    "Payer", "ACC-1", "", "Partial")
+    return invoice_id
+
+
+def test_delete_customer_removes_payments_entered_through_the_form(crm):
+    add_customer(crm, "KH0000001")
+    add_customer(crm, "KH0000002")
+    deleted_invoice = add_paid_invoice(crm, "KH0000001")
+    kept_invoice = add_paid_invoice(crm, "KH0000002")
+    assert count(crm, "SELECT COUNT(*) FROM CRM_Payments WHERE InvoiceID = ? AND CustomerID IS NULL",
+                 (deleted_invoice,)) == 1
+
+    counts = crm.delete_customers(["KH0000001"])
+
+    assert counts['CRM_Customers'] == 1
+    assert counts['CRM_Payments'] == 2  # the invoice row and the form payment
+    assert count(crm, "SELECT COUNT(*) FROM CRM_Payments WHERE InvoiceID = ?", (deleted_invoice,)) == 0
+    assert count(crm, "SELECT COUNT(*) FROM CRM_Payments WHERE InvoiceID = ?", (kept_invoice,)) == 2
+    assert count(crm, "SELECT COUNT(*) FROM CRM_Services WHERE CustomerID = ?", ("KH0000001",)) == 0
+
+
+
+def test_delete_customer_removes_its_rule_notifications(crm):
+    add_customer(crm, "KH0000001")
+    add_customer(crm, "KH0000002")
+    today = date(2024, 1, 25)
+    for customer_id in ("KH0000001", "KH0000002"):
+        # Invoice due 2024-02-01 and service ending 2024-01-30: both within NOTIFY_DUE_DAYS
+        service_id = crm.add_service(customer_id, "Audit", "", date(2024, 1, 1), date(2024, 1, 30), "", "")
+        crm.add_invoice(service_id, customer_id, 1000.0, "USD", date(2024, 2, 1))
+    assert crm.run_notification_rules(today) == {'invoice_due': 2, 'service_due': 2, 'approval_stale': 0}
+
+    crm.delete_customers(["KH0000001"])
+
+    auth = crm.get_auth_connection()
+    try:
+        remaining = auth.execute("SELECT type, COUNT(*) FROM notifications GROUP BY type").fetchall()
+        keys = auth.execute("SELECT customer_id FROM notification_keys").fetchall()
+    finally:
+        auth.close()
+    assert dict(remaining) == {'invoice_due': 1, 'service_due': 1}
+    assert keys == [("KH0000002",), ("KH0000002",)]
@@ -0,0 +1,13 @@
+def test_new_sequence_starts_past_the_highest_numeric_id(crm):
+    conn = crm.get_connection()
+    conn.executemany("INSERT INTO CRM_Services (ServiceID, CustomerID) VALUES (?, 'KH0000001')",
+                     [("DV00000009",), ("DV000000010",), ("DV-OLD",), ("DVX0000099",), ("DV0000001a",)])
+    conn.commit()
+    conn.close()
+
+    assert crm.next_id('service') == "DV00000011"
+    assert crm.next_id('service') == "DV00000012"
+
+
+def test_new_sequence_on_an_empty_table_starts_at_one(crm):
+    assert crm.next_id('task') == "CV00000001"
@@ -0,0 +1,18 @@
+import storage
+
+
+def test_approved_customer_ids_inlines_sqlite_literals_for_auth_db(crm, monkeypatch):
+    """Long IN lists run against auth.db use SQLite literals even with a SQL Server CRM backend."""
+    backend = crm.get_backend()
+    monkeypatch.setattr(backend, 'dialect', storage.SQLSERVER)
+    monkeypatch.setattr(crm, 'MAX_SQL_PARAMS', 2)
+    conn = crm.get_auth_connection()
+    conn.executemany("INSERT INTO customer_meta (CustomerID, approved) VALUES (?, ?)",
+                     [("KH0000001", 1), ("KH0000002", 0), ("KH0000003", 1)])
+    conn.commit()
+    conn.close()
+
+    ids = ["KH0000001", "KH0000002", "KH0000003", "KH0000004"]
+    assert crm.approved_customer_ids(ids) == {"KH0000001", "KH0000003"}
+    condition, params = crm.in_clause('CustomerID', ids, storage.SQLITE)
+    assert "N'" not in condition and params == []
@@ -0,0 +1,62 @@
+class BatchCursor:
+    """
+    Stands in for a pyodbc cursor: records the statements and params of each
+    execute() and returns one single-row result set per statement.
+    """
+
+    def __init__(self, executes):
+        self.executes = executes
+        self.description = None
+        self._sets = 0
+
+    def execute(self, sql, params=()):
+        statements = [part for part in sql.split(";\n") if part.strip() != "SET NOCOUNT ON"]
+        self.executes.append((len(statements), len(params)))
+        self._sets = len(statements)
+        self.description = [('Value',)]
+
+    def fetchall(self):
+        return [(len(self.executes),)]
+
+    def nextset(self):
+        self._sets -= 1
+        return self._sets > 0
+
+
+class BatchConnection:
+    def __init__(self):
+        self.executes = []
+
+    def cursor(self):
+        return BatchCursor(self.executes)
+
+
+def sql_server(crm, monkeypatch):
+    """Make query_batch take its SQL Server (multi-statement batch) path."""
+    dialect = crm.get_backend().dialect
+    monkeypatch.setattr(dialect, 'multiple_result_sets', True)
+
+
+def test_query_batch_splits_batches_at_the_parameter_limit(crm, monkeypatch):
+    sql_server(crm, monkeypatch)
+    conn = BatchConnection()
+    scope = list(range(450))
+    statements = {f"s{i}": ("SELECT COUNT(*) FROM WorkProgress WHERE ServiceID IN (...) AND Status = ? AND x = ?",
+                            scope + [i, i]) for i in range(5)}
+
+    frames = crm.query_batch(statements, conn)
+
+    assert list(frames) == list(statements)
+    assert conn.executes == [(4, 1808), (1, 452)]
+    assert all(params <= crm.MAX_SQL_PARAMS for _, params in conn.executes)
+    assert frames['s3']['Value'].iloc[0] == 1 and frames['s4']['Value'].iloc[0] == 2
+
+
+def test_query_batch_sends_one_batch_when_under_the_limit(crm, monkeypatch):
+    sql_server(crm, monkeypatch)
+    conn = BatchConnection()
+
+    frames = crm.query_batch({f"s{i}": ("SELECT ?", [i]) for i in range(5)}, conn)
+
+    assert len(frames) == 5
+    assert conn.executes == [(5, 5)]
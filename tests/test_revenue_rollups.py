@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+
+def add_payments(app, payment_ids):
+    conn = app.get_connection()
+    conn.executemany("INSERT INTO CRM_Payments (PaymentID, PaymentDate, PaidAmountUSD) VALUES (?, '2024-03-05', 100.0)",
+                     [(payment_id,) for payment_id in payment_ids])
+    conn.commit()
+    conn.close()
+
+
+def settle(app):
+    """Age the recorded high-water mark past ROLLUP_SETTLE_SECONDS."""
+    conn = app.get_connection()
+    conn.execute("UPDATE CRM_Watermarks SET RefreshedAt = ? WHERE Name = ?",
+                 (datetime.now() - timedelta(seconds=app.ROLLUP_SETTLE_SECONDS + 1), app.ROLLUP_SEEN))
+    conn.commit()
+    conn.close()
+
+
+def rolled_up_payments(app):
+    conn = app.get_connection()
+    try:
+        return conn.execute("SELECT COALESCE(SUM(Payments), 0) FROM CRM_RevenueRollup").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_payment_committed_after_a_higher_id_is_still_folded_in(crm):
+    # Payment 3 has its ID but its transaction is still open
+    add_payments(crm, [1, 2, 4])
+    assert crm.refresh_revenue_rollups() == 0  # 4 is only seen, not settled
+
+    add_payments(crm, [3])  # commits after 4
+    settle(crm)
+    assert crm.refresh_revenue_rollups() == 4
+    assert rolled_up_payments(crm) == 4
+
+
+def test_refresh_folds_nothing_until_the_seen_mark_settles(crm):
+    add_payments(crm, [1, 2])
+    assert crm.refresh_revenue_rollups() == 0
+    add_payments(crm, [3])
+    assert crm.refresh_revenue_rollups() == 0  # mark 2 not settled yet, and not moved on
+
+    settle(crm)
+    assert crm.refresh_revenue_rollups() == 2  # up to the settled mark; 3 starts the next period
+    settle(crm)
+    assert crm.refresh_revenue_rollups() == 1
+    assert rolled_up_payments(crm) == 3